@@ -45,7 +45,7 @@ from langchain_experimental.agents.agent_toolkits.pandas.prompt import (
     SUFFIX_WITH_DF,
     SUFFIX_WITH_MULTI_DF,
 )
-from langchain_experimental.tools.python.tool import PythonAstREPLTool
+from python_repl import PythonAstREPLTool
 
 
 def _get_multi_prompt(
@@ -0,0 +1,171 @@
+"""
+Cached agents and a bounded pool for their runs.
+
+Building a pandas agent renders the head of every DataFrame into its prompt and recreates its tools, so agents are
+kept per (session, dataset set) in an LRU and only built again when the session's datasets change. The variables of
+a cached agent's REPL are reset to fresh copies of the DataFrames before every run, so a DataFrame reassigned by the
+code of a run is not seen by the next ones. Runs are awaited (`ainvoke`) or streamed (`astream_events`), at most
+AGENT_CONCURRENCY at a time; the others queue, up to AGENT_MAX_QUEUE. The counters of `metrics()` are served by
+GET /agent-metrics, "completed" counts the runs that succeeded and "failed" the others.
+"""
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Tuple
+
+import pandas as pd
+from fastapi.concurrency import run_in_threadpool
+
+from python_repl import PythonAstREPLTool
+
+AGENT_CACHE_SIZE = int(os.getenv("AGENT_CACHE_SIZE", "64"))
+AGENT_CONCURRENCY = int(os.getenv("AGENT_CONCURRENCY", "8"))
+AGENT_MAX_QUEUE = int(os.getenv("AGENT_MAX_QUEUE", "64"))
+
+
+class AgentQueueFull(Exception):
+    pass
+
+
+def dataset_set_hash(dataset_ids: Dict[str, str]) -> str:
+    """Hash of the DataFrame names and dataset ids of a session"""
+    return hashlib.sha256(repr(sorted(dataset_ids.items())).encode()).hexdigest()
+
+
+class AgentPool:
+    def __init__(self, max_agents: int = AGENT_CACHE_SIZE, concurrency: int = AGENT_CONCURRENCY,
+                 max_queue: int = AGENT_MAX_QUEUE):
+        self.max_agents = max_agents
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self._agents: "OrderedDict[Tuple[str, str], Any]" = OrderedDict()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._counters = {"cache_hits": 0, "cache_misses": 0, "queued": 0, "running": 0, "completed": 0,
+                          "failed": 0, "rejected": 0, "wait_seconds": 0.0, "run_seconds": 0.0, "max_wait_seconds": 0.0,
+                          "streams": 0, "first_byte_seconds": 0.0, "max_first_byte_seconds": 0.0,
+                          "first_tokens": 0, "first_token_seconds": 0.0, "max_first_token_seconds": 0.0}
+
+    async def get(self, session_id: str, dataset_ids: Dict[str, str], dataframes: Dict[str, pd.DataFrame],
+                  build: Callable[[Dict[str, pd.DataFrame]], Any]):
+        """
+        The agent of the session for its datasets, built in the thread pool by `build(dataframes)` when not cached,
+        otherwise with the REPL variables reset to `dataframes`.
+
+        Runs of a session are serialized by its session lock, so one agent (and its REPL) is never used by two runs
+        at once.
+        """
+        key = (session_id, dataset_set_hash(dataset_ids))
+        agent_executor = self._agents.get(key)
+        if agent_executor is not None:
+            self._counters["cache_hits"] += 1
+            self._agents.move_to_end(key)
+            for tool in agent_executor.tools:
+                if isinstance(tool, PythonAstREPLTool):
+                    tool.globals, tool.locals = {}, dict(dataframes)
+            return agent_executor
+
+        self._counters["cache_misses"] += 1
+        agent_executor = await run_in_threadpool(build, dataframes)
+        # the session's agents for its previous datasets are not used anymore
+        for stale_key in [cached_key for cached_key in self._agents if cached_key[0] == session_id]:
+            del self._agents[stale_key]
+        self._agents[key] = agent_executor
+        while len(self._agents) > self.max_agents:
+            self._agents.popitem(last=False)
+        return agent_executor
+
+    @asynccontextmanager
+    async def _slot(self):
+        """
+        Hold one of the AGENT_CONCURRENCY slots, waiting for it in the queue.
+
+        Raises:
+            AgentQueueFull: AGENT_MAX_QUEUE runs are already waiting.
+        """
+        if self._counters["queued"] >= self.max_queue:
+            self._counters["rejected"] += 1
+            raise AgentQueueFull()
+
+        queued_at = time.monotonic()
+        self._counters["queued"] += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._counters["queued"] -= 1
+
+        started_at = time.monotonic()
+        wait = started_at - queued_at
+        self._counters["wait_seconds"] += wait
+        self._counters["max_wait_seconds"] = max(self._counters["max_wait_seconds"], wait)
+        self._counters["running"] += 1
+        try:
+            yield
+        except BaseException:
+            self._counters["failed"] += 1
+            raise
+        else:
+            self._counters["completed"] += 1
+        finally:
+            self._counters["running"] -= 1
+            self._counters["run_seconds"] += time.monotonic() - started_at
+            self._semaphore.release()
+
+    async def run(self, agent_executor, inputs: Dict[str, Any], **kwargs) -> Dict[str, Any]:
+        """Await the agent run once a slot is free (AgentQueueFull when the queue is full)"""
+        async with self._slot():
+            return await agent_executor.ainvoke(inputs, **kwargs)
+
+    async def stream(self, agent_executor, inputs: Dict[str, Any], **kwargs) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Stream the agent run once a slot is free (AgentQueueFull when the queue is full).
+
+        Yields:
+            ("token", text) for the LLM tokens, ("tool_start", {"tool", "input"}) and ("tool_end", {"tool", "input",
+            "output"}) around the tool calls, and last ("result", output of the agent).
+        """
+        async with self._slot():
+            async for event in agent_executor.astream_events(inputs, version="v2", **kwargs):
+                kind, data = event["event"], event["data"]
+                if kind == "on_chat_model_stream":
+                    text = data["chunk"].content
+                    if isinstance(text, str) and text:
+                        yield "token", text
+                elif kind == "on_tool_start":
+                    yield "tool_start", {"tool": event["name"], "input": data.get("input")}
+                elif kind == "on_tool_end":
+                    yield "tool_end", {"tool": event["name"], "input": data.get("input"),
+                                       "output": str(data.get("output"))}
+                elif kind == "on_chain_end" and not event["parent_ids"]:
+                    yield "result", data["output"]
+
+    def observe_stream(self, first_byte: float, first_token: Optional[float]):
+        """Record the seconds from a streamed request to its first event and to its first LLM token"""
+        self._counters["streams"] += 1
+        self._counters["first_byte_seconds"] += first_byte
+        self._counters["max_first_byte_seconds"] = max(self._counters["max_first_byte_seconds"], first_byte)
+        if first_token is not None:
+            self._counters["first_tokens"] += 1
+            self._counters["first_token_seconds"] += first_token
+            self._counters["max_first_token_seconds"] = max(self._counters["max_first_token_seconds"], first_token)
+
+    def metrics(self) -> Dict[str, Any]:
+        # every run that held a slot, for the mean times
+        finished = self._counters["completed"] + self._counters["failed"]
+        return {
+            **self._counters,
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+            "cached_agents": len(self._agents),
+            "mean_wait_seconds": self._counters["wait_seconds"] / finished if finished else 0.0,
+            "mean_run_seconds": self._counters["run_seconds"] / finished if finished else 0.0,
+            "mean_first_byte_seconds": (self._counters["first_byte_seconds"] / self._counters["streams"]
+                                        if self._counters["streams"] else 0.0),
+            "mean_first_token_seconds": (self._counters["first_token_seconds"] / self._counters["first_tokens"]
+                                         if self._counters["first_tokens"] else 0.0),
+        }
+
+
+agents = AgentPool()
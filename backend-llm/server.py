@@ -1,4 +1,5 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
@@ -20,22 +21,16 @@ from langchain_core.callbacks import BaseCallbackHandler
 from langchain_core.messages import AIMessage, HumanMessage
 from langchain.output_parsers import ResponseSchema, StructuredOutputParser
 from prompts import get_prompt_for_datasets
-import pandas as pd
-from io import StringIO
 from os import getenv
 from access_web import access_web
 from tools import query_clinical_trial_data,query_inclusion_exclusion_criteria
+from dataset_registry import DatasetNotFound, context_dataset_hash, dataset_info, register_dataset, resolve_context_datasets
+from session_store import SessionBusy, get_session_id, issue_session_id, sessions
+from agent_pool import AgentQueueFull, agents
+from streaming import sse_response
+import conversation_store
 
 
-
-
-# State to store agent steps and chat history
-app_state = {
-    "steps": [],
-    "chat_history": [],
-    "data":{}
-}
-
 class PoorPyHandler(BaseCallbackHandler):
     def on_tool_start(
         self, serialized: Dict[str, Any], input_str: str, **kwargs: Any
@@ -85,6 +80,9 @@ class ConversationToSave(BaseModel):
     dataSource: Optional[str] = None 
     contextVariables: Dict[str, Any]
 
+class DatasetUpload(BaseModel):
+    data: str
+
 class UpdateContextRequest(BaseModel):
     chat: List[Message]
     summary_prompt: str
@@ -103,7 +101,9 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Session-Id"],
 )
+app.middleware("http")(issue_session_id)
 
 
 # Redis connection for caching conversations
@@ -213,12 +213,15 @@ def get_html_file_urls(output_text):
 
 
 def generate_cache_key_for_summary(context_variables: Dict[str, Dict[str, str]], selected_ctx: List[str]) -> str:
+    """The key of the cached summary, it changes with the contexts' datasets (their hash, the CSV is not serialized)"""
     sorted_ctx_ids = sorted(selected_ctx)
-    filtered_context = {
-        ctx_id: {k: v for k, v in context_variables[ctx_id].items() if k != "data"}
-        for ctx_id in sorted_ctx_ids
-        if ctx_id in context_variables
-    }
+    filtered_context = {}
+    for ctx_id in sorted_ctx_ids:
+        if ctx_id in context_variables:
+            context = context_variables[ctx_id]
+            filtered_context[ctx_id] = {k: v for k, v in context.items() if k != "data"}
+            if context.get("dataset_id") or "data" in context:
+                filtered_context[ctx_id]["dataset_id"] = context_dataset_hash(context)
     serialized_data = json.dumps({
         "selected_ctx": sorted_ctx_ids,
         "context_variables": filtered_context
@@ -274,6 +277,11 @@ def get_agent_executor(data):
     return agent_executor
 
 
+def dataframe_dataset_ids(context_variables: Dict[str, Dict[str, Any]]) -> Dict[str, str]:
+    """The dataset id of each DataFrame ("{context}_df") of contexts resolved by resolve_context_datasets"""
+    return {f"{key}_df": value["dataset_id"] for key, value in context_variables.items() if "dataset_id" in value}
+
+
 def add_additional_topics_if_needed(response_object: dict, selected_ctx: str) -> dict:
     """Adds additional topics and questions based on specific IDs in selected_ctx."""
     additional_topics = {
@@ -303,55 +311,125 @@ def add_additional_topics_if_needed(response_object: dict, selected_ctx: str) ->
 ############################ Endpoints ##############################################
 
 
-@app.post("/summarise-text")
-async def summarise_text(request: summaryRequest, redis_conn: Redis = Depends(get_redis)):
-    cache_key = generate_cache_key_for_summary(request.contextVariables, request.selected_ctx)
+@app.post("/datasets")
+async def upload_dataset(dataset: DatasetUpload):
+    """Register a context dataset (CSV or TSV text) once, contexts then pass its "dataset_id" instead of "data" """
     try:
-        cached_response = redis_conn.get(cache_key)
-        dataframes = {}
-
-        for key, value in request.contextVariables.items():
-            df = pd.read_csv(StringIO(value["data"].strip()), sep="," if "," in value["data"] else "\t")
-            dataframe_name = f"{key}_df"
-            dataframes[dataframe_name] = df
+        dataset_id = await run_in_threadpool(register_dataset, dataset.data)
+        return await run_in_threadpool(dataset_info, dataset_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        print(dataframes)
 
-        app_state['data'] = dataframes
+@app.get("/datasets/{dataset_id}")
+async def get_dataset(dataset_id: str):
+    """Check whether a dataset is registered, so the frontend can skip uploading it again"""
+    try:
+        return await run_in_threadpool(dataset_info, dataset_id)
+    except DatasetNotFound:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+
+
+async def agent_events(agent_executor, inputs: Dict[str, Any], stream: bool):
+    """
+    The events of an agent run, last ("result", output of the agent). Not streamed, the run only yields its result.
+
+    Streamed, the HTML plots a tool call wrote are moved to 'static' and yielded as ("plot", {"url"}) when it ends.
+    """
+    if not stream:
+        yield "result", await agents.run(agent_executor, inputs)
+        return
+    plot_urls = set()
+    async for event, data in agents.stream(agent_executor, inputs):
+        yield event, data
+        if event == "tool_end":
+            for url in await run_in_threadpool(get_html_file_urls, f"{data['input']} {data['output']}"):
+                if url not in plot_urls:
+                    plot_urls.add(url)
+                    yield "plot", {"url": url}
+
+
+async def last_result(events) -> Any:
+    """The "result" of the events of a request, once all consumed"""
+    result = None
+    async for event, data in events:
+        if event == "result":
+            result = data
+    return result
+
+
+async def summary_events(request: summaryRequest, redis_conn: Redis, session_id: str, stream: bool):
+    # Contexts reference their dataset by id, CSVs still sent inline are registered once
+    context_variables, dataframes = await run_in_threadpool(resolve_context_datasets, request.contextVariables)
+    cache_key = generate_cache_key_for_summary(context_variables, request.selected_ctx)
+    cached_response = redis_conn.get(cache_key)
+
+    print({name: df.shape for name, df in dataframes.items()})
+
+    async with sessions.session(session_id, redis_conn) as state:
+        state.dataset_ids = dataframe_dataset_ids(context_variables)
         if cached_response:
-            cached_response = json.loads(cached_response)
+            response_object = json.loads(cached_response)
             # update llm context
-            app_state["chat_history"].append(HumanMessage(content=cached_response["summary_prompt"]))
-            app_state["chat_history"].append(AIMessage(content=json.dumps(cached_response["summary_text"])))
-            return cached_response
-
-        # If no cached response, generate summary
-        output_parser, format_instructions = get_format_instructions_for_summary()
-        messages=generate_prompt(request.selected_ctx, request.contextVariables)
-        summary_prompt=messages[0].content
-        messages[0].content += f"\n\n{format_instructions}"
-        agent_executor=get_agent_executor(app_state["data"])
-        response = agent_executor.invoke({"input": messages, "chat_history": app_state["chat_history"][-6:]})
-        response_as_dict = output_parser.parse(response["output"])
-        response_object = {
-            "summary_prompt":summary_prompt,
-            "summary_text": response_as_dict
-        }
-        response_object = add_additional_topics_if_needed(response_object, request.selected_ctx)
-        app_state["chat_history"].append(HumanMessage(content=response_object["summary_prompt"]))
-        app_state["chat_history"].append(AIMessage(content=json.dumps(response_object["summary_text"])))
+            state.chat_history.append(HumanMessage(content=response_object["summary_prompt"]))
+            state.chat_history.append(AIMessage(content=json.dumps(response_object["summary_text"])))
+        else:
+            # If no cached response, generate summary
+            output_parser, format_instructions = get_format_instructions_for_summary()
+            messages=generate_prompt(request.selected_ctx, context_variables)
+            summary_prompt=messages[0].content
+            messages[0].content += f"\n\n{format_instructions}"
+            agent_executor = await agents.get(session_id, state.dataset_ids, dataframes, get_agent_executor)
+            async for event, data in agent_events(agent_executor,
+                                                  {"input": messages, "chat_history": state.chat_history[-6:]}, stream):
+                if event == "result":
+                    response = data
+                else:
+                    yield event, data
+            response_as_dict = output_parser.parse(response["output"])
+            response_object = {
+                "summary_prompt":summary_prompt,
+                "summary_text": response_as_dict
+            }
+            response_object = add_additional_topics_if_needed(response_object, request.selected_ctx)
+            state.chat_history.append(HumanMessage(content=response_object["summary_prompt"]))
+            state.chat_history.append(AIMessage(content=json.dumps(response_object["summary_text"])))
+
+            # Cache the full response object
+            redis_conn.set(cache_key, json.dumps(response_object))
+
+    # yielded once the session is saved
+    yield "result", response_object
 
-        # Cache the full response object
-        redis_conn.set(cache_key, json.dumps(response_object))
 
-        return response_object
+@app.post("/summarise-text")
+async def summarise_text(request: summaryRequest, redis_conn: Redis = Depends(get_redis),
+                         session_id: str = Depends(get_session_id)):
+    try:
+        return await last_result(summary_events(request, redis_conn, session_id, stream=False))
+    except DatasetNotFound as e:
+        raise HTTPException(status_code=404, detail=f"Dataset not found: {e}")
+    except SessionBusy:
+        raise HTTPException(status_code=409, detail="The session is busy with another request")
+    except AgentQueueFull:
+        raise HTTPException(status_code=503, detail="Too many requests are waiting for the LLM, retry later")
+    except HTTPException:
+        raise
     except Exception as e:
         print(e)
         raise HTTPException(status_code=500, detail=f"Error fetching summary text: {str(e)}")
 
 
+@app.post("/summarise-text/stream")
+async def summarise_text_stream(request: summaryRequest, redis_conn: Redis = Depends(get_redis),
+                                session_id: str = Depends(get_session_id)):
+    """/summarise-text as server-sent events (see streaming.py)"""
+    return sse_response(summary_events(request, redis_conn, session_id, stream=True))
+
+
 @app.post("/update-context")
-async def update_context(data: UpdateContextRequest):
+async def update_context(data: UpdateContextRequest, redis_conn: Redis = Depends(get_redis),
+                         session_id: str = Depends(get_session_id)):
     try:
         # Combine inputs to form the updated chat history
         chat_history = []
@@ -364,49 +442,64 @@ async def update_context(data: UpdateContextRequest):
                 chat_history.append(HumanMessage(content=item.message))
             else:
                 chat_history.append(AIMessage(content=item.message["output"]))
-        app_state["chat_history"] = chat_history
-
-        dataframes = {}
-
-        for key, value in data.context_variables.items():
-            df = pd.read_csv(StringIO(value["data"].strip()), sep="," if "," in value["data"] else "\t")
-            
-            dataframe_name = f"{key}_df"
-            dataframes[dataframe_name] = df
+        context_variables, dataframes = await run_in_threadpool(resolve_context_datasets, data.context_variables)
 
-        app_state['data'] = dataframes
+        async with sessions.session(session_id, redis_conn) as state:
+            state.chat_history = chat_history
+            state.dataset_ids = dataframe_dataset_ids(context_variables)
 
-        print(app_state['data'])
+        print({name: df.shape for name, df in dataframes.items()})
             
 
         return {"message": "llm context updated successfully!!!"}
+    except DatasetNotFound as e:
+        raise HTTPException(status_code=404, detail=f"Dataset not found: {e}")
+    except SessionBusy:
+        raise HTTPException(status_code=409, detail="The session is busy with another request")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/generate-text")
-async def generate_text(request_body: RequestBody, redis_conn: Redis = Depends(get_redis)):
+async def generate_events(request_body: RequestBody, redis_conn: Redis, session_id: str, stream: bool):
     final_prompt = request_body.prompt
     #Clean up unnecessary tags from the prompt
     final_prompt = re.sub(r'\[\/?DATA\]|\[\/?RESPONSE_FORMAT\]', '', final_prompt)
     print(final_prompt)
     question=final_prompt
 
-    try:
-        print(app_state["chat_history"])
-        agent_executor=get_agent_executor(app_state['data'])
-        response = agent_executor.invoke({"input": question, "chat_history": app_state["chat_history"][-6:]})
+    async with sessions.session(session_id, redis_conn) as state:
+        print(state.chat_history)
+        dataframes = await run_in_threadpool(lambda: state.dataframes)
+        agent_executor = await agents.get(session_id, state.dataset_ids, dataframes, get_agent_executor)
+        async for event, data in agent_events(agent_executor,
+                                              {"input": question, "chat_history": state.chat_history[-6:]}, stream):
+            if event == "result":
+                response = data
+            else:
+                yield event, data
 
-        html_file_urls= get_html_file_urls(response["output"])
+        html_file_urls= await run_in_threadpool(get_html_file_urls, response["output"])
         # Append response to chat history
-        app_state["chat_history"].append(HumanMessage(content=final_prompt))
-        app_state["chat_history"].append(AIMessage(content=response["output"]))
+        state.chat_history.append(HumanMessage(content=final_prompt))
+        state.chat_history.append(AIMessage(content=response["output"]))
+
+    # yielded once the session is saved
+    yield "result", {
+        "output": response.get("output", "Default output if missing"),
+        # "intermediate_steps": response.get("intermediate_steps", []),
+        "svg_file_urls": html_file_urls
+    }
 
-        return {
-            "output": response.get("output", "Default output if missing"),
-            # "intermediate_steps": response.get("intermediate_steps", []),
-            "svg_file_urls": html_file_urls
-        }
+
+@app.post("/generate-text")
+async def generate_text(request_body: RequestBody, redis_conn: Redis = Depends(get_redis),
+                        session_id: str = Depends(get_session_id)):
+    try:
+        return await last_result(generate_events(request_body, redis_conn, session_id, stream=False))
+    except SessionBusy:
+        raise HTTPException(status_code=409, detail="The session is busy with another request")
+    except AgentQueueFull:
+        raise HTTPException(status_code=503, detail="Too many requests are waiting for the LLM, retry later")
     except Exception as e:
         print("Exception:", e)
         return {
@@ -415,14 +508,41 @@ async def generate_text(request_body: RequestBody, redis_conn: Redis = Depends(g
         }
 
 
+@app.post("/generate-text/stream")
+async def generate_text_stream(request_body: RequestBody, redis_conn: Redis = Depends(get_redis),
+                               session_id: str = Depends(get_session_id)):
+    """/generate-text as server-sent events (see streaming.py)"""
+    return sse_response(generate_events(request_body, redis_conn, session_id, stream=True),
+                        error_detail="Cannot handle your request at this time :)!")
+
+
+@app.get("/agent-metrics")
+async def agent_metrics():
+    return agents.metrics()
+
+
+def conversation_summary_key(conversation: Dict[str, Any]) -> str:
+    return generate_cache_key_for_summary(conversation["contextVariables"], conversation["selected_ctx"])
+
+
+@app.on_event("startup")
+async def index_saved_conversations():
+    # Conversations saved before they were indexed for listing
+    try:
+        indexed = await run_in_threadpool(conversation_store.index_conversations, get_redis(), conversation_summary_key)
+        if indexed:
+            print(f"Indexed {indexed} saved conversations")
+    except Exception as e:
+        print(f"Could not index the saved conversations: {e}")
+
 
 # Endpoint to save a conversation to Redis
 @app.post("/save_conversation")
 async def save_conversation(conversation: ConversationToSave, redis_conn: Redis = Depends(get_redis)):
     try:
-        conversation_key = f"conversation:{conversation.id}:{conversation.chat_name}"
-        
-        redis_conn.set(conversation_key, conversation.json())
+        conversation_data = conversation.dict()
+        summary_key = await run_in_threadpool(conversation_summary_key, conversation_data)
+        conversation_store.save_conversation(redis_conn, conversation_data, summary_key)
         
         return {"message": "Conversation saved successfully"}
     except Exception as e:
@@ -430,37 +550,43 @@ async def save_conversation(conversation: ConversationToSave, redis_conn: Redis
         raise HTTPException(status_code=500, detail=f"Error saving conversation: {str(e)}")
 
 
-# Endpoint to list all conversations from Redis
+# Endpoint to list the conversations, with their chat and summary, most recent first
 @app.get("/list_conversations")
 async def list_conversations(redis_conn: Redis = Depends(get_redis)):
     try:
-        cursor = '0'
-        conversations = []
-        while cursor != 0:
-            cursor, keys = redis_conn.scan(cursor=cursor, match="conversation:*")
-            for key in keys:
-                conversation_data = redis_conn.get(key)
-                if conversation_data:
-                    conversation = json.loads(conversation_data)
-                    
-                    selected_ctx = conversation["selected_ctx"]
-                    context_variables = conversation["contextVariables"]
-                    # print(selected_ctx, context_variables)
-                    cache_key = generate_cache_key_for_summary(context_variables, selected_ctx)
-
-                    cached_summary = redis_conn.get(cache_key)
-                    if cached_summary:
-                        cached_summary = json.loads(cached_summary)
-                        conversation["summaryPrompt"] = cached_summary.get("summary_prompt", "")
-                        conversation["summaryResponse"] = cached_summary.get("summary_text", "")
-
-                    conversations.append(conversation)
-
-        return conversations
+        return await run_in_threadpool(lambda: list(conversation_store.iter_conversations_with_summaries(
+            redis_conn, conversation_summary_key)))
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        raise HTTPException(status_code=500, detail="Error fetching conversations")
+
+
+# Endpoint to list the conversations (metadata only), most recent first, a page at a time
+@app.get("/list_conversations_page")
+async def list_conversations_page(cursor: Optional[str] = None, limit: int = Query(50, ge=1, le=500),
+                                  redis_conn: Redis = Depends(get_redis)):
+    try:
+        conversations, next_cursor = conversation_store.list_conversations(redis_conn, cursor, limit)
+        return {"conversations": conversations, "next_cursor": next_cursor}
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
     except Exception as e:
         print(f"An error occurred: {e}")
         raise HTTPException(status_code=500, detail="Error fetching conversations")
 
+
+# Endpoint to load a saved conversation, with its chat and summary
+@app.get("/load_conversation")
+async def load_conversation(id: str, chat_name: str, redis_conn: Redis = Depends(get_redis)):
+    try:
+        conversation = conversation_store.load_conversation(redis_conn, id, chat_name)
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        raise HTTPException(status_code=500, detail="Error fetching the conversation")
+    if conversation is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return conversation
+
     
 
 # Main entry to run the FastAPI app
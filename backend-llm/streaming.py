@@ -0,0 +1,75 @@
+"""
+Server-sent events for the streamed variants of the LLM endpoints (/summarise-text/stream, /generate-text/stream).
+
+Every event is `event: <name>` with a JSON `data:` line. A stream opens with "start" as soon as the request is
+received, then relays the events of the run ("token", "tool_start", "tool_end", "plot"), then "result" with the body
+the non-streamed endpoint returns, and closes with "done" (timings in seconds) or "error" ({"status", "detail"}).
+Clients cancel a run by closing the connection.
+"""
+import json
+import time
+from typing import Any, AsyncIterator, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from agent_pool import AgentQueueFull, agents
+from dataset_registry import DatasetNotFound
+from session_store import SessionBusy
+
+
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def error_status(e: Exception) -> Tuple[int, str]:
+    """The HTTP status and detail the non-streamed endpoints answer with for the exception"""
+    if isinstance(e, HTTPException):
+        return e.status_code, e.detail
+    if isinstance(e, DatasetNotFound):
+        return 404, f"Dataset not found: {e}"
+    if isinstance(e, SessionBusy):
+        return 409, "The session is busy with another request"
+    if isinstance(e, AgentQueueFull):
+        return 503, "Too many requests are waiting for the LLM, retry later"
+    return 500, str(e)
+
+
+def sse_response(events: AsyncIterator[Tuple[str, Any]], error_detail: Optional[str] = None) -> StreamingResponse:
+    """
+    Stream the (event, data) pairs as server-sent events.
+
+    The time to the first byte (the "start" event) and to the first LLM token are measured from the request, sent
+    with "done" and recorded in the agent metrics.
+
+    Args:
+        events: The events of the request, "result" included.
+        error_detail (str): Detail of the "error" event for unexpected exceptions, instead of the exception message.
+    """
+    requested_at = time.monotonic()
+
+    async def stream():
+        yield sse_event("start", {})
+        first_byte = time.monotonic() - requested_at
+        first_token = None
+        try:
+            async for event, data in events:
+                if event == "token" and first_token is None:
+                    first_token = time.monotonic() - requested_at
+                yield sse_event(event, data)
+        except Exception as e:
+            print(f"Streamed request failed: {e}")
+            status, detail = error_status(e)
+            if status == 500 and error_detail:
+                detail = error_detail
+            yield sse_event("error", {"status": status, "detail": detail})
+            return
+        finally:
+            agents.observe_stream(first_byte, first_token)
+        timings = {"first_byte_seconds": first_byte, "first_token_seconds": first_token,
+                   "total_seconds": time.monotonic() - requested_at}
+        print(f"Streamed request: {timings}")
+        yield sse_event("done", timings)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -1,10 +1,10 @@
 import os
 from urllib import response
-from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
-from dependencies import get_neo4j_driver
+from dependencies import get_neo4j_driver, close_neo4j_driver
 from collections import defaultdict
 from graphrag_service import get_graphrag_answer, fetch_text_chunks
 from component_services.disease_profile_services import (
@@ -44,7 +44,7 @@ from services import (
     # parse_safety_events,
 )
 from api_models import TargetRequest, GraphRequest, DiseaseRequest, SearchQueryModel, DiseasesRequest, SearchRequest, \
-    TargetOnlyRequest,ExcelExportRequest
+    TargetOnlyRequest,ExcelExportRequest,LocusZoomTilesRequest
 from utils import format_for_cytoscape, get_efo_id, find_disease_id_by_name, send_graphql_request, \
     save_response_to_file, load_response_from_file, calculate_expiry_date, add_years, save_big_response_to_file,get_associated_targets,get_mouse_phenotypes,fetch_all_publications,get_exact_synonyms,get_conver_later_strapi,get_target_indication_pairs_strapi,enrich_disease_pathway_results,add_pipeline_indication_records,fetch_nct_titles
 from dependencies import get_neo4j_driver
@@ -57,36 +57,43 @@ from component_services.market_intelligence_service import extract_nct_ids, fetc
 from component_services.evidence_services import build_query, get_geo_data_for_diseases,fetch_mouse_models,fetch_and_filter_figures_by_disease_and_pmids,fetch_mouse_model_data_alliancegenome,get_top_10_literature_helper,add_platform_name,add_study_type, get_mesh_term_for_disease
 
 from component_services.target_services import find_matching_screens_for_target,fetch_subcellular_locations
-from fastapi.testclient import TestClient
 from fastapi.security import OAuth2PasswordRequestForm
 from login_utils import create_access_token,authenticate_user,ACCESS_TOKEN_EXPIRE_MINUTES,get_current_user_role
 from fastapi import status
 from datetime import datetime, timedelta
 from component_services.evidence_services import search_pubmed,search_pubmed_target,fetch_literature_details_in_batches,get_network_biology_strapi
 from component_services.disease_profile_services import get_disease_description_strapi
-from component_services.excel_export import process_data_and_return_file_rna,process_pipeline_data,process_mouse_studies,process_patent_data,process_model_studies,process_target_pipeline,process_cover_letter_list_excel
 from fastapi.responses import FileResponse
 from cache_results import cache_all_data
 from component_services.genomics_services import fetch_pgs_data
-from component_services.entity_search_services import lexical_phenotype_search, get_db_connection
-import duckdb
-from duckdb import DuckDBPyConnection
+from component_services.entity_search_services import lexical_phenotype_search, get_db_connection, \
+    autocomplete_phenotypes, warm_autocomplete_index, AUTOCOMPLETE_MAX_LIMIT
 from component_services.gwas_services import get_gwas_studies
-from component_services.locus_zoom_services import load_data
+from component_services.genomics_mirror import query_gwas_studies, query_pgs_scores
+from component_services.locus_zoom_services import load_data, query_variant_tiles, TILE_BIN_SIZES
+from component_services.kg_subgraph_services import query_subgraphs, resolve_disease_ids, iter_metapath, new_graph, \
+    refresh_subgraph_store_periodically, SUBGRAPH_STORE_PATH, REFRESH_ENABLED as SUBGRAPH_REFRESH_ENABLED, \
+    REFRESH_INTERVAL as SUBGRAPH_REFRESH_INTERVAL
+from response_cache import conditional_cached_response
+from single_flight import single_flight, single_flight_key
+from export_cache import export_cache_key, get_cached_export, store_export
+from serialization import FastJSONResponse, redis_json, iter_ndjson
 from fastapi.staticfiles import StaticFiles
 from starlette.responses import FileResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import StreamingResponse
 from fastapi.responses import FileResponse
 import time
 import threading
+import itertools
 from threading import Lock
 import asyncio
 import httpx
+import inspect
 
 
 
-app = FastAPI()
-
-client = TestClient(app)
+app = FastAPI(default_response_class=FastJSONResponse)
 
 
 SERP_API_KEY: str = os.getenv('SERP_API_KEY')
@@ -113,6 +120,20 @@ app.mount("/gwas-data", StaticFiles(directory=GWAS_DATA_DIR), name="gwas-data")
 async def startup():
     # This will create the tables for all models defined with Base
     Base.metadata.create_all(bind=engine)
+    # the autocomplete index takes a few seconds to build, don't make the first keystroke wait for it
+    asyncio.create_task(run_in_threadpool(warm_autocomplete_index))
+    # one driver (and connection pool) to the knowledge graph for the whole application
+    driver = get_neo4j_driver()
+    if SUBGRAPH_REFRESH_ENABLED and SUBGRAPH_REFRESH_INTERVAL > 0:
+        app.state.subgraph_refresh = asyncio.create_task(refresh_subgraph_store_periodically(driver))
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    subgraph_refresh = getattr(app.state, "subgraph_refresh", None)
+    if subgraph_refresh is not None:
+        subgraph_refresh.cancel()
+    await close_neo4j_driver()
 
 
 # def get_redis() -> Redis:
@@ -151,7 +172,7 @@ def generate_cache_key(endpoint: str, target: str, diseases: List[str] = None) -
 
 
 async def get_cached_response(redis: Redis, key: str):
-    cached_response = redis.json().get(key)
+    cached_response = redis_json(redis).get(key)
     if cached_response:
         # logger.log("")
         # return json.loads(cached_response)
@@ -161,7 +182,16 @@ async def get_cached_response(redis: Redis, key: str):
 
 async def set_cached_response(redis: Redis, key: str, response: dict):
     #redis.set(key, json.dumps(response), ex=expiry)
-    redis.json().set(key, "$", response)
+    redis_json(redis).set(key, "$", response)
+
+
+def disease_cache_files(db: Session, diseases: List[str]) -> List[str]:
+    """ Return the cached JSON file of each disease, a placeholder path is used for diseases not cached yet """
+    file_paths: List[str] = []
+    for disease in diseases:
+        disease_record = db.query(Disease).filter_by(id=f"{disease}").first()
+        file_paths.append(disease_record.file_path if disease_record is not None else f"cached_data_json/disease/{disease}.json")
+    return file_paths
 
 
 def validate_target_and_diseases(request: TargetRequest, require_diseases: bool = False):
@@ -672,17 +702,11 @@ async def get_protein_structure(request: TargetOnlyRequest, redis: Redis = Depen
 
 
 #################################### market intelligence page ##############################################
-semaphore = asyncio.Semaphore(1)
 @app.post("/market-intelligence/target-pipeline-semaphore/", tags=["Market Intelligence"])
 async def get_target_pipeline_semaphore(request: TargetRequest, redis: Redis = Depends(get_redis), db: Session = Depends(get_db)):
-    try:
-        async with semaphore:  # This will block concurrent requests
-            print(f"lock applied and processing {request.diseases}")
-            response =  await get_target_pipeline(request, redis, db)
-            print("lock removed")
-    except Exception as e:
-        raise e
-    return response
+    # identical concurrent requests share one computation, other targets and diseases proceed in parallel
+    key: str = single_flight_key("/market-intelligence/target-pipeline/", request.diseases, request.target)
+    return await single_flight(key, lambda: get_target_pipeline(request, redis, db))
 
 
 @app.post("/market-intelligence/target-pipeline/", tags=["Market Intelligence"])
@@ -802,18 +826,12 @@ async def get_target_pipeline(request: TargetRequest, redis: Redis = Depends(get
             raise e
         raise HTTPException(status_code=500, detail=str(e))
 
-semaphore = asyncio.Semaphore(1)
 @app.post("/market-intelligence/indication-pipeline-semaphore/", tags=["Market Intelligence"])
 async def get_indication_pipeline_semaphore(request: DiseasesRequest,
                                   db: Session = Depends(get_db)):
-    try:
-        async with semaphore:  # This will block concurrent requests
-            print(f"lock applied and processing {request.diseases}")
-            response =  await get_indication_pipeline(request, db)
-        print("lock removed")
-    except Exception as e:
-        raise e
-    return response    
+    # identical concurrent requests share one computation, other diseases proceed in parallel
+    key: str = single_flight_key("/market-intelligence/indication-pipeline/", request.diseases)
+    return await single_flight(key, lambda: get_indication_pipeline(request, db))
 
 @app.post("/market-intelligence/indication-pipeline/", tags=["Market Intelligence"])
 async def get_indication_pipeline(request: DiseasesRequest,
@@ -992,8 +1010,7 @@ async def get_kol(request: DiseasesRequest, redis: Redis = Depends(get_redis),
         # indication_pipeline = fetch_and_parse_diseases_known_drugs(diseases_and_efo)
         # response = {"indication_pipeline": indication_pipeline}
         request_data = DiseasesRequest(diseases=[s.strip().lower().replace("_", " ") for s in filtered_diseases])
-        response = client.post("/market-intelligence/indication-pipeline/", json=request_data.dict())
-        response = response.json()
+        response = await get_indication_pipeline(request_data, db=db)
         disease_nct_ids: Dict[str, List[Tuple[str, str]]] = extract_nct_ids(response)
         print(disease_nct_ids)
         final_response = fetch_data_for_diseases(disease_nct_ids)
@@ -1141,23 +1158,24 @@ async def get_evidence_target_literature(request: TargetRequest,
             raise e
         raise HTTPException(status_code=500, detail=str(e))
 
-semaphore = asyncio.Semaphore(1)
 @app.post("/evidence/literature-semaphore/", tags=["Evidence"])
 async def get_evidence_literature_semaphore(request: DiseasesRequest, redis: Redis = Depends(get_redis),
                                   db: Session = Depends(get_db)):
-
-    try:
-        async with semaphore:  # This will block concurrent requests
-            print(f"lock applied and processing {request.diseases}")
-            response =  await get_evidence_literature(request, redis, db)
-        print("lock removed")
-    except Exception as e:
-        raise e
-    return response
+    # identical concurrent requests share one computation, other diseases proceed in parallel
+    key: str = single_flight_key("/evidence/literature/", request.diseases)
+    return await single_flight(key, lambda: get_evidence_literature(request, redis, db))
 
 @app.post("/evidence/literature/", tags=["Evidence"])
 async def get_evidence_literature(request: DiseasesRequest, redis: Redis = Depends(get_redis),
-                                  db: Session = Depends(get_db)):
+                                  db: Session = Depends(get_db), http_request: Request = None):
+    diseases: List[str] = [s.strip().lower().replace(" ", "_") for s in request.diseases]
+    key: str = f"/evidence/literature/:{'-'.join(diseases)}"
+    return await conditional_cached_response(http_request, key,
+                                             lambda: disease_cache_files(db, diseases),
+                                             lambda: fetch_evidence_literature(request, redis, db))
+
+
+async def fetch_evidence_literature(request: DiseasesRequest, redis: Redis, db: Session):
     diseases: List[str] = request.diseases
     diseases = [s.strip().lower().replace(" ", "_") for s in diseases]
     diseases_str = "-".join(diseases)
@@ -1388,18 +1406,12 @@ async def get_mouse_studies(request: DiseasesRequest, redis: Redis = Depends(get
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-semaphore = asyncio.Semaphore(1)
 @app.post("/evidence/network-biology-semaphore/", tags=["Evidence"])
 async def get_network_biology_semaphore(request: DiseasesRequest,
                             db: Session = Depends(get_db)):
-    try:
-        async with semaphore:  # This will block concurrent requests
-            print(f"lock applied and processing {request.diseases}")
-            response =  await get_network_biology(request, db)
-            print("lock removed")
-    except Exception as e:
-        raise e
-    return response
+    # identical concurrent requests share one computation, other diseases proceed in parallel
+    key: str = single_flight_key("/evidence/network-biology/", request.diseases)
+    return await single_flight(key, lambda: get_network_biology(request, db))
 
     
 @app.post("/evidence/network-biology/", tags=["Evidence"])
@@ -1676,31 +1688,34 @@ async def get_functional_genomics(request: TargetOnlyRequest, redis: Redis = Dep
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-semaphore = asyncio.Semaphore(1)
 @app.post("/evidence/rna-sequence-semaphore/", tags=["Evidence"])
 async def get_rna_sequence_semaphore(
         request: DiseasesRequest,  # Pydantic model that contains the target and diseases list
         redis: Redis = Depends(get_redis),  # Redis dependency for caching
         db: Session = Depends(get_db)
 ):
-    try:
-        async with semaphore:  # This will block concurrent requests
-            print(f"lock applied and processing {request.diseases}")
-            response =  await get_rna_sequence(request, redis, db)
-            print("lock removed")
-    except Exception as e:
-        raise e
-    return response
+    # identical concurrent requests share one computation, other diseases proceed in parallel
+    key: str = single_flight_key("/evidence/rna-sequence/", request.diseases)
+    return await single_flight(key, lambda: get_rna_sequence(request, redis, db))
 
 @app.post("/evidence/rna-sequence/", tags=["Evidence"])
 async def get_rna_sequence(
         request: DiseasesRequest,  # Pydantic model that contains the target and diseases list
         redis: Redis = Depends(get_redis),  # Redis dependency for caching
-        db: Session = Depends(get_db)
+        db: Session = Depends(get_db),
+        http_request: Request = None
 ):
     """
     Fetches RNA sequence data for list of diseases.
     """
+    diseases: List[str] = [s.strip().lower().replace(" ", "_") for s in request.diseases]
+    key: str = f"/evidence/rna-sequence/:{'-'.join(diseases)}"
+    return await conditional_cached_response(http_request, key,
+                                             lambda: disease_cache_files(db, diseases),
+                                             lambda: fetch_rna_sequence(request, redis, db))
+
+
+async def fetch_rna_sequence(request: DiseasesRequest, redis: Redis, db: Session):
     diseases: List[str] = request.diseases
     diseases = [s.strip().lower().replace(" ", "_") for s in diseases]
     diseases_str = "-".join(diseases)
@@ -1873,6 +1888,11 @@ async def pgs_catalog_data(request: DiseasesRequest, redis: Redis = Depends(get_
         
         diseases_and_efo: Dict[str, str] = {}  # Dictionary to store disease names and their corresponding EFO IDs
 
+        efo_ids: Dict[str, Optional[str]] = {disease: get_efo_id(disease.replace('_', ' ').lower())
+                                             for disease in filtered_diseases}
+        # one query for all diseases on the local catalog mirror, None if the mirror isn't built
+        mirrored_data = await run_in_threadpool(query_pgs_scores, [efo_id for efo_id in efo_ids.values() if efo_id])
+
         for disease in filtered_diseases:
             disease_name: str = disease.strip().lower().replace(" ", "_")
             disease_record = db.query(Disease).filter_by(id=f"{disease_name}").first()
@@ -1886,10 +1906,10 @@ async def pgs_catalog_data(request: DiseasesRequest, redis: Redis = Depends(get_
                 cached_responses = {}
             
             # Fetch PGS CAtalog data using EFO IDs
-            efo_id: str = get_efo_id(disease_name.replace('_', ' ').lower())
+            efo_id: Optional[str] = efo_ids[disease]
             if efo_id:
                 diseases_and_efo[disease_name] = efo_id.replace(':', '_')
-                genomics_data = fetch_pgs_data(efo_id)
+                genomics_data = mirrored_data[efo_id] if mirrored_data is not None else fetch_pgs_data(efo_id)
             else:
                 genomics_data = [f"EFO ID not found for {disease_name.replace('_', ' ')}"]
 
@@ -1972,6 +1992,11 @@ async def gwas_studies_data(request: DiseasesRequest, redis: Redis = Depends(get
         
         diseases_and_efo: Dict[str, str] = {}  # Dictionary to store disease names and their corresponding EFO IDs
 
+        efo_ids: Dict[str, Optional[str]] = {disease: get_efo_id(disease.replace('_', ' ').lower())
+                                             for disease in filtered_diseases}
+        # one query for all diseases on the local catalog mirror, None if the mirror isn't built
+        mirrored_data = await run_in_threadpool(query_gwas_studies, [efo_id for efo_id in efo_ids.values() if efo_id])
+
         for disease in filtered_diseases:
             disease_name: str = disease.strip().lower().replace(" ", "_")
             disease_record = db.query(Disease).filter_by(id=f"{disease_name}").first()
@@ -1985,10 +2010,10 @@ async def gwas_studies_data(request: DiseasesRequest, redis: Redis = Depends(get
                 cached_responses = {}
             
             # Fetch PGS CAtalog data using EFO IDs
-            efo_id: str = get_efo_id(disease_name.replace('_', ' ').lower())
+            efo_id: Optional[str] = efo_ids[disease]
             if efo_id:
                 diseases_and_efo[disease_name] = efo_id.replace(':', '_')
-                genomics_data = get_gwas_studies(efo_id)
+                genomics_data = mirrored_data[efo_id] if mirrored_data is not None else get_gwas_studies(efo_id)
             else:
                 genomics_data = [f"EFO ID not found for {disease_name.replace('_', ' ')}"]
 
@@ -2025,11 +2050,8 @@ async def plot_locus_zoom(request: DiseasesRequest, redis: Redis = Depends(get_r
         for disease in diseases:
             print('disease: ', disease)
             efo_id: str = get_efo_id(disease)
-            gwas_disease_file_path = os.path.join(GWAS_DATA_DIR, f'{efo_id}.tsv')
-            print("gwas_disease_file_path: ", gwas_disease_file_path)
-            if not os.path.exists(gwas_disease_file_path):
-                print("path doesn't exists")
-                gwas_disease_file_path = load_data(efo_id)
+            # generates the file from the associations store if it is missing or older than the store
+            gwas_disease_file_path = load_data(efo_id)
             print("gwas_disease_file_path: ", gwas_disease_file_path)
             if gwas_disease_file_path and os.path.isfile(gwas_disease_file_path):
                 response[disease] = gwas_disease_file_path
@@ -2041,6 +2063,51 @@ async def plot_locus_zoom(request: DiseasesRequest, redis: Redis = Depends(get_r
 
     except Exception as e:
         return None
+
+# EFO ids of the diseases plotted, the tiles endpoint is called on every pan and zoom (the oldest entries are
+# dropped beyond LOCUS_ZOOM_EFO_CACHE_SIZE)
+locus_zoom_efo_ids: Dict[str, str] = {}
+LOCUS_ZOOM_EFO_CACHE_SIZE: int = int(os.getenv("LOCUS_ZOOM_EFO_CACHE_SIZE", "1024"))
+
+@app.post("/genomics/locus-zoom/tiles", tags=["Genomics"])
+async def get_locus_zoom_tiles(request: LocusZoomTilesRequest):
+    """
+    Manhattan/locus zoom points of a disease in a window at a zoom level.
+
+    Genome-wide significant hits are always returned, the other variants are collapsed into one point per bin
+    (see `build_variant_tiles`), so the payload stays small whatever the number of associations.
+    """
+    disease: str = request.disease.strip().lower()
+    try:
+        efo_id = locus_zoom_efo_ids.get(disease)
+        if efo_id is None:
+            efo_id = await run_in_threadpool(get_efo_id, disease)
+            if not efo_id:
+                raise HTTPException(status_code=404, detail=f"EFO ID not found for {disease}")
+            while len(locus_zoom_efo_ids) >= LOCUS_ZOOM_EFO_CACHE_SIZE:
+                locus_zoom_efo_ids.pop(next(iter(locus_zoom_efo_ids)))
+            locus_zoom_efo_ids[disease] = efo_id
+
+        points = await run_in_threadpool(query_variant_tiles, efo_id, request.zoom, request.chromosome,
+                                         request.start, request.end)
+        if points is None:
+            raise HTTPException(status_code=404, detail=f"No GWAS associations for {disease}")
+
+        zoom: int = min(request.zoom, len(TILE_BIN_SIZES))
+        return {
+            "efo_id": efo_id,
+            "zoom": zoom,
+            "max_zoom": len(TILE_BIN_SIZES),
+            "bin_size": TILE_BIN_SIZES[zoom] if zoom < len(TILE_BIN_SIZES) else None,
+            "chromosome": request.chromosome,
+            "start": request.start,
+            "end": request.end,
+            "points": points,
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 #################################### target assessment page ##############################################
 
 @app.post("/target-assessment/targetability/", tags=["Target Assessment"])
@@ -2299,21 +2366,124 @@ async def get_paralogs(request: TargetOnlyRequest, redis: Redis = Depends(get_re
 @app.post("/fetch-graph/")
 async def fetch_graph(request: GraphRequest, driver=Depends(get_neo4j_driver)
                       , db: Session = Depends(get_db)
+                      , http_request: Request = None
                       ):
     """
     Return the data for knowledge graph.
-    """
 
-    efo_id_list: List[str] = list(map(get_efo_id, request.target_diseases))
+    Nodes and edges carry every property unless `all_properties` is unset, `top_k` keeps the most connected genes
+    and pathways. Clients accepting application/x-ndjson get the elements streamed one per line, as the records of
+    the knowledge graph arrive when the graph is neither cached nor ranked (see `stream_graph_elements`).
+    """
+    # response variant: properties projection and ranking, the default one keeps the keys of the graphs cached before
+    options: str = "" if request.all_properties and request.top_k is None else \
+        (":all" if request.all_properties else ":summary") + (f":top{request.top_k}" if request.top_k else "")
+    stream: bool = http_request is not None and "application/x-ndjson" in http_request.headers.get("accept", "")
+
+    # target/disease pairs materialized ahead of time are served without resolving the diseases
+    subgraphs = await run_in_threadpool(query_subgraphs, request.target_gene, request.target_diseases,
+                                        request.metapath, request.top_k, request.all_properties)
+    if subgraphs is not None:
+        if stream:
+            return graph_stream_response(subgraphs)
+        subgraphs_key: str = ":".join(sorted([request.target_gene.strip().lower(), request.metapath]
+                                             + [disease.strip().lower() for disease in request.target_diseases]))
+
+        async def stored_subgraphs():
+            return subgraphs
+
+        return await conditional_cached_response(http_request, f"/fetch-graph/subgraphs:{subgraphs_key}{options}",
+                                                 lambda: [SUBGRAPH_STORE_PATH], stored_subgraphs)
+
+    efo_id_list: List[str] = list(await asyncio.gather(
+        *(run_in_threadpool(get_efo_id, disease) for disease in request.target_diseases)))
     key_list: List[str] = [request.target_gene.strip().lower()] + efo_id_list + [request.metapath]
-    key: str = ":".join(sorted(key_list))
-    endpoint: str = "/fetch-graph/"
-    print(key)
+    key: str = ":".join(sorted(key_list)) + options
+
+    if stream:
+        if request.top_k is None and db.query(TargetDisease).filter_by(id=f"{key}").first() is None:
+            # nothing to rank, the elements are sent as the records arrive
+            return StreamingResponse(stream_graph_elements(request, driver, efo_id_list, key),
+                                     media_type="application/x-ndjson")
+        return graph_stream_response(await fetch_graph_elements(request, driver, db, efo_id_list, key))
+
+    def graph_cache_files() -> List[str]:
+        target_disease_record = db.query(TargetDisease).filter_by(id=f"{key}").first()
+        return [target_disease_record.file_path if target_disease_record is not None else ""]
+
+    return await conditional_cached_response(http_request, f"/fetch-graph/:{key}", graph_cache_files,
+                                             lambda: fetch_graph_elements(request, driver, db, efo_id_list, key))
+
+
+def graph_stream_response(payload: Dict[str, Any]) -> StreamingResponse:
+    """
+    Stream the elements of a built graph as NDJSON. The last line is {"truncated": ...}, like the streams of
+    `stream_graph_elements`, and whether the graph was truncated is also sent in a header.
+    """
+    lines = itertools.chain(payload["elements"], [{"truncated": bool(payload.get("truncated"))}])
+    return StreamingResponse(iter_ndjson(lines), media_type="application/x-ndjson",
+                             headers={"X-Graph-Truncated": "true" if payload.get("truncated") else "false"})
+
+
+def graph_file_path(key: str) -> str:
     cache_dir: str = "cached_data_json/target_disease"
     os.makedirs(cache_dir, exist_ok=True)  # Ensure the directory exists
+    return os.path.join(cache_dir, f"{key}.json")
+
+
+def save_graph_response(db: Session, key: str, response: Dict[str, Any]):
+    """
+    Cache the /fetch-graph/ response of a key in a file recorded in the target-disease table. Graphs truncated at
+    MAX_GRAPH_RECORDS are not cached, they are read again from the knowledge graph by the next request.
+    """
+    if response.get("truncated"):
+        print(f"Graph {key} is truncated, not caching it.")
+        return
+    file_path: str = graph_file_path(key)
+    save_big_response_to_file(file_path, response)
+    new_record = TargetDisease(id=key, file_path=file_path)  # Create a new instance of the identified model
+    db.add(new_record)  # Add the new record to the session
+    db.commit()  # Commit the transaction to save the record to the database
+    db.refresh(new_record)  # Refresh the instance to reflect any changes from the DB (like auto-generated
+    # fields)
+    print(f"Record with ID {key} added to the target-disease table.")
+
+
+def metapath_records(graph, request: GraphRequest, driver, efo_id_list: List[str], disease_ids: Optional[List[str]]):
+    """ The elements of the metapath records of the request, added to `graph` (see `iter_metapath`) """
+    # match the diseases on their node id when the equivalent identifiers lookup is built, this uses the index
+    if disease_ids is None:
+        return iter_metapath(graph, driver, request.metapath, request.target_gene, efo_id_list,
+                             by_equivalent_identifiers=True)
+    return iter_metapath(graph, driver, request.metapath, request.target_gene, disease_ids)
+
+
+async def stream_graph_elements(request: GraphRequest, driver, efo_id_list: List[str], key: str):
+    """
+    NDJSON lines of the elements of a graph not cached yet, sent as the metapath records arrive (a record's new nodes
+    before its new edges). The last line is {"truncated": ...}, the truncation is only known once every record is
+    read. The complete graph is then cached like the responses of `fetch_graph_elements`.
+    """
+    graph = new_graph(request.metapath, request.all_properties)
+    disease_ids: Optional[List[str]] = await run_in_threadpool(resolve_disease_ids, efo_id_list)
+    if disease_ids is None or disease_ids:
+        async for elements in metapath_records(graph, request, driver, efo_id_list, disease_ids):
+            for chunk in iter_ndjson(elements):
+                yield chunk
+    for chunk in iter_ndjson([{"truncated": graph.truncated}]):
+        yield chunk
+
+    def save():
+        # the request's session is closed once the response has started
+        with SessionLocal() as db:
+            if db.query(TargetDisease).filter_by(id=f"{key}").first() is None:
+                save_graph_response(db, key, graph.payload())
 
-    file_path: str = os.path.join(cache_dir, f"{key}.json")
+    await run_in_threadpool(save)
 
+
+async def fetch_graph_elements(request: GraphRequest, driver, db: Session, efo_id_list: List[str], key: str):
+    print(key)
     target_disease_record = db.query(TargetDisease).filter_by(id=f"{key}").first()
     # 1. Check if the cached JSON file exists
     if target_disease_record is not None:
@@ -2323,61 +2493,17 @@ async def fetch_graph(request: GraphRequest, driver=Depends(get_neo4j_driver)
         print(f"Returning cached response from file: {cached_file_path}")
         return cached_responses
 
-    QUERIES = {
-        "DGPG": """
-            MATCH (d:`biolink:Disease`)-[r1]-(g1:`biolink:Gene`)-[r2]-(bp:`biolink:Pathway`)-[r3]-(g:`biolink:Gene`)
-            WHERE g.name = $target_gene
-            AND (d.id IN $diseases 
-            OR any(id in d.equivalent_identifiers WHERE id IN $diseases))
-            RETURN d, r1, g1, r2, bp, r3, g
-        """,
-        "GGGD": """
-            MATCH(g:`biolink:Gene`{name:"TNFRSF4"})-[r1]-(g2:`biolink:Gene`)-[r2:`biolink:directly_physically_interacts_with`]-(g3)-[r3:`biolink:target_for`]-(d:`biolink:Disease`{name:"dermatitis, atopic"})
-            WHERE g.name = $target_gene
-            AND (d.id IN $diseases 
-            OR any(id in d.equivalent_identifiers WHERE id IN $diseases))
-            RETURN g, r1, g2, r2, g3, r3, d
-        """
-    }
-
-    NODE_TYPES = {
-        "DGPG": ['d', 'g1', 'bp', 'g'],
-        "GGGD": ['g', 'g2', 'g3', 'd']
-    }
-
-    EDGE_TYPES = {
-        "DGPG": ['r1', 'r2', 'r3'],
-        "GGGD": ['r1', 'r2', 'r3']
-    }
-
     # TODO: Add exception handling and return appropriate response and status code
 
-    with driver.session() as session:
-        result = session.run(
-            QUERIES[request.metapath],
-            parameters={
-                "target_gene": request.target_gene,
-                "diseases": efo_id_list
-            }
-        )
-
-        # Format the results for Cytoscape.js
-        graph_elements = format_for_cytoscape(
-            query_result=result,
-            node_types=NODE_TYPES[request.metapath],
-            edge_types=EDGE_TYPES[request.metapath]
-        )
-    response: Dict[str, Any] = {"elements": graph_elements}
-
-    if target_disease_record is None:
-        save_big_response_to_file(file_path, response)
-        new_record = TargetDisease(id=key, file_path=file_path)  # Create a new instance of the identified model
-        db.add(new_record)  # Add the new record to the session
-        db.commit()  # Commit the transaction to save the record to the database
-        db.refresh(new_record)  # Refresh the instance to reflect any changes from the DB (like auto-generated
-        # fields)
-        print(f"Record with ID {key} added to the target-disease table.")
+    graph = new_graph(request.metapath, request.all_properties)
+    disease_ids: Optional[List[str]] = await run_in_threadpool(resolve_disease_ids, efo_id_list)
+    if disease_ids is None or disease_ids:
+        async for _ in metapath_records(graph, request, driver, efo_id_list, disease_ids):
+            pass
 
+    # Format the results for Cytoscape.js
+    response: Dict[str, Any] = graph.payload(request.top_k)
+    save_graph_response(db, key, response)
     return response
 
 
@@ -2744,87 +2870,78 @@ def fetch_landing_page() -> str:
 
 #################################### Export feature apis ##############################################
 
+EXCEL_MEDIA_TYPE: str = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+async def excel_file_response(request: ExcelExportRequest, export: Callable[[Any], str], json_data: Any,
+                              filename: str) -> FileResponse:
+    """
+    Serve an Excel export, generating it off the event loop only if the same data was not exported before.
+
+    Args:
+        request (ExcelExportRequest): The export request, its endpoint, target and diseases scope the cache key.
+        export (Callable[[Any], str]): Export function returning the path of the generated file.
+        json_data (Any): Data passed to the export function, its content hash versions the cache key.
+        filename (str): File name offered to the client.
+
+    Returns:
+        FileResponse: The Excel file.
+    """
+    cache_key: str = export_cache_key(
+        request.endpoint,
+        (request.target or "").strip().lower(),
+        [disease.strip().lower() for disease in request.diseases or []],
+        json_data,
+    )
+    file_path: Optional[str] = get_cached_export(cache_key)
+    if file_path is None:
+        file_path = store_export(cache_key, await run_in_threadpool(export, json_data))
+    else:
+        print(f"Returning cached export {file_path}")
+    return FileResponse(file_path, media_type=EXCEL_MEDIA_TYPE, filename=filename)
+
+
+# Export function (in component_services.excel_export) and file name per exportable endpoint
+EXCEL_EXPORTS: Dict[str, Tuple[str, str]] = {
+    "/evidence/rna-sequence/": ("process_data_and_return_file_rna", "rna_seq_excel.xlsx"),
+    "/market-intelligence/indication-pipeline/": ("process_pipeline_data", "pipeline_indication_excel.xlsx"),
+    "/evidence/mouse-studies/": ("process_mouse_studies", "animal_model_excel.xlsx"),
+    "/evidence/search-patent/": ("process_patent_data", "patent_excel.xlsx"),
+    "/evidence/target-mouse-studies/": ("process_model_studies", "model_studies_excel.xlsx"),
+    "/market-intelligence/target-pipeline/": ("process_target_pipeline", "target_pipeline_excel.xlsx"),
+    "/target-indication-pairs": ("process_cover_letter_list_excel", "cover_letter_excel.xlsx"),
+}
+
 
 @app.post("/export",tags=["Export API"])
-async def get_excel_export(request: ExcelExportRequest):
+async def get_excel_export(request: ExcelExportRequest, redis: Redis = Depends(get_redis),
+                           db: Session = Depends(get_db)):
     """
-    Calls the `get_excel_export` API endpoint internally using TestClient.
+    Exports the data of an endpoint as an Excel file, the data is fetched in-process from the endpoint's handler.
     """
     try:
-        # Prepare the request data for the DiseasesRequest model
-        diseases=request.diseases
+        # Prepare the request data for the endpoint's request model
+        diseases=request.diseases or []
         filtered_diseases = [disease.strip().lower() for disease in diseases]
-        target=request.target.strip().lower()
+        target=(request.target or "").strip().lower()
         endpoint: str=request.endpoint
-        
-        if endpoint=="/evidence/rna-sequence/":
-            request_data = DiseasesRequest(diseases=filtered_diseases)
-            # Make the POST request to the internal API endpoint
-            response = client.post("/evidence/rna-sequence/", json=request_data.dict())
-            if response.status_code != 200:
-                raise HTTPException(status_code=response.status_code, detail=response.json())
-            json_data=response.json()
-            file_path = process_data_and_return_file_rna(json_data)
-            return FileResponse(file_path, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", filename="rna_seq_excel.xlsx")
-        elif endpoint=="/market-intelligence/indication-pipeline/":
-            print(endpoint)
-            request_data = DiseasesRequest(diseases=filtered_diseases)
-            # Make the POST request to the internal API endpoint
-            response = client.post("/market-intelligence/indication-pipeline/", json=request_data.dict())
-            print(response)
-            if response.status_code != 200:
-                raise HTTPException(status_code=response.status_code, detail=response.json())
-            json_data=response.json()
-            file_path = process_pipeline_data(json_data)
-            return FileResponse(file_path, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", filename="pipeline_indication_excel.xlsx")            
-        elif endpoint=="/evidence/mouse-studies/":
-            request_data = DiseasesRequest(diseases=filtered_diseases)
-            # Make the POST request to the internal API endpoint
-            response = client.post("/evidence/mouse-studies/", json=request_data.dict())
-            if response.status_code != 200:
-                raise HTTPException(status_code=response.status_code, detail=response.json())
-            json_data=response.json()
-            file_path = process_mouse_studies(json_data)
-            return FileResponse(file_path, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", filename="animal_model_excel.xlsx")
-        elif endpoint=="/evidence/search-patent/":
-            request_data = TargetRequest(target=target,diseases=filtered_diseases)
-            # Make the POST request to the internal API endpoint
-            response = client.post("/evidence/search-patent/", json=request_data.dict())
-            if response.status_code != 200:
-                raise HTTPException(status_code=response.status_code, detail=response.json())
-            json_data=response.json()
-            file_path = process_patent_data(json_data)
-            return FileResponse(file_path, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", filename="patent_excel.xlsx")  
-        elif endpoint=="/evidence/target-mouse-studies/":
+
+        if endpoint not in EXCEL_EXPORTS:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,detail="No functionality of export available")
+
+        if endpoint == "/evidence/target-mouse-studies/":
             request_data = TargetOnlyRequest(target=target)
-            # Make the POST request to the internal API endpoint
-            response = client.post("/evidence/target-mouse-studies/", json=request_data.dict())
-            if response.status_code != 200:
-                raise HTTPException(status_code=response.status_code, detail=response.json())
-            json_data=response.json()
-            file_path = process_model_studies(json_data)
-            return FileResponse(file_path, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", filename="model_studies_excel.xlsx") 
-        elif endpoint=="/market-intelligence/target-pipeline/":
+        elif endpoint in ("/evidence/search-patent/", "/market-intelligence/target-pipeline/"):
             request_data = TargetRequest(target=target,diseases=filtered_diseases)
-            # Make the POST request to the internal API endpoint
-            response = client.post("/market-intelligence/target-pipeline/", json=request_data.dict())
-            if response.status_code != 200:
-                raise HTTPException(status_code=response.status_code, detail=response.json())
-            json_data=response.json()
-            file_path = process_target_pipeline(json_data)
-            return FileResponse(file_path, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", filename="target_pipeline_excel.xlsx") 
-        elif endpoint=="/target-indication-pairs":
-            request_data = DiseasesRequest(diseases=filtered_diseases)
-            # Make the POST request to the internal API endpoint
-            response = client.post("/target-indication-pairs", json=request_data.dict())
-            if response.status_code != 200:
-                raise HTTPException(status_code=response.status_code, detail=response.json())
-            json_data=response.json()
-            file_path=process_cover_letter_list_excel(json_data)
-            return FileResponse(file_path, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", filename="cover_letter_excel.xlsx") 
         else:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,detail="No functionality of export available")
-        
+            request_data = DiseasesRequest(diseases=filtered_diseases)
+
+        json_data = await call_service(endpoint, request_data, redis, db)
+        # openpyxl is only needed for exports, load the export module on first use
+        from component_services import excel_export
+        export_name, filename = EXCEL_EXPORTS[endpoint]
+        return await excel_file_response(request, getattr(excel_export, export_name), json_data, filename)
+
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
@@ -2853,19 +2970,70 @@ async def get_phenotypes_lexical(query: str, offset: int = 0, limit: int = 20, c
     Endpoint to query phenotypes lexically based on input string.
     """
     try:
-        results = lexical_phenotype_search(query, conn)
-        count = len(results)
-        data = results.iloc[offset:offset + limit].to_dict(orient="records")
+        count, data = await run_in_threadpool(lexical_phenotype_search, query, conn, offset, limit)
         return {"count": count, "data": data} 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+
+@app.get("/phenotypes/autocomplete", tags=["Phenotypes entity search"])
+async def get_phenotypes_autocomplete(query: str, limit: int = Query(10, ge=1, le=AUTOCOMPLETE_MAX_LIMIT)):
+    """
+    Endpoint to complete a partially typed phenotype or disease (names, synonyms, ids and dbXRefs), for search as you type.
+    """
+    try:
+        return {"data": await run_in_threadpool(autocomplete_phenotypes, query, limit)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
         
+#################################### In-process service calls ##############################################
+
+# Handlers of the endpoints other endpoints, the cache builder and build_dossier need data from. They are plain
+# async functions, so they are awaited directly with the caller's DB session and Redis client instead of going
+# through an HTTP round trip (routing, validation, new dependencies and JSON encoding/decoding of the payload).
+SERVICE_HANDLERS: Dict[str, Callable[..., Awaitable[Any]]] = {
+    "/evidence/literature/": get_evidence_literature,
+    "/evidence/mouse-studies/": get_mouse_studies,
+    "/evidence/network-biology/": get_network_biology,
+    "/evidence/top-10-literature/": get_top_10_literature,
+    "/evidence/rna-sequence/": get_rna_sequence,
+    "/evidence/search-patent/": search_patents,
+    "/evidence/target-mouse-studies/": get_target_mouse_studies,
+    "/disease-profile/details/": get_diseases_profiles,
+    "/disease-profile/ontology/": get_disease_ontology,
+    "/market-intelligence/indication-pipeline/": get_indication_pipeline,
+    "/market-intelligence/target-pipeline/": get_target_pipeline,
+    "/market-intelligence/kol/": get_kol,
+    "/market-intelligence/key-influencers/": get_key_influencers,
+    "/target-indication-pairs": get_target_indication_pairs,
+}
+
+
+async def call_service(endpoint: str, request: BaseModel, redis: Redis, db: Session) -> Any:
+    """
+    Call an endpoint's handler in-process.
+
+    Args:
+        endpoint (str): Path of the endpoint, a key of SERVICE_HANDLERS.
+        request (BaseModel): The endpoint's request model.
+        redis (Redis): Redis client shared with the caller.
+        db (Session): Database session shared with the caller.
+
+    Returns:
+        Any: The handler's payload. Errors are raised as they are by the handler (usually HTTPException).
+    """
+    handler = SERVICE_HANDLERS[endpoint]
+    parameters = inspect.signature(handler).parameters
+    dependencies: Dict[str, Any] = {name: value for name, value in (("redis", redis), ("db", db)) if name in parameters}
+    return await handler(request, **dependencies)
+
+
 @app.get("/cache-data",tags=["Caching Data"])
-def cache_data():
+async def cache_data(redis: Redis = Depends(get_redis), db: Session = Depends(get_db)):
     print("API endpoint '/cache-data' is called.")
     try:
-        cache_all_data(client)  # Call the cache_all_data function
+        await cache_all_data(call_service, redis, db)  # Call the cache_all_data function
         return {"message": "Cache data operation completed"}
     except Exception as e:
         print(f"Error in '/cache-data' endpoint: {e}")
@@ -17,6 +17,9 @@ class GraphRequest(BaseModel):
     target_gene: str
     target_diseases: list[str]
     metapath: Literal["GGGD", "DGPG"]
+    top_k: Optional[int] = Field(None, ge=1, description="Keep the k most connected genes and pathways of the path")
+    # Every property of the nodes and edges (the graph's properties panel shows them all), False keeps the main ones
+    all_properties: bool = True
 
 
 class DiseaseRequest(BaseModel):
@@ -26,6 +29,13 @@ class DiseaseRequest(BaseModel):
 class DiseasesRequest(BaseModel):
     diseases: List[str]
 
+class LocusZoomTilesRequest(BaseModel):
+    disease: str
+    zoom: int = Field(0, ge=0, description="Zoom level, 0 is genome-wide")
+    chromosome: Optional[str] = None  # All chromosomes if not given
+    start: Optional[int] = Field(None, ge=0, description="First position of the window")
+    end: Optional[int] = Field(None, ge=0, description="Last position of the window")
+
 class ExcelExportRequest(BaseModel):
     endpoint: str
     target: Optional[str] = None  # Make 'target' optional
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Benchmark the streaming Excel export against the previous in-memory approach on a synthetic indication pipeline.
+
+The previous approach loaded the template in normal mode, cleared the data sheet cell by cell and wrote every
+value with `ws.cell`. The streaming export parses the template once per process and appends rows to a
+write-only workbook. Reports wall time and peak traced memory; the streaming export is measured cold (template
+parsed, time only) and warm (template cached).
+
+Usage (from the scripts directory):
+    python benchmarks/excel_export_benchmark.py [--rows N] [--skip-legacy]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openpyxl import load_workbook  # noqa: E402
+
+from component_services.excel_export import capitalize_words, process_pipeline_data  # noqa: E402
+
+TEMPLATE_PATH: str = "../excel_export_templates/Pipeline-template-latest.xltx"
+
+
+def synthetic_pipeline(rows: int) -> Dict[str, Any]:
+    """ Build an indication pipeline payload producing roughly the given number of Pipeline_Data rows """
+    random.seed(0)
+    diseases: List[str] = ["asthma", "hidradenitis suppurativa", "prurigo nodularis", "alopecia areata"]
+    statuses: List[str] = ["Completed", "Terminated", "Recruiting", "Withdrawn"]
+    outcomes: List[str] = ["Success", "Failed", "Indeterminate", "Not Known"]
+    pipeline: Dict[str, List[Dict[str, Any]]] = {disease: [] for disease in diseases}
+
+    produced: int = 0
+    while produced < rows:
+        disease: str = random.choice(diseases)
+        urls: List[str] = [f"https://clinicaltrials.gov/study/NCT{random.randint(0, 10 ** 8):08d}"
+                           for _ in range(random.randint(1, 3))]
+        status: str = random.choice(statuses)
+        pmids: List[str] = [str(random.randint(10 ** 7, 4 * 10 ** 7)) for _ in range(random.randint(0, 2))]
+        pipeline[disease].append({
+            "Disease": disease,
+            "Target": f"GENE{random.randint(0, 2000)}",
+            "OutcomeStatus": random.choice(outcomes),
+            "Drug": f"DRUG-{random.randint(0, 5000)}",
+            "Phase": random.choice(["Phase 1", "Phase 2", "Phase 3", "Phase 4"]),
+            "Status": status,
+            "Sponsor": f"Sponsor {random.randint(0, 300)}",
+            "Type": random.choice(["Small molecule", "Antibody", "Protein"]),
+            "Mechanism of Action": "Interleukin receptor antagonist",
+            "WhyStopped": "Business decision" if status != "Completed" else None,
+            "ApprovalStatus": random.choice(["Approved", "Not Known"]),
+            "Source URLs": urls,
+            "PMIDs": pmids,
+        })
+        produced += max(len(urls), len(pmids) if status == "Completed" else 0, 1)
+    return {"indication_pipeline": pipeline}
+
+
+def legacy_export(data: Dict[str, Any]) -> str:
+    """ Pipeline_Data sheet written the way the export worked before streaming """
+    output_path: str = "pipeline_indication_excel_legacy.xlsx"
+    workbook = load_workbook(TEMPLATE_PATH)
+    workbook.template = False
+    ws = workbook["Pipeline_Data"]
+    for row in ws.iter_rows(min_row=2):
+        for cell in row:
+            cell.value = None
+
+    row = 2
+    for records in data["indication_pipeline"].values():
+        for item in records:
+            source_urls = item["Source URLs"]
+            for idx in range(max(len(source_urls), 1)):
+                ws.cell(row=row, column=1, value=capitalize_words(item["Disease"]))
+                ws.cell(row=row, column=2, value=item["Target"])
+                ws.cell(row=row, column=4, value=item["OutcomeStatus"])
+                ws.cell(row=row, column=6, value=item["Drug"])
+                ws.cell(row=row, column=7, value=item["Phase"])
+                ws.cell(row=row, column=8, value=item["Status"])
+                ws.cell(row=row, column=9, value=item["Sponsor"])
+                ws.cell(row=row, column=10, value=item["Mechanism of Action"])
+                ws.cell(row=row, column=11, value=item["Type"])
+                ws.cell(row=row, column=12, value=item["ApprovalStatus"])
+                trial_id = source_urls[idx] if idx < len(source_urls) else ""
+                ws.cell(row=row, column=3).hyperlink = trial_id if trial_id != "" else None
+                ws.cell(row=row, column=3, value=trial_id)
+                if trial_id != "":
+                    ws.cell(row=row, column=3).style = "Hyperlink"
+                row += 1
+    workbook.save(output_path)
+    return output_path
+
+
+def measure(operation: Callable[[], str]) -> Tuple[float, int]:
+    """
+    Return the wall time in seconds of an export and the peak traced memory in bytes of a second, traced run
+    (tracing slows allocations down too much to time the same run).
+    """
+    start = time.perf_counter()
+    output_path: str = operation()
+    seconds: float = time.perf_counter() - start
+    os.remove(output_path)
+
+    tracemalloc.start()
+    output_path = operation()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    os.remove(output_path)
+    return seconds, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=50000, help="approximate number of Pipeline_Data rows")
+    parser.add_argument("--skip-legacy", action="store_true", help="only measure the streaming export")
+    args = parser.parse_args()
+
+    data = synthetic_pipeline(args.rows)
+    results: Dict[str, Tuple[float, int]] = {}
+    if not args.skip_legacy:
+        results["legacy"] = measure(lambda: legacy_export(data))
+    start = time.perf_counter()
+    os.remove(process_pipeline_data(data))
+    results["streaming (cold)"] = (time.perf_counter() - start, 0)
+    results["streaming (warm)"] = measure(lambda: process_pipeline_data(data))
+
+    print(f"{'export':<18} {'time s':>8} {'peak MB':>9}")
+    for name, (seconds, peak) in results.items():
+        print(f"{name:<18} {seconds:>8.2f} {peak / 1e6 if peak else float('nan'):>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Profile the import of the API module and check it against an import-time budget.
+
+Runs `python -X importtime -c "import api"` in fresh interpreters, reports the slowest modules by cumulative
+import time and fails (exit code 1) if the best total exceeds the budget or if a dependency that should only be
+loaded lazily by the routes needing it is imported at startup.
+
+Usage (from the scripts directory):
+    python benchmarks/import_profile.py [--module api] [--runs N] [--top N] [--budget SECONDS]
+
+The budget defaults to IMPORT_BUDGET_SECONDS or 2.5 seconds.
+"""
+import argparse
+import os
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+SCRIPTS_DIR: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Heavy dependencies that must stay out of the startup path
+LAZY_MODULES: List[str] = [
+    "graphrag",
+    "tiktoken",
+    "llmfactory",
+    "langchain_core",
+    "openai",
+    "openpyxl",
+    "duckdb",
+    "neo4j",
+    "sentence_transformers",
+    "qdrant_client",
+    "fastapi.testclient",
+    "ipywidgets",
+    "matplotlib",
+]
+
+
+def profile_import(module: str) -> List[Tuple[str, int, int]]:
+    """
+    Import a module in a fresh interpreter with -X importtime.
+
+    Returns:
+        List[Tuple[str, int, int]]: (module name, self time, cumulative time) in microseconds, in import order.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=SCRIPTS_DIR,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        print(result.stderr[-2000:])
+        raise RuntimeError(f"Importing {module} failed")
+
+    timings: List[Tuple[str, int, int]] = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line.split(":", 1)[1].split("|")
+        timings.append((name.strip(), int(self_us), int(cumulative_us)))
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="api", help="module to import")
+    parser.add_argument("--runs", type=int, default=3, help="fresh interpreters, the fastest run is reported")
+    parser.add_argument("--top", type=int, default=25, help="number of modules to report")
+    parser.add_argument("--budget", type=float, default=float(os.getenv("IMPORT_BUDGET_SECONDS", "2.5")),
+                        help="maximum import time in seconds")
+    args = parser.parse_args()
+
+    best: List[Tuple[str, int, int]] = []
+    best_total: int = 0
+    for _ in range(args.runs):
+        timings = profile_import(args.module)
+        total: int = next(cumulative for name, _, cumulative in timings if name == args.module)
+        if not best or total < best_total:
+            best, best_total = timings, total
+
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for name, self_us, cumulative_us in sorted(best, key=lambda timing: timing[2], reverse=True)[:args.top]:
+        print(f"{cumulative_us / 1e3:>14.1f} {self_us / 1e3:>9.1f}  {name}")
+
+    imported: Dict[str, int] = {name: cumulative for name, _, cumulative in best}
+    eager: List[str] = [name for name in LAZY_MODULES if name in imported]
+
+    print(f"\nimport {args.module}: {best_total / 1e6:.2f} s (budget {args.budget:.2f} s)")
+    failed: bool = False
+    if eager:
+        print(f"FAIL: imported at startup but should be lazy: {', '.join(eager)}")
+        failed = True
+    if best_total / 1e6 > args.budget:
+        print("FAIL: import time over budget")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Benchmark stdlib `json` against the `serialization` module on real cached disease files.
+
+For every file, reports the best-of-N load and dump time and the peak traced memory of each operation.
+
+Usage (from the scripts directory):
+    python benchmarks/serialization_benchmark.py [FILE_OR_DIR ...] [--repeat N]
+
+Defaults to the disease files under cached_data_json/ and backedup_cache_data/.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import serialization  # noqa: E402
+
+DEFAULT_PATTERNS: List[str] = [
+    "cached_data_json/disease/*.json",
+    "backedup_cache_data/*/disease/*.json",
+]
+
+
+def measure(operation: Callable[[], Any], repeat: int) -> Tuple[float, int]:
+    """ Return the best wall time in seconds and the peak traced memory in bytes of an operation """
+    best: float = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        operation()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    operation()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def benchmark_file(file_path: str, repeat: int) -> Dict[str, Tuple[float, int]]:
+    with open(file_path, "rb") as file:
+        raw: bytes = file.read()
+    data: Any = json.loads(raw)
+
+    return {
+        "json load": measure(lambda: json.loads(raw), repeat),
+        "orjson load": measure(lambda: serialization.loads(raw), repeat),
+        "json dump": measure(lambda: json.dumps(data).encode("utf-8"), repeat),
+        "orjson dump": measure(lambda: serialization.dumps(data), repeat),
+    }
+
+
+def collect_files(paths: List[str]) -> List[str]:
+    files: List[str] = []
+    for path in paths or DEFAULT_PATTERNS:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "*.json"))))
+        else:
+            files.extend(sorted(glob.glob(path)))
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="*", help="cached JSON files or directories")
+    parser.add_argument("--repeat", type=int, default=5, help="timed repetitions per operation")
+    args = parser.parse_args()
+
+    files = collect_files(args.paths)
+    if not files:
+        print("No cached files found")
+        sys.exit(1)
+
+    totals: Dict[str, List[float]] = {}
+    print(f"{'file':<45} {'size MB':>8} {'operation':<12} {'time ms':>9} {'peak MB':>9}")
+    for file_path in files:
+        size_mb: float = os.path.getsize(file_path) / 1e6
+        for operation, (seconds, peak) in benchmark_file(file_path, args.repeat).items():
+            totals.setdefault(operation, [0.0, 0.0])
+            totals[operation][0] += seconds
+            totals[operation][1] = max(totals[operation][1], peak)
+            print(f"{os.path.basename(file_path)[:45]:<45} {size_mb:>8.2f} {operation:<12} "
+                  f"{seconds * 1e3:>9.2f} {peak / 1e6:>9.2f}")
+
+    print("\nTotals over all files")
+    for operation, (seconds, peak) in totals.items():
+        print(f"{operation:<12} {seconds * 1e3:>9.2f} ms   max peak {peak / 1e6:>8.2f} MB")
+
+
+if __name__ == "__main__":
+    main()
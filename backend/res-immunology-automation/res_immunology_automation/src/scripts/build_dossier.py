@@ -2,12 +2,12 @@ from db.database import get_db # , engine, Base, SessionLocal
 from db.models import DiseasesDossierStatus 
 from db.database import Base
 
-from api_models import DiseasesRequest, DiseaseRequest
+from api_models import DiseasesRequest, DiseaseRequest, ExcelExportRequest
 from api import get_evidence_literature_semaphore, get_mouse_studies, \
                 get_network_biology_semaphore, get_top_10_literature, \
                 get_diseases_profiles, get_indication_pipeline_semaphore, \
                 get_kol, get_key_influencers, get_rna_sequence_semaphore, \
-                get_disease_ontology
+                get_disease_ontology, get_excel_export
                 
 import logging
 import time
@@ -33,6 +33,14 @@ logging.basicConfig(
 task_started = False
 WAIT_TIME = 200
 
+# Exports generated once a dossier is built, so the first download is served from the export cache
+PREGENERATE_EXPORTS = os.getenv("PREGENERATE_EXPORTS", "true").lower() == "true"
+DOSSIER_EXPORT_ENDPOINTS = [
+    "/evidence/rna-sequence/",
+    "/market-intelligence/indication-pipeline/",
+    "/evidence/mouse-studies/",
+]
+
 POSTGRES_USER: str = os.getenv("POSTGRES_USER")
 POSTGRES_PASSWORD: str = os.getenv("POSTGRES_PASSWORD")
 POSTGRES_DB: str = os.getenv("POSTGRES_DB")
@@ -150,7 +158,7 @@ async def run_endpoints(unique_diseases):
 
         # Define endpoint categories
         diseases_only_endpoints = [
-            get_evidence_letiniterature_semaphore, 
+            get_evidence_literature_semaphore, 
             get_mouse_studies, 
             get_network_biology_semaphore, 
             get_top_10_literature, 
@@ -196,13 +204,25 @@ async def run_endpoints(unique_diseases):
                     logging.error(f"Error calling {endpoint.__name__} for disease {disease}: {e}")
                     return 'error'
         await asyncio.sleep(5)
-        
+
+        if PREGENERATE_EXPORTS:
+            await pregenerate_exports(unique_diseases, redis, db)
+
         return 'processed'
 
     finally:
         db.close()
         print("connection closed in endpoints")
 
+async def pregenerate_exports(unique_diseases, redis, db):
+    """ Generate the disease exports of a freshly built dossier, failures don't fail the build """
+    for endpoint in DOSSIER_EXPORT_ENDPOINTS:
+        try:
+            logging.info(f"Pre-generating export {endpoint} for {unique_diseases}")
+            await get_excel_export(ExcelExportRequest(endpoint=endpoint, diseases=unique_diseases), redis=redis, db=db)
+        except Exception as e:
+            logging.error(f"Error pre-generating export {endpoint} for {unique_diseases}: {e}")
+
 async def main():
     """Main entry point to initialize database and start dossier processing."""
     await create_models()
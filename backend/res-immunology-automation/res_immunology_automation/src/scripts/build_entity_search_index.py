@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Build the normalized search table of the phenotype lexical search in the entity search database.
+
+Run after the phenotypes table is created or reloaded, the API picks the new index up when the database file changes.
+
+Usage (from the scripts directory):
+    python build_entity_search_index.py [--db PATH]
+"""
+import argparse
+
+import duckdb
+
+from component_services.entity_search_services import build_phenotype_search_index, db_file_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=db_file_path, help="entity search database")
+    args = parser.parse_args()
+
+    conn = duckdb.connect(args.db)
+    try:
+        build_phenotype_search_index(conn)
+        rows = conn.execute("SELECT count(*) FROM phenotype_search").fetchone()[0]
+    finally:
+        conn.close()
+    print(f"Phenotype search table built: {rows} phenotypes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+Materialize the knowledge graph metapath subgraphs served by /fetch-graph/.
+
+Runs the DGPG and GGGD metapath queries of every target/disease pair of target_disease.json against ROBOKOP and
+rebuilds the DuckDB store with their results and the equivalent identifiers of the disease nodes. Run this after
+changing target_disease.json or to refresh the store. With KG_SUBGRAPH_REFRESH=true the API also refreshes it in the
+background every KG_SUBGRAPH_REFRESH_INTERVAL seconds.
+
+Usage (from the scripts directory):
+    python build_kg_subgraphs.py
+"""
+import argparse
+import asyncio
+
+from component_services.kg_subgraph_services import SUBGRAPH_STORE_PATH, refresh_subgraph_store
+from dependencies import close_neo4j_driver, get_neo4j_driver
+
+
+async def build():
+    try:
+        if await refresh_subgraph_store(get_neo4j_driver(), force=True):
+            print(f"KG subgraph store rebuilt: {SUBGRAPH_STORE_PATH}")
+        else:
+            print("The KG subgraph store is being rebuilt by another process")
+    finally:
+        await close_neo4j_driver()
+
+
+def main():
+    argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter).parse_args()
+    asyncio.run(build())
+
+
+if __name__ == "__main__":
+    main()
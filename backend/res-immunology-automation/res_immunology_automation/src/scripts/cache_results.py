@@ -4,12 +4,23 @@ from api_models import (
     DiseaseRequest,
     TargetOnlyRequest
 )
-from typing import List, Dict, Set
+from typing import Any, Awaitable, Callable, List, Dict, Set
 import json
-from fastapi.testclient import TestClient
+from pydantic import BaseModel
+from redis import Redis
+from sqlalchemy.orm import Session
 
 
-def cache_all_data(client: TestClient):
+async def cache_all_data(call_service: Callable[[str, BaseModel, Redis, Session], Awaitable[Any]],
+                         redis: Redis, db: Session):
+    """
+    Build the cache of every disease listed in diseases_to_cache.json.
+
+    Args:
+        call_service (Callable): Calls an endpoint's handler in-process (`api.call_service`).
+        redis (Redis): Redis client shared by all calls.
+        db (Session): Database session shared by all calls.
+    """
     # Load target-disease mapping from a JSON file
     with open("../disease_data/diseases_to_cache.json") as f:
         unique_diseases: Set[str] = set(json.load(f))
@@ -37,8 +48,8 @@ def cache_all_data(client: TestClient):
         try:
             request_data = DiseasesRequest(diseases=list(unique_diseases))
             print(f"Calling {endpoint} with all diseases: {list(unique_diseases)}")
-            response = client.post(endpoint, json=request_data.dict())
-            print(f"Response for {endpoint}: {response.status_code} {response.json()}")
+            await call_service(endpoint, request_data, redis, db)
+            print(f"Cached {endpoint}")
         except Exception as e:
             print(f"Error calling {endpoint} with all diseases: {e}")
 
@@ -48,8 +59,8 @@ def cache_all_data(client: TestClient):
             try:
                 request_data = DiseaseRequest(disease=disease)
                 print(f"Calling {endpoint} for disease: {disease}")
-                response = client.post(endpoint, json=request_data.dict())
-                print(f"Response for {endpoint}: {response.status_code} {response.json()}")
+                await call_service(endpoint, request_data, redis, db)
+                print(f"Cached {endpoint} for disease: {disease}")
             except Exception as e:
                 print(f"Error calling {endpoint} for disease {disease}: {e}")
 
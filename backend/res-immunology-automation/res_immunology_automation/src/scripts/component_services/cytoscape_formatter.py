@@ -0,0 +1,159 @@
+"""
+Cytoscape.js graphs built from metapath query records.
+
+`CytoscapeGraph` takes the records one at a time as the Neo4j result streams in. Each node and relationship is
+formatted once, on first sight, with every property or only NODE_PROPERTIES/EDGE_PROPERTIES. Dense metapaths can
+be capped to their strongest intermediate nodes with `elements(top_k)`.
+"""
+import heapq
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, List, Optional
+
+# Properties kept on the elements when not all of them are requested
+NODE_PROPERTIES: List[str] = ["id", "name", "category", "description", "information_content"]
+EDGE_PROPERTIES: List[str] = ["predicate", "primary_knowledge_source", "aggregator_knowledge_source",
+                              "knowledge_level", "agent_type", "publications"]
+
+NODE_TYPES: Dict[str, str] = {
+    "biolink:Gene": "Gene",
+    "biolink:Disease": "Disease",
+    "biolink:Pathway": "Pathway"
+}
+
+
+def get_type_from_labels(labels) -> Optional[str]:
+    for label, node_type in NODE_TYPES.items():
+        if label in labels:
+            return node_type
+
+
+def _properties(entity, keys: Optional[List[str]]) -> Dict[str, Any]:
+    if keys is None:
+        return dict(entity)
+    return {key: entity[key] for key in keys if entity.get(key) is not None}
+
+
+class CytoscapeGraph:
+    """
+    Nodes and edges of metapath records, each once, keyed by their Neo4j id.
+
+    Args:
+        node_types (List[str]): Keys of the nodes in a record.
+        edge_types (List[str]): Keys of the relationships in a record.
+        ranked_types (Iterable[str]): Keys of the intermediate nodes, the ones `top_k` selects among. The nodes of
+            the other keys (the target and the diseases) are always kept.
+        all_properties (bool): Keep every property of the nodes and relationships instead of NODE_PROPERTIES and
+            EDGE_PROPERTIES.
+    """
+
+    def __init__(self, node_types: List[str], edge_types: List[str], ranked_types: Iterable[str] = (),
+                 all_properties: bool = False):
+        self.node_types = node_types
+        self.edge_types = edge_types
+        self.anchor_types = [node_type for node_type in node_types if node_type not in set(ranked_types)]
+        self.node_properties = None if all_properties else NODE_PROPERTIES
+        self.edge_properties = None if all_properties else EDGE_PROPERTIES
+        self.nodes: Dict[str, Dict[str, Any]] = {}
+        self.edges: Dict[str, Dict[str, Any]] = {}
+        self.anchors: set = set()
+        self.records = 0
+        self.truncated = False
+
+    def add(self, record) -> List[Dict[str, Any]]:
+        """ Add the nodes and relationships of a record not seen yet, returns these new elements (nodes first) """
+        self.records += 1
+        new_nodes, new_edges = [], []
+        for node in self.node_types:
+            node_data = record[node]
+            node_id = str(node_data.id)
+            if node_id not in self.nodes:
+                self.nodes[node_id] = {
+                    "data": {
+                        "id": node_id,
+                        "label": node_data.get("name") or node_data.get("id"),
+                        "type": get_type_from_labels(node_data.labels),
+                        "labels": node_data.labels,
+                        "properties": _properties(node_data, self.node_properties)
+                    }
+                }
+                new_nodes.append(self.nodes[node_id])
+        for node in self.anchor_types:
+            self.anchors.add(str(record[node].id))
+
+        for rel in self.edge_types:
+            rel_data = record[rel]
+            rel_id = str(rel_data.id)
+            if rel_id not in self.edges:
+                prop_dict = _properties(rel_data, self.edge_properties)
+                prop_dict["source"] = str(rel_data.start_node.get("name") or rel_data.start_node.get("id"))
+                prop_dict["target"] = str(rel_data.end_node.get("name") or rel_data.end_node.get("id"))
+
+                self.edges[rel_id] = {
+                    "data": {
+                        "source": str(rel_data.start_node.id),
+                        "target": str(rel_data.end_node.id),
+                        "label": rel_data.type,
+                        "properties": prop_dict
+                    }
+                }
+                new_edges.append(self.edges[rel_id])
+        return new_nodes + new_edges
+
+    def merge(self, state: Dict[str, Any]):
+        """ Add the elements of a graph saved with `state`, projected to this graph's properties """
+        for node_id, node in state["nodes"].items():
+            if node_id not in self.nodes:
+                if self.node_properties is not None:
+                    node = {"data": {**node["data"], "properties": _properties(node["data"]["properties"],
+                                                                                self.node_properties)}}
+                self.nodes[node_id] = node
+        for rel_id, edge in state["edges"].items():
+            if rel_id not in self.edges:
+                if self.edge_properties is not None:
+                    properties = edge["data"]["properties"]
+                    projected = _properties(properties, self.edge_properties)
+                    projected["source"], projected["target"] = properties["source"], properties["target"]
+                    edge = {"data": {**edge["data"], "properties": projected}}
+                self.edges[rel_id] = edge
+        self.anchors.update(state.get("anchors", []))
+        self.records += state.get("records", 0)
+        self.truncated = self.truncated or state.get("truncated", False)
+
+    def state(self) -> Dict[str, Any]:
+        """ The graph as a JSON serializable dict, for `merge` """
+        return {"nodes": self.nodes, "edges": self.edges, "anchors": sorted(self.anchors), "records": self.records,
+                "truncated": self.truncated}
+
+    def elements(self, top_k: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        The Cytoscape.js elements, nodes first.
+
+        Args:
+            top_k (Optional[int]): Only keep the `top_k` intermediate nodes of each type (Gene, Pathway) with the
+                most edges, the edges between the kept nodes, and the nodes still connected.
+
+        Returns:
+            List[Dict]: The elements.
+        """
+        nodes, edges = self.nodes, self.edges
+        if top_k is not None:
+            degree: Counter = Counter()
+            for edge in edges.values():
+                degree[edge["data"]["source"]] += 1
+                degree[edge["data"]["target"]] += 1
+            candidates = defaultdict(list)
+            for node_id, node in nodes.items():
+                if node_id not in self.anchors:
+                    candidates[node["data"]["type"]].append(node_id)
+            kept = set(self.anchors)
+            for node_ids in candidates.values():
+                kept.update(heapq.nlargest(top_k, node_ids, key=degree.__getitem__))
+            edges = {rel_id: edge for rel_id, edge in edges.items()
+                     if edge["data"]["source"] in kept and edge["data"]["target"] in kept}
+            connected = {edge["data"][end] for edge in edges.values() for end in ("source", "target")}
+            nodes = {node_id: node for node_id, node in nodes.items() if node_id in connected or node_id in self.anchors}
+        return list(nodes.values()) + list(edges.values())
+
+    def payload(self, top_k: Optional[int] = None) -> Dict[str, Any]:
+        """ The /fetch-graph/ response """
+        return {"elements": self.elements(top_k), "truncated": self.truncated}
@@ -1,146 +1,445 @@
 
-from typing import Dict, List
-from duckdb import DuckDBPyConnection
-from pandas import DataFrame
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Tuple
+from bisect import bisect_left
+from collections import OrderedDict
+import heapq
+import json
 import os
-import duckdb
+import queue
+import re
+import threading
 from fastapi import HTTPException
 
+if TYPE_CHECKING:
+    from duckdb import DuckDBPyConnection
+
 db_file_path = "/app/database/entity_search.db"
+diseases_file_path = "../disease_data/diseases_efo.jsonl"
 
-# To query the phenotype id and name
-primary_phenotype_query = """
-SELECT
-   id,
-   name,
-   CASE
-       WHEN id ILIKE (? || '%') THEN 'id: ' || id
-       WHEN dbXRefs_text ILIKE ('%' || ? || '%') THEN 'dbXRef: ' || dbXRefs_text
-       WHEN name ILIKE ? THEN 'name: ' || name
-       WHEN name ILIKE (? || '%') THEN 'name: ' || name
-       WHEN name ILIKE ('%' || ' ' || ? || '%') THEN 'name: ' || name
-       ELSE NULL
-   END AS matched_column
-FROM
-   phenotypes
-WHERE
-   id ILIKE (? || '%') OR
-   dbXRefs_text ILIKE ('%' || ? || '%') OR
-   name ILIKE ? OR
-   name ILIKE (? || '%') OR
-   name ILIKE ('%' || ' ' || ? || '%')
-ORDER BY
-   CASE
-       WHEN name ILIKE ? THEN 1
-       WHEN name ILIKE (? || '%') THEN 2
-       WHEN name ILIKE ('%' || ' ' || ? || '%') THEN 3
-       WHEN id ILIKE (? || '%') THEN 4
-       WHEN dbXRefs_text ILIKE ('%' || ? || '%') THEN 5
-       ELSE 6
-   END
-"""
+# Cursors kept open on the shared read-only connection, one is used per request
+POOL_SIZE: int = int(os.getenv("ENTITY_SEARCH_POOL_SIZE", "8"))
+# Recent searches and how many of their ranked results are kept, pages within them are served without a query
+SEARCH_CACHE_SIZE: int = int(os.getenv("ENTITY_SEARCH_CACHE_SIZE", "256"))
+SEARCH_CACHE_RESULTS: int = 500
 
-# To query synonyms
-secondary_phenotype_query = """
-SELECT
-   id,
-   name,
-   CASE
-       WHEN synonyms_text ILIKE (? || '%') OR synonyms_text ILIKE ('%' || ' ' || ? || '%') THEN 'synonyms: ' || synonyms_text
-       ELSE NULL
-   END AS matched_column
-FROM
-   phenotypes
-WHERE
-   synonyms_text ILIKE (? || '%') OR synonyms_text ILIKE ('%' || ' ' || ? || '%')
+# Built once the phenotypes table is created (see `build_phenotype_search_index`): the searched columns lower-cased
+# ahead of time, so the lexical predicates are plain (vectorized) string comparisons instead of ILIKE patterns that
+# case-fold every row of the table for every search.
+phenotype_search_index_query = """
+CREATE OR REPLACE TABLE phenotype_search AS
+SELECT id,
+       lower(id) AS id_lc,
+       lower(coalesce(name, '')) AS name_lc,
+       lower(coalesce(synonyms_text, '')) AS synonyms_lc,
+       lower(coalesce(dbXRefs_text, '')) AS dbxrefs_lc
+FROM phenotypes
+ORDER BY id
 """
 
-# Full text search query
-fts_phenotype_query = """
-WITH fts_results AS (
-    SELECT 
-        id, 
-        name,
-        synonyms_text,
-        fts_main_phenotypes.match_bm25(id, ?, conjunctive := 1, fields := 'name') AS name_score,
-        fts_main_phenotypes.match_bm25(id, ?, conjunctive := 1, fields := 'synonyms_text') AS synonym_score
+# Same columns computed on the fly, for databases built before the search table existed
+phenotype_search_fallback = """(
+    SELECT id, lower(id) AS id_lc, lower(coalesce(name, '')) AS name_lc,
+           lower(coalesce(synonyms_text, '')) AS synonyms_lc, lower(coalesce(dbXRefs_text, '')) AS dbxrefs_lc
     FROM phenotypes
+)"""
+
+# Ranked, deduplicated and paginated lexical search. A phenotype is returned once, with its best tier:
+#   1-3 name equal to / starting with / having a word starting with the query, 4 id starting with the query,
+#   5 dbXRefs containing the query, 6-7 full text match on the name / synonyms (by BM25 score),
+#   8 synonyms having a word starting with the query, 9-10 name / synonyms containing the query
+# Only the ids are ranked, the text columns are read for the rows of the requested page.
+lexical_search_query = """
+WITH lexical_matches AS (
+    SELECT id, tier, 0.0 AS sub_order
+    FROM (
+        SELECT id,
+               CASE
+                   WHEN name_lc = lower($query) THEN 1
+                   WHEN starts_with(name_lc, lower($query)) THEN 2
+                   WHEN contains(name_lc, ' ' || lower($query)) THEN 3
+                   WHEN starts_with(id_lc, lower($query)) THEN 4
+                   WHEN contains(dbxrefs_lc, lower($query)) THEN 5
+                   WHEN starts_with(synonyms_lc, lower($query)) OR contains(synonyms_lc, ' ' || lower($query)) THEN 8
+                   WHEN contains(name_lc, lower($query)) THEN 9
+                   WHEN contains(synonyms_lc, lower($query)) THEN 10
+               END AS tier
+        FROM {search_table}
+    )
+    WHERE tier IS NOT NULL
+),
+fts_results AS (
+    SELECT id,
+           fts_main_phenotypes.match_bm25(id, $query, conjunctive := 1, fields := 'name') AS name_score,
+           fts_main_phenotypes.match_bm25(id, $query, conjunctive := 1, fields := 'synonyms_text') AS synonym_score
+    FROM phenotypes
+),
+fts_matches AS (
+    SELECT id, 6 AS tier, -name_score AS sub_order FROM fts_results WHERE name_score IS NOT NULL
+    UNION ALL
+    SELECT id, 7 AS tier, -synonym_score AS sub_order FROM fts_results WHERE synonym_score IS NOT NULL
+),
+best_matches AS (
+    SELECT *, row_number() OVER (PARTITION BY id ORDER BY tier, sub_order) AS match_rank
+    FROM (SELECT * FROM lexical_matches UNION ALL SELECT * FROM fts_matches)
+),
+page AS (
+    SELECT id, tier, sub_order, count(*) OVER () AS total
+    FROM best_matches
+    WHERE match_rank = 1
+    ORDER BY tier, sub_order, id
+    LIMIT $limit OFFSET $offset
 )
-SELECT id, name, matched_column
-FROM (
-    SELECT 
-        id,
-        name,
-        'name: ' || name AS matched_column,
-        name_score AS score
-    FROM fts_results
-    WHERE name_score IS NOT NULL
-    UNION
-    SELECT 
-        id,
-        name,
-        'synonyms: ' || synonyms_text AS matched_column,
-        synonym_score AS score
-    FROM fts_results
-    WHERE synonym_score IS NOT NULL
-) AS all_matches
-ORDER BY 
-    CASE 
-        WHEN matched_column ILIKE 'name:%' THEN 1
-        WHEN matched_column ILIKE 'synonyms:%' THEN 2
-    END,
-    score DESC
+SELECT p.id,
+       p.name,
+       CASE
+           WHEN page.tier <= 5 AND starts_with(lower(p.id), lower($query)) THEN 'id: ' || p.id
+           WHEN page.tier <= 5 AND contains(lower(p.dbXRefs_text), lower($query)) THEN 'dbXRef: ' || p.dbXRefs_text
+           WHEN page.tier IN (7, 8, 10) THEN 'synonyms: ' || p.synonyms_text
+           ELSE 'name: ' || p.name
+       END AS matched_column,
+       page.total
+FROM page JOIN phenotypes p USING (id)
+ORDER BY page.tier, page.sub_order, page.id
 """
 
-# catchall query
-substring_query = """
-SELECT
-   id,
-   name,
-   CASE
-       WHEN name ILIKE ('%' || ? || '%') THEN 'name: ' || name
-       WHEN synonyms_text ILIKE ('%' || ? || '%') THEN 'synonyms: ' || synonyms_text
-       ELSE NULL
-   END AS matched_column
-FROM
-   phenotypes
-WHERE
-   name ILIKE ('%' || ? || '%') OR
-   synonyms_text ILIKE ('%' || ? || '%')
-ORDER BY
-   CASE
-       WHEN name ILIKE ('%' || ? || '%') THEN 1
-       WHEN synonyms_text ILIKE ('%' || ? || '%') THEN 2
-       ELSE 3
-   END
-"""
 
-def get_db_connection() -> DuckDBPyConnection: 
+def build_phenotype_search_index(conn: "DuckDBPyConnection"):
+    """
+    Build the normalized search table of the phenotype search, to run whenever the phenotypes table is (re)created.
+
+    Args:
+        conn (DuckDBPyConnection): Writable connection to the entity search database.
+    """
+    conn.execute(phenotype_search_index_query)
+    conn.execute("CHECKPOINT")
+
+
+class _SearchPool:
+    """ Cursors on one long-lived read-only connection to the database and the LRU of recent searches """
+
+    def __init__(self, path: str):
+        # duckdb is only needed by the search routes, import it on first use
+        import duckdb
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        self.connection = duckdb.connect(path, read_only=True)
+        self.has_index = self.connection.execute(
+            "SELECT count(*) > 0 FROM information_schema.tables WHERE table_name = 'phenotype_search'"
+        ).fetchone()[0]
+        if not self.has_index:
+            print("Phenotype search table not built, lexical search normalizes the phenotypes on every query")
+        self.cursors: "queue.Queue[DuckDBPyConnection]" = queue.Queue()
+        self.results: "OrderedDict[str, Tuple[int, List[Dict[str, Any]]]]" = OrderedDict()
+        self.results_lock = threading.Lock()
+
+    def acquire(self) -> "DuckDBPyConnection":
+        try:
+            return self.cursors.get_nowait()
+        except queue.Empty:
+            return self.connection.cursor()
+
+    def release(self, cursor: "DuckDBPyConnection"):
+        if self.cursors.qsize() < POOL_SIZE:
+            self.cursors.put(cursor)
+        else:
+            cursor.close()
+
+
+_pool: Optional[_SearchPool] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> _SearchPool:
+    """ Return the pool, reopened when the database file has been replaced """
+    global _pool
+    with _pool_lock:
+        if _pool is None or os.path.getmtime(db_file_path) != _pool.mtime:
+            _pool = _SearchPool(db_file_path)
+        return _pool
+
+
+def get_db_connection() -> Iterator["DuckDBPyConnection"]:
     if not db_file_path:
         raise HTTPException(status_code=500, detail="Database path is not set")
-    conn = duckdb.connect(db_file_path, read_only=True)
+    pool = _get_pool()
+    cursor = pool.acquire()
     try:
-        yield conn
+        yield cursor
     finally:
-        conn.close()
-
-
-def lexical_phenotype_search(search_string: str, conn: DuckDBPyConnection) -> DataFrame:
-   """
-   Query the database for phenotypes lexically matching the search term with a result limit.
-  
-   Parameters:
-       search_term (str): The search term for filtering phenotypes.
-       limit (int): Maximum number of results to return.
-       conn (DuckDBPyConnection): The database connection.
-
-
-   Returns:
-       List[Dict]: Query results as a list of dictionaries.
-   """
-   query = f"({primary_phenotype_query}) UNION ALL ({fts_phenotype_query}) UNION ALL ({secondary_phenotype_query}) UNION ALL ({substring_query})"
-   results = conn.execute(query, (search_string, ) * query.count('?')).df()
-   results.drop_duplicates(subset = ['id', 'name'], keep = 'first', inplace = True)
-   if results.empty:
-    return DataFrame()
-   return results
+        pool.release(cursor)
+
+
+def _run_search(conn: "DuckDBPyConnection", search_string: str, offset: int, limit: int,
+                has_index: bool) -> Tuple[int, List[Dict[str, Any]]]:
+    query = lexical_search_query.format(search_table="phenotype_search" if has_index else phenotype_search_fallback)
+    rows = conn.execute(query, {"query": search_string, "limit": limit, "offset": offset}).fetchall()
+    if not rows and offset > 0:
+        # past the last result, the page has no row carrying the total
+        return _run_search(conn, search_string, 0, 1, has_index)[0], []
+    total = rows[0][3] if rows else 0
+    return total, [{"id": id, "name": name, "matched_column": matched_column} for id, name, matched_column, _ in rows]
+
+
+def lexical_phenotype_search(search_string: str, conn: "DuckDBPyConnection", offset: int = 0,
+                             limit: int = 20) -> Tuple[int, List[Dict[str, Any]]]:
+    """
+    Query the database for a page of the phenotypes lexically matching the search term.
+
+    The first SEARCH_CACHE_RESULTS results of recent searches are kept, so paging through them doesn't query again.
+
+    Parameters:
+        search_string (str): The search term for filtering phenotypes.
+        conn (DuckDBPyConnection): The database connection (from `get_db_connection`).
+        offset (int): Index of the first result to return.
+        limit (int): Maximum number of results to return.
+
+    Returns:
+        Tuple[int, List[Dict]]: Total number of matching phenotypes and the page of results (id, name and
+            matched_column), best matches first.
+    """
+    pool = _get_pool()
+    key = search_string.lower()
+    with pool.results_lock:
+        cached = pool.results.get(key)
+        if cached is not None:
+            pool.results.move_to_end(key)
+    if cached is not None:
+        total, rows = cached
+        if offset + limit <= len(rows) or len(rows) == total:
+            return total, rows[offset:offset + limit]
+
+    if offset + limit > SEARCH_CACHE_RESULTS:
+        return _run_search(conn, search_string, offset, limit, pool.has_index)
+
+    total, rows = _run_search(conn, search_string, 0, SEARCH_CACHE_RESULTS, pool.has_index)
+    with pool.results_lock:
+        pool.results[key] = (total, rows)
+        pool.results.move_to_end(key)
+        while len(pool.results) > SEARCH_CACHE_SIZE:
+            pool.results.popitem(last=False)
+    return total, rows[offset:offset + limit]
+
+
+# Autocomplete: completions are served from an in-memory prefix index, rebuilt when its source files change
+AUTOCOMPLETE_MAX_LIMIT: int = 50
+# Prefixes matching more keys than this have their completions precomputed, the others are ranked on the fly
+AUTOCOMPLETE_MAX_SCAN: int = 256
+# Longer keys are truncated, completions only need their beginning
+AUTOCOMPLETE_KEY_LENGTH: int = 64
+
+# Kinds of keys, best ranked first: label of the completion (prefix of the key) and whether the key is the whole text
+_NAME, _ID, _SYNONYM, _XREF, _NAME_WORD, _SYNONYM_WORD = range(6)
+_KIND_LABELS = {_NAME: "name", _ID: "id", _SYNONYM: "synonyms", _XREF: "dbXRef", _NAME_WORD: "name",
+                _SYNONYM_WORD: "synonyms"}
+_WORD_START = re.compile(r"(?<=[\s\-(/,])(?=\w)")
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def _split(text: Optional[str], separators: str) -> List[str]:
+    return [value.strip() for value in re.split(separators, text or "") if value.strip()]
+
+
+class _AutocompleteIndex:
+    """
+    Sorted array of the normalized keys (names, synonyms and xrefs, and the names and synonyms from each of their
+    words) with, for every key, its entity and a rank weight. A prefix query is a binary search for the range of keys
+    starting with it.
+    """
+
+    def __init__(self, sources: Dict[str, Optional[float]]):
+        self.sources = sources
+        self.ids: List[str] = []
+        self.names: List[str] = []
+        self.entity_sources: List[str] = []
+        self.entity_of: Dict[str, int] = {}
+        entries: List[Tuple[str, int, int, int, str]] = []
+
+        def add_entity(id: str, name: str, source: str) -> int:
+            index = self.entity_of.get(id)
+            if index is None:
+                index = self.entity_of[id] = len(self.ids)
+                self.ids.append(id)
+                self.names.append(name)
+                self.entity_sources.append(source)
+            return index
+
+        def add_keys(entity: int, text: str, kind: int, word_kind: Optional[int] = None):
+            normalized = _normalize(text)
+            if not normalized:
+                return
+            weight = kind * 10000 + min(len(normalized), 9999)
+            entries.append((normalized[:AUTOCOMPLETE_KEY_LENGTH], weight, entity, kind, text))
+            if word_kind is not None:
+                weight = word_kind * 10000 + min(len(normalized), 9999)
+                for match in _WORD_START.finditer(normalized):
+                    entries.append((normalized[match.start():][:AUTOCOMPLETE_KEY_LENGTH], weight, entity, word_kind,
+                                    text))
+
+        for id, name, synonyms, xrefs in self._load_phenotypes():
+            entity = add_entity(id, name or id, "phenotype")
+            add_keys(entity, id, _ID)
+            add_keys(entity, name or "", _NAME, _NAME_WORD)
+            for synonym in _split(synonyms, r"[;|]"):
+                add_keys(entity, synonym, _SYNONYM, _SYNONYM_WORD)
+            for xref in _split(xrefs, r"[;|,\s]"):
+                add_keys(entity, xref, _XREF)
+        for id, name in self._load_diseases():
+            known = id in self.entity_of
+            entity = add_entity(id, name, "disease")
+            if not known:
+                add_keys(entity, id, _ID)
+            if not known or _normalize(self.names[entity]) != _normalize(name):
+                add_keys(entity, name, _NAME, _NAME_WORD)
+
+        entries.sort()
+        self.keys: List[str] = [entry[0] for entry in entries]
+        self.weights: List[int] = [entry[1] for entry in entries]
+        self.entities: List[int] = [entry[2] for entry in entries]
+        self.kinds: List[int] = [entry[3] for entry in entries]
+        self.texts: List[str] = [entry[4] for entry in entries]
+        self.top: Dict[str, List[int]] = self._precompute()
+
+    def _load_phenotypes(self) -> List[Tuple[str, str, str, str]]:
+        if self.sources.get(db_file_path) is None:
+            return []
+        pool = _get_pool()
+        cursor = pool.acquire()
+        try:
+            return cursor.execute("SELECT id, name, synonyms_text, dbXRefs_text FROM phenotypes").fetchall()
+        finally:
+            pool.release(cursor)
+
+    def _load_diseases(self) -> Iterator[Tuple[str, str]]:
+        if self.sources.get(diseases_file_path) is None:
+            return
+        with open(diseases_file_path) as f:
+            for line in f:
+                disease = json.loads(line)
+                if disease.get("id") and disease.get("name"):
+                    yield disease["id"], disease["name"]
+
+    def _rank(self, lo: int, hi: int, limit: int) -> List[int]:
+        """ Best key of each of the `limit` best entities among the keys lo..hi """
+        candidates = heapq.nsmallest(limit * 4, range(lo, hi), key=self.weights.__getitem__)
+        if len(candidates) < hi - lo:
+            ranked = self._dedupe(candidates, limit)
+            if len(ranked) == limit:
+                return ranked
+            # a few entities match through many keys, rank all of them
+            candidates = sorted(range(lo, hi), key=self.weights.__getitem__)
+        return self._dedupe(candidates, limit)
+
+    def _dedupe(self, candidates: List[int], limit: int) -> List[int]:
+        seen, ranked = set(), []
+        for entry in candidates:
+            if self.entities[entry] not in seen:
+                seen.add(self.entities[entry])
+                ranked.append(entry)
+                if len(ranked) == limit:
+                    break
+        return ranked
+
+    def _precompute(self, lo: int = 0, hi: Optional[int] = None, prefix: str = "",
+                    top: Optional[Dict[str, List[int]]] = None) -> Dict[str, List[int]]:
+        """
+        Completions of every prefix matching more than AUTOCOMPLETE_MAX_SCAN keys, built bottom-up: the completions of
+        a prefix are the best among the completions of its longer prefixes and its own remaining keys.
+        """
+        hi = len(self.keys) if hi is None else hi
+        top = {} if top is None else top
+        depth = len(prefix)
+        candidates = []
+        while lo < hi and len(self.keys[lo]) == depth:
+            candidates.append(lo)
+            lo += 1
+        while lo < hi:
+            extended = self.keys[lo][:depth + 1]
+            end = bisect_left(self.keys, _successor(extended), lo, hi)
+            if end - lo > AUTOCOMPLETE_MAX_SCAN:
+                self._precompute(lo, end, extended, top)
+                candidates.extend(top[extended])
+            else:
+                candidates.extend(self._rank(lo, end, AUTOCOMPLETE_MAX_LIMIT))
+            lo = end
+        if prefix:
+            top[prefix] = self._dedupe(sorted(candidates, key=self.weights.__getitem__), AUTOCOMPLETE_MAX_LIMIT)
+        return top
+
+    def complete(self, prefix: str, limit: int) -> List[Dict[str, str]]:
+        prefix = _normalize(prefix)[:AUTOCOMPLETE_KEY_LENGTH]
+        if not prefix:
+            return []
+        limit = min(max(limit, 1), AUTOCOMPLETE_MAX_LIMIT)
+        ranked = self.top.get(prefix)
+        if ranked is None:
+            lo = bisect_left(self.keys, prefix)
+            ranked = self._rank(lo, bisect_left(self.keys, _successor(prefix), lo), limit)
+        return [self._format(entry) for entry in ranked[:limit]]
+
+    def _format(self, entry: int) -> Dict[str, str]:
+        entity = self.entities[entry]
+        return {"id": self.ids[entity], "name": self.names[entity],
+                "matched_column": f"{_KIND_LABELS[self.kinds[entry]]}: {self.texts[entry]}",
+                "source": self.entity_sources[entity]}
+
+
+def _successor(prefix: str) -> str:
+    """ Smallest string greater than every string starting with `prefix` """
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _source_mtimes() -> Dict[str, Optional[float]]:
+    return {path: os.path.getmtime(path) if os.path.exists(path) else None
+            for path in (db_file_path, diseases_file_path)}
+
+
+_autocomplete_index: Optional[_AutocompleteIndex] = None
+_autocomplete_lock = threading.Lock()
+
+
+def _get_autocomplete_index() -> _AutocompleteIndex:
+    """ Return the index, rebuilt when a source file changed. Requests keep using the previous one meanwhile. """
+    global _autocomplete_index
+    sources = _source_mtimes()
+    index = _autocomplete_index
+    if index is not None and index.sources == sources:
+        return index
+    # only the first index is waited for, a rebuild runs in a single request
+    if not _autocomplete_lock.acquire(blocking=index is None):
+        return index
+    try:
+        if _autocomplete_index is None or _autocomplete_index.sources != sources:
+            print("Building the phenotype autocomplete index")
+            _autocomplete_index = _AutocompleteIndex(sources)
+        return _autocomplete_index
+    finally:
+        _autocomplete_lock.release()
+
+
+def autocomplete_phenotypes(prefix: str, limit: int = 10) -> List[Dict[str, str]]:
+    """
+    Complete a partially typed phenotype or disease.
+
+    Matches the start of the names, synonyms, ids and dbXRefs of the phenotypes and of the disease names, and the
+    start of any word of the names and synonyms. Whole names rank first, then ids, synonyms, dbXRefs and word matches,
+    shorter matches first within each.
+
+    Args:
+        prefix (str): The typed text.
+        limit (int): Maximum number of completions, up to AUTOCOMPLETE_MAX_LIMIT.
+
+    Returns:
+        List[Dict]: Completions (id, name, matched_column and source, "phenotype" or "disease"), best first.
+    """
+    return _get_autocomplete_index().complete(prefix, limit)
+
+
+def warm_autocomplete_index():
+    """ Build the autocomplete index ahead of the first request """
+    try:
+        _get_autocomplete_index()
+    except Exception as e:
+        print(f"Phenotype autocomplete index not built: {e}")
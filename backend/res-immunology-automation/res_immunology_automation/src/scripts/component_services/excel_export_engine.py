@@ -0,0 +1,222 @@
+"""
+Streaming Excel export engine.
+
+Templates are parsed once per process and kept in memory as a light description of every sheet: styled header
+and static cells, column widths, sheet views, tables, pivot tables and charts. Each export creates a write-only
+workbook from that description and streams data rows into it, so memory stays flat however many rows are
+exported, and writes it to a unique temporary file so concurrent exports never share an output path.
+"""
+import copy
+import os
+import tempfile
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment
+from openpyxl.utils import get_column_letter, range_boundaries
+
+# Directory for generated exports, files are removed once the response has been sent
+EXPORT_TMP_DIR: str = os.getenv("EXCEL_EXPORT_TMP_DIR", tempfile.gettempdir())
+
+
+class ExportCell(NamedTuple):
+    """ A cell value with an optional hyperlink and alignment, plain values can be used for other cells """
+    value: Any
+    hyperlink: Optional[str] = None
+    alignment: Optional[Alignment] = None
+
+
+class CellStyle(NamedTuple):
+    font: Any
+    fill: Any
+    border: Any
+    alignment: Any
+    number_format: str
+    protection: Any
+
+
+class TemplateSheet(NamedTuple):
+    title: str
+    active: bool
+    rows: List[List[Tuple[Any, Optional[CellStyle]]]]
+    row_heights: Dict[int, float]
+    column_dimensions: Dict[str, Any]
+    views: Any
+    sheet_properties: Any
+    sheet_format: Any
+    merged_cells: List[str]
+    conditional_formatting: Any
+    data_validations: Any
+    auto_filter: Optional[str]
+    tables: List[Any]
+    pivots: List[Any]
+    charts: List[Any]
+
+
+def _cell_style(cell) -> Optional[CellStyle]:
+    if not cell.has_style:
+        return None
+    return CellStyle(copy.copy(cell.font), copy.copy(cell.fill), copy.copy(cell.border),
+                     copy.copy(cell.alignment), cell.number_format, copy.copy(cell.protection))
+
+
+def _apply_style(cell: WriteOnlyCell, style: Optional[CellStyle]):
+    if style is None:
+        return
+    cell.font = style.font
+    cell.fill = style.fill
+    cell.border = style.border
+    cell.alignment = style.alignment
+    cell.number_format = style.number_format
+    cell.protection = style.protection
+
+
+@lru_cache(maxsize=None)
+def load_template(template_path: str, data_sheets: Tuple[str, ...]) -> List[TemplateSheet]:
+    """
+    Parse an Excel template once.
+
+    Args:
+        template_path (str): Path to the .xltx template.
+        data_sheets (Tuple[str, ...]): Sheets whose rows are replaced by exported data, only their header row is kept.
+
+    Returns:
+        List[TemplateSheet]: Description of every sheet in workbook order.
+    """
+    workbook = load_workbook(template_path)
+    sheets: List[TemplateSheet] = []
+    for ws in workbook.worksheets:
+        max_row: int = 1 if ws.title in data_sheets else ws.max_row
+        rows = [[(cell.value, _cell_style(cell)) for cell in row]
+                for row in ws.iter_rows(min_row=1, max_row=max_row)]
+
+        for pivot in ws._pivots:
+            # pivots are rebuilt by Excel from the exported data when the file is opened
+            pivot.cache.refreshOnLoad = True
+            pivot.cache.records = None
+            pivot.cache.saveData = False
+
+        sheets.append(TemplateSheet(
+            title=ws.title,
+            active=ws is workbook.active,
+            rows=rows,
+            row_heights={idx: dim.height for idx, dim in ws.row_dimensions.items() if idx <= max_row and dim.height},
+            column_dimensions=dict(ws.column_dimensions.items()),
+            views=ws.views,
+            sheet_properties=ws.sheet_properties,
+            sheet_format=ws.sheet_format,
+            merged_cells=[str(merged) for merged in ws.merged_cells.ranges],
+            conditional_formatting=ws.conditional_formatting,
+            data_validations=ws.data_validations,
+            auto_filter=ws.auto_filter.ref,
+            tables=list(ws.tables.values()),
+            pivots=list(ws._pivots),
+            charts=list(ws._charts),
+        ))
+    return sheets
+
+
+def _resize_range(ref: str, last_row: int) -> str:
+    """ Extend or shrink a range such as A1:F505 to end at the given row """
+    min_col, min_row, max_col, _ = range_boundaries(ref)
+    return f"{get_column_letter(min_col)}{min_row}:{get_column_letter(max_col)}{max(last_row, min_row + 1)}"
+
+
+def _data_cells(ws, values: Sequence[Any]) -> List[Any]:
+    """ Convert a row of values to write-only cells where a hyperlink or alignment is needed """
+    cells: List[Any] = []
+    for value in values:
+        if not isinstance(value, ExportCell):
+            cells.append(value)
+            continue
+        cell = WriteOnlyCell(ws, value=value.value)
+        if value.hyperlink:
+            cell.hyperlink = value.hyperlink
+            cell.style = "Hyperlink"
+        if value.alignment is not None:
+            cell.alignment = value.alignment
+        cells.append(cell)
+    return cells
+
+
+def _template_cells(ws, row: List[Tuple[Any, Optional[CellStyle]]]) -> List[Any]:
+    cells: List[Any] = []
+    for value, style in row:
+        if style is None:
+            cells.append(value)
+            continue
+        cell = WriteOnlyCell(ws, value=value)
+        _apply_style(cell, style)
+        cells.append(cell)
+    return cells
+
+
+def export_workbook(template_path: str, sheet_rows: Dict[str, Iterable[Sequence[Any]]]) -> str:
+    """
+    Stream rows into a copy of an Excel template.
+
+    Args:
+        template_path (str): Path to the .xltx template.
+        sheet_rows (Dict[str, Iterable[Sequence[Any]]]): Data rows (without header) per sheet name. Rows are
+            consumed lazily in the template's sheet order. Values may be plain or ExportCell instances.
+
+    Returns:
+        str: Path of the generated .xlsx file, a unique temporary file the caller is responsible for removing.
+    """
+    template = load_template(template_path, tuple(sorted(sheet_rows)))
+    workbook = Workbook(write_only=True)
+
+    for idx, sheet in enumerate(template):
+        ws = workbook.create_sheet(sheet.title)
+        if sheet.active:
+            workbook.active = idx
+        ws.sheet_properties = copy.copy(sheet.sheet_properties)
+        ws.sheet_format = copy.copy(sheet.sheet_format)
+        ws.views = copy.deepcopy(sheet.views)
+        for key, dimension in sheet.column_dimensions.items():
+            ws.column_dimensions[key] = copy.copy(dimension)
+            ws.column_dimensions[key].parent = ws
+        for idx, height in sheet.row_heights.items():
+            ws.row_dimensions[idx].height = height
+        for merged in sheet.merged_cells:
+            ws.merged_cells.add(merged)
+        ws.conditional_formatting = sheet.conditional_formatting
+        ws.data_validations = sheet.data_validations
+
+        for row in sheet.rows:
+            ws.append(_template_cells(ws, row))
+        last_row: int = len(sheet.rows)
+
+        if sheet.title in sheet_rows:
+            for values in sheet_rows[sheet.title]:
+                ws.append(_data_cells(ws, values))
+                last_row += 1
+            if sheet.auto_filter:
+                ws.auto_filter.ref = _resize_range(sheet.auto_filter, last_row)
+        elif sheet.auto_filter:
+            ws.auto_filter.ref = sheet.auto_filter
+
+        for table in sheet.tables:
+            table = copy.deepcopy(table)
+            if sheet.title in sheet_rows:
+                table.ref = _resize_range(table.ref, last_row)
+                if table.autoFilter is not None:
+                    table.autoFilter.ref = table.ref
+            # the template tables already carry their column definitions
+            ws.tables.add(table)
+        for pivot in sheet.pivots:
+            ws._pivots.append(copy.deepcopy(pivot))
+        for chart in sheet.charts:
+            ws.add_chart(copy.deepcopy(chart))
+
+    os.makedirs(EXPORT_TMP_DIR, exist_ok=True)
+    file_descriptor, output_path = tempfile.mkstemp(prefix="export_", suffix=".xlsx", dir=EXPORT_TMP_DIR)
+    os.close(file_descriptor)
+    try:
+        workbook.save(output_path)
+    except Exception:
+        os.remove(output_path)
+        raise
+    return output_path
@@ -0,0 +1,302 @@
+"""
+Local mirror of the GWAS Catalog studies and the PGS Catalog scores.
+
+`sync_mirror` downloads the public catalogs into MIRROR_DIR and rebuilds a DuckDB store from them, the genomics
+endpoints then query the store instead of calling the live APIs for every trait. Refreshes are incremental: the GWAS
+Catalog downloads are only fetched again when their ETag/Last-Modified changes and the PGS Catalog scores only
+when a new PGS Catalog release is out. The store is only rebuilt when a source changed.
+"""
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional
+
+import requests
+
+from component_services.genomics_services import format_pgs_score
+from component_services.locus_zoom_services import gwas_data_path
+from serialization import dump_file, dumps, loads
+
+if TYPE_CHECKING:
+    from duckdb import DuckDBPyConnection
+
+MIRROR_DIR: str = os.getenv("GENOMICS_MIRROR_DIR", gwas_data_path)
+MIRROR_PATH: str = os.path.join(MIRROR_DIR, "genomics_mirror.duckdb")
+DOWNLOADS_DIR: str = os.path.join(MIRROR_DIR, "mirror_downloads")
+SYNC_STATE_PATH: str = os.path.join(DOWNLOADS_DIR, "sync_state.json")
+
+GWAS_STUDIES_URL: str = os.getenv("GWAS_STUDIES_URL", "https://www.ebi.ac.uk/gwas/api/search/downloads/studies_alternative")
+GWAS_ANCESTRIES_URL: str = os.getenv("GWAS_ANCESTRIES_URL", "https://www.ebi.ac.uk/gwas/api/search/downloads/ancestry")
+PGS_REST_URL: str = os.getenv("PGS_REST_URL", "https://www.pgscatalog.org/rest")
+PGS_PAGE_SIZE: int = 250
+REQUEST_TIMEOUT: int = 300
+
+GWAS_STUDIES_FILE: str = "gwas_studies.tsv"
+GWAS_ANCESTRIES_FILE: str = "gwas_ancestries.tsv"
+PGS_SCORES_FILE: str = "pgs_scores.jsonl"
+PGS_TRAITS_FILE: str = "pgs_traits.jsonl"
+
+
+def _connect(path: str, read_only: bool) -> "DuckDBPyConnection":
+    # duckdb is only needed by the genomics routes, import it on first use
+    import duckdb
+    return duckdb.connect(path, read_only=read_only)
+
+
+def _load_state() -> Dict[str, Any]:
+    if not os.path.exists(SYNC_STATE_PATH):
+        return {}
+    with open(SYNC_STATE_PATH, "rb") as file:
+        return loads(file.read())
+
+
+def _download(url: str, file_name: str, state: Dict[str, Any]) -> bool:
+    """
+    Download a catalog file unless it is unchanged since the last sync.
+
+    Returns:
+        bool: True if a new version was downloaded.
+    """
+    file_path = os.path.join(DOWNLOADS_DIR, file_name)
+    previous = state.get(file_name, {})
+    headers = {}
+    if os.path.exists(file_path):
+        if previous.get("etag"):
+            headers["If-None-Match"] = previous["etag"]
+        if previous.get("last_modified"):
+            headers["If-Modified-Since"] = previous["last_modified"]
+
+    with requests.get(url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT) as response:
+        if response.status_code == 304:
+            print(f"{file_name} is up to date")
+            return False
+        response.raise_for_status()
+        fd, tmp_path = tempfile.mkstemp(dir=DOWNLOADS_DIR, suffix=".tmp")
+        with os.fdopen(fd, "wb") as file:
+            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                file.write(chunk)
+        os.replace(tmp_path, file_path)
+        state[file_name] = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "synced_at": datetime.now().isoformat(),
+        }
+    print(f"Downloaded {file_name}")
+    return True
+
+
+def _fetch_all_pages(url: str) -> Iterable[Dict[str, Any]]:
+    """ Yield the results of every page of a PGS Catalog REST listing """
+    params: Optional[Dict[str, Any]] = {"limit": PGS_PAGE_SIZE}
+    while url:
+        response = requests.get(url, params=params, timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        data = response.json()
+        yield from data.get("results", [])
+        url, params = data.get("next"), None
+
+
+def _write_jsonl(file_name: str, records: Iterable[Dict[str, Any]]):
+    fd, tmp_path = tempfile.mkstemp(dir=DOWNLOADS_DIR, suffix=".tmp")
+    with os.fdopen(fd, "wb") as file:
+        for record in records:
+            file.write(dumps(record) + b"\n")
+    os.replace(tmp_path, os.path.join(DOWNLOADS_DIR, file_name))
+
+
+def _sync_pgs(state: Dict[str, Any], force: bool) -> bool:
+    """
+    Download the PGS Catalog scores and trait mappings if a new release is out.
+
+    The scores are read from the REST listing rather than the CSV metadata dump, the CSV lacks the structured ancestry
+    distribution shown on the genomics page.
+
+    Returns:
+        bool: True if a new release was downloaded.
+    """
+    response = requests.get(f"{PGS_REST_URL}/release/current", timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    release: str = response.json().get("date", "")
+    files_present = all(os.path.exists(os.path.join(DOWNLOADS_DIR, name)) for name in [PGS_SCORES_FILE, PGS_TRAITS_FILE])
+    if not force and files_present and state.get("pgs_release") == release:
+        print(f"PGS Catalog release {release} is up to date")
+        return False
+
+    _write_jsonl(PGS_SCORES_FILE, (
+        {"pgs_id": score["id"], "data": format_pgs_score(score)}
+        for score in _fetch_all_pages(f"{PGS_REST_URL}/score/all") if score
+    ))
+    # a trait search returns the scores of the trait and of its child traits
+    _write_jsonl(PGS_TRAITS_FILE, (
+        {"efo_id": trait["id"],
+         "pgs_ids": sorted(set(trait.get("associated_pgs_ids", [])) | set(trait.get("child_associated_pgs_ids", [])))}
+        for trait in _fetch_all_pages(f"{PGS_REST_URL}/trait/all") if trait
+    ))
+    state["pgs_release"] = release
+    print(f"Downloaded PGS Catalog release {release}")
+    return True
+
+
+def build_mirror() -> str:
+    """
+    Rebuild the store from the downloaded catalogs.
+
+    Tables:
+        gwas_studies: one formatted study per accession, as returned by `gwas_services.format_gwas_study`.
+        gwas_study_traits: trait id -> study accession, from MAPPED_TRAIT_URI.
+        pgs_scores: one formatted score per PGS id, as returned by `genomics_services.format_pgs_score`.
+        pgs_trait_scores: trait id -> PGS id, including the scores of the child traits.
+
+    Returns:
+        str: Path of the store.
+    """
+    print("Building the genomics mirror")
+    studies_path = os.path.join(DOWNLOADS_DIR, GWAS_STUDIES_FILE)
+    ancestries_path = os.path.join(DOWNLOADS_DIR, GWAS_ANCESTRIES_FILE)
+    # DuckDB refuses to open an existing empty file, so the store is built in a private directory next to the mirror
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(MIRROR_PATH) or ".", suffix=".tmp")
+    tmp_path = os.path.join(tmp_dir, os.path.basename(MIRROR_PATH))
+    try:
+        conn = _connect(tmp_path, read_only=False)
+    except BaseException:
+        os.rmdir(tmp_dir)
+        raise
+    try:
+        conn.execute("""
+            CREATE TEMP TABLE ancestries AS
+            SELECT "STUDY ACCESSION" AS accession, lower("STAGE") AS stage,
+                   string_agg(trim(concat_ws(' ', format('{:,}', TRY_CAST("NUMBER OF INDIVIDUALS" AS BIGINT)),
+                                             "BROAD ANCESTRAL CATEGORY")), ', ') AS ancestry
+            FROM read_csv(?, delim = '\t', header = true, all_varchar = true, null_padding = true)
+            GROUP BY ALL
+        """, [ancestries_path])
+        conn.execute("""
+            CREATE TEMP TABLE raw_studies AS
+            SELECT * FROM read_csv(?, delim = '\t', header = true, all_varchar = true, null_padding = true)
+        """, [studies_path])
+        conn.execute("""
+            CREATE TABLE gwas_studies AS
+            SELECT s."STUDY ACCESSION" AS accession,
+                   coalesce(TRY_CAST(s."DATE" AS DATE), DATE '1900-01-01') AS publication_date,
+                   json_object(
+                       'First author', coalesce(nullif(s."FIRST AUTHOR", ''), 'Not available'),
+                       'Study accession', s."STUDY ACCESSION",
+                       'Pub. date', coalesce(nullif(s."DATE", ''), 'Not available'),
+                       'Journal', coalesce(nullif(s."JOURNAL", ''), 'Not available'),
+                       'Title', coalesce(nullif(s."STUDY", ''), 'Not available'),
+                       'Reported trait', coalesce(nullif(s."DISEASE/TRAIT", ''), 'Not available'),
+                       'Trait(s)', coalesce(nullif(split_part(s."MAPPED_TRAIT", ', ', 1), ''), 'Not available'),
+                       'Discovery sample ancestry', coalesce(nullif(d.ancestry, ''), 'Not available'),
+                       'Replication sample ancestry', coalesce(nullif(r.ancestry, ''), 'Not available'),
+                       'Association count', coalesce(TRY_CAST(s."ASSOCIATION COUNT" AS BIGINT), 0),
+                       'Summary statistics', coalesce(nullif(s."SUMMARY STATS LOCATION", ''), 'Not available')
+                   )::VARCHAR AS data
+            FROM raw_studies s
+            LEFT JOIN ancestries d ON d.accession = s."STUDY ACCESSION" AND d.stage = 'initial'
+            LEFT JOIN ancestries r ON r.accession = s."STUDY ACCESSION" AND r.stage = 'replication'
+            ORDER BY accession
+        """)
+        conn.execute("""
+            CREATE TABLE gwas_study_traits AS
+            SELECT DISTINCT regexp_extract(trim(uri), '[^/]+$') AS efo_id, "STUDY ACCESSION" AS accession
+            FROM (SELECT "STUDY ACCESSION", unnest(string_split("MAPPED_TRAIT_URI", ',')) AS uri FROM raw_studies)
+            WHERE trim(uri) <> ''
+            ORDER BY efo_id, accession
+        """)
+        conn.execute("""
+            CREATE TABLE pgs_scores AS
+            SELECT pgs_id, data::VARCHAR AS data
+            FROM read_json(?, format = 'newline_delimited', columns = {pgs_id: 'VARCHAR', data: 'JSON'})
+            ORDER BY pgs_id
+        """, [os.path.join(DOWNLOADS_DIR, PGS_SCORES_FILE)])
+        conn.execute("""
+            CREATE TABLE pgs_trait_scores AS
+            SELECT DISTINCT efo_id, unnest(pgs_ids) AS pgs_id
+            FROM read_json(?, format = 'newline_delimited', columns = {efo_id: 'VARCHAR', pgs_ids: 'VARCHAR[]'})
+            ORDER BY efo_id, pgs_id
+        """, [os.path.join(DOWNLOADS_DIR, PGS_TRAITS_FILE)])
+        conn.execute("CHECKPOINT")
+        conn.close()
+        # readers keep using the previous store until the new one is swapped in
+        os.replace(tmp_path, MIRROR_PATH)
+    finally:
+        conn.close()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return MIRROR_PATH
+
+
+def sync_mirror(force: bool = False) -> bool:
+    """
+    Refresh the downloaded catalogs and rebuild the store if any of them changed.
+
+    Args:
+        force (bool): Download and rebuild everything even if nothing changed.
+
+    Returns:
+        bool: True if the store was rebuilt.
+    """
+    os.makedirs(DOWNLOADS_DIR, exist_ok=True)
+    state = {} if force else _load_state()
+    changed = _download(GWAS_STUDIES_URL, GWAS_STUDIES_FILE, state)
+    changed = _download(GWAS_ANCESTRIES_URL, GWAS_ANCESTRIES_FILE, state) or changed
+    changed = _sync_pgs(state, force) or changed
+    dump_file(SYNC_STATE_PATH, state)
+
+    if not changed and os.path.exists(MIRROR_PATH):
+        print("Genomics mirror is up to date")
+        return False
+    build_mirror()
+    return True
+
+
+def _query_by_trait(query: str, efo_ids: List[str]) -> Optional[Dict[str, List[Dict[str, Any]]]]:
+    if not os.path.exists(MIRROR_PATH):
+        return None
+    trait_ids = {efo_id: efo_id.replace(':', '_') for efo_id in efo_ids}
+    by_trait_id: Dict[str, List[Dict[str, Any]]] = {}
+    conn = _connect(MIRROR_PATH, read_only=True)
+    try:
+        for trait_id, data in conn.execute(query, [list(set(trait_ids.values()))]).fetchall():
+            by_trait_id.setdefault(trait_id, []).append(loads(data))
+    finally:
+        conn.close()
+    return {efo_id: by_trait_id.get(trait_id, []) for efo_id, trait_id in trait_ids.items()}
+
+
+def query_gwas_studies(efo_ids: List[str]) -> Optional[Dict[str, List[Dict[str, Any]]]]:
+    """
+    Fetch the GWAS Catalog studies of several traits from the mirror in one query.
+
+    Args:
+        efo_ids (List[str]): Trait ids, e.g. EFO_0000270.
+
+    Returns:
+        Optional[Dict[str, List[Dict[str, Any]]]]: Trait id -> every study mapped to the trait (child traits are not
+            included, as with the live API call), most recent first. None if the mirror is not built.
+    """
+    return _query_by_trait("""
+        SELECT t.efo_id, s.data
+        FROM gwas_study_traits t JOIN gwas_studies s USING (accession)
+        WHERE t.efo_id IN (SELECT unnest(?))
+        ORDER BY t.efo_id, s.publication_date DESC, s.accession
+    """, efo_ids)
+
+
+def query_pgs_scores(efo_ids: List[str]) -> Optional[Dict[str, List[Dict[str, Any]]]]:
+    """
+    Fetch the PGS Catalog scores of several traits from the mirror in one query.
+
+    Args:
+        efo_ids (List[str]): Trait ids, e.g. EFO_0000270.
+
+    Returns:
+        Optional[Dict[str, List[Dict[str, Any]]]]: Trait id -> every score of the trait and its child traits, by PGS
+            id. None if the mirror is not built.
+    """
+    return _query_by_trait("""
+        SELECT t.efo_id, s.data
+        FROM pgs_trait_scores t JOIN pgs_scores s USING (pgs_id)
+        WHERE t.efo_id IN (SELECT unnest(?))
+        ORDER BY t.efo_id, s.pgs_id
+    """, efo_ids)
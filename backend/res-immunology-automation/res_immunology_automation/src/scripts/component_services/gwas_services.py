@@ -1,40 +1,48 @@
 import requests
+from typing import Any, Dict, List
+
+def format_gwas_study(study: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Format a study of the GWAS Catalog REST API (v2) for the genomics page.
+    """
+    if "efoTraits" not in study:
+        return {}
+    return {
+        "First author": study.get("firstAuthor") or "Not available",
+        "Study accession": study["accessionId"],
+        "Pub. date": study.get("publicationDate") or "Not available",
+        "Journal": study.get("journal") or "Not available",
+        "Title": study.get("title") or "Not available",
+        "Reported trait": study.get("reportedTrait") or "Not available",
+        "Trait(s)": study.get("efoTraits")[0].get("label") or "Not available",
+        "Discovery sample ancestry": study.get("discoverySampleAncestry") or "Not available",
+        "Replication sample ancestry": study.get("replicationSampleAncestry") or "Not available",
+        "Association count": study.get("associationCount") or 0,
+        "Summary statistics": study.get("summaryStatistics") or "Not available"
+    }
 
 def get_gwas_studies(efo_id):
 
     base_url = f"https://www.ebi.ac.uk/gwas/api/v2/efotraits/{efo_id}/studies/"
-    params = {"fullPvalueSet": False, "includeChildTraits": False, "includeBgTraits": False, "size": 1000}
+    params = {"fullPvalueSet": False, "includeChildTraits": False, "includeBgTraits": False, "size": 1000, "page": 0}
     headers = {"Accept": "application/json"}
 
-    response = requests.get(base_url, params = params, headers=headers)
-    if response.status_code != 200:
-        print(f"Error: {response.status_code}")
-        return None
-
-    data = response.json()
-    # print (data)
-    filtered_studies = []
-
-    if "_embedded" in data:
-        if 'studies' in data['_embedded']:
-            for study in data["_embedded"]["studies"]:
-                if "efoTraits" in study:
-                    trait = study.get("efoTraits")[0].get("label").lower()
-                    filtered_studies.append({
-                        "First author": study.get("firstAuthor") or "Not available",
-                        "Study accession": study["accessionId"],
-                        "Pub. date": study.get("publicationDate") or "Not available",
-                        "Journal": study.get("journal") or "Not available",
-                        "Title": study.get("title") or "Not available",
-                        "Reported trait": study.get("reportedTrait") or "Not available",
-                        "Trait(s)": study.get("efoTraits")[0].get("label") or "Not available",
-                        "Discovery sample ancestry": study.get("discoverySampleAncestry") or "Not available",
-                        "Replication sample ancestry": study.get("replicationSampleAncestry") or "Not available",
-                        "Association count": study.get("associationCount") or 0,
-                        "Summary statistics": study.get("summaryStatistics") or "Not available"
-                    })
-                else:
-                    filtered_studies.append({})
+    filtered_studies: List[Dict[str, Any]] = []
+    # studies are paginated, read every page instead of only the first `size` studies
+    while True:
+        response = requests.get(base_url, params = params, headers=headers)
+        if response.status_code != 200:
+            print(f"Error: {response.status_code}")
+            return filtered_studies or None
+
+        data = response.json()
+        for study in data.get("_embedded", {}).get("studies", []):
+            filtered_studies.append(format_gwas_study(study))
+
+        page = data.get("page", {})
+        if page.get("number", 0) + 1 >= page.get("totalPages", 0):
+            break
+        params["page"] = page["number"] + 1
 
     return filtered_studies
 
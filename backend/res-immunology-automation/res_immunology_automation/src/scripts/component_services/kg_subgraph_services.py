@@ -0,0 +1,361 @@
+"""
+Materialized metapath subgraphs of the knowledge graph.
+
+`refresh_subgraph_store` runs the DGPG and GGGD metapath queries of every target/disease pair of target_disease.json
+against ROBOKOP once and stores their Cytoscape.js elements in a DuckDB store, /fetch-graph/ then serves these pairs
+without resolving the diseases or querying the remote graph. The store also holds the equivalent identifiers of every
+disease node, so the queries of the other pairs match the diseases on their (indexed) `id` instead of scanning the
+`equivalent_identifiers` of every disease node.
+"""
+import asyncio
+import fcntl
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+from serialization import dumps, loads
+from component_services.cytoscape_formatter import CytoscapeGraph
+from utils import get_efo_id
+
+if TYPE_CHECKING:
+    import neo4j
+    from duckdb import DuckDBPyConnection
+
+SUBGRAPH_STORE_PATH: str = os.getenv("KG_SUBGRAPH_STORE_PATH", "cached_data_json/kg_subgraphs.duckdb")
+TARGET_DISEASE_FILE: str = "../disease_data/target_disease.json"
+# The API only refreshes the store in the background when enabled, otherwise it is rebuilt by build_kg_subgraphs.py
+REFRESH_ENABLED: bool = os.getenv("KG_SUBGRAPH_REFRESH", "false").lower() == "true"
+# Age after which the store is rebuilt in the background (0 disables the refresh), and how often it is checked
+REFRESH_INTERVAL: float = float(os.getenv("KG_SUBGRAPH_REFRESH_INTERVAL", str(7 * 24 * 3600)))
+REFRESH_CHECK_INTERVAL: float = 3600
+# Metapath queries run at once against ROBOKOP while the store is built
+BUILD_CONCURRENCY: int = int(os.getenv("KG_SUBGRAPH_BUILD_CONCURRENCY", "4"))
+# Records of a metapath query read at most, the graph is flagged as truncated beyond
+MAX_GRAPH_RECORDS: int = int(os.getenv("KG_MAX_GRAPH_RECORDS", "50000"))
+
+METAPATHS: Dict[str, Dict[str, Any]] = {
+    "DGPG": {
+        "match": "MATCH (d:`biolink:Disease`)-[r1]-(g1:`biolink:Gene`)-[r2]-(bp:`biolink:Pathway`)-[r3]-(g:`biolink:Gene`)",
+        "return": "RETURN d, r1, g1, r2, bp, r3, g",
+        "node_types": ['d', 'g1', 'bp', 'g'],
+        "edge_types": ['r1', 'r2', 'r3'],
+        "ranked_types": ['g1', 'bp'],
+    },
+    "GGGD": {
+        "match": 'MATCH(g:`biolink:Gene`)-[r1]-(g2:`biolink:Gene`)-[r2:`biolink:directly_physically_interacts_with`]-(g3)-[r3:`biolink:target_for`]-(d:`biolink:Disease`)',
+        "return": "RETURN g, r1, g2, r2, g3, r3, d",
+        "node_types": ['g', 'g2', 'g3', 'd'],
+        "edge_types": ['r1', 'r2', 'r3'],
+        "ranked_types": ['g2', 'g3'],
+    },
+}
+
+
+def metapath_query(metapath: str, by_equivalent_identifiers: bool = False) -> str:
+    """
+    Cypher query of a metapath for a target gene ($target_gene) and diseases ($diseases), returning at most $limit
+    records.
+
+    Args:
+        metapath (str): DGPG or GGGD.
+        by_equivalent_identifiers (bool): Also match the diseases on their equivalent identifiers, for when they
+            could not be resolved to node ids. This scans every disease node.
+
+    Returns:
+        str: The query.
+    """
+    disease_match = "d.id IN $diseases"
+    if by_equivalent_identifiers:
+        disease_match = "(d.id IN $diseases OR any(id in d.equivalent_identifiers WHERE id IN $diseases))"
+    return f"""
+        {METAPATHS[metapath]["match"]}
+        WHERE g.name = $target_gene
+        AND {disease_match}
+        {METAPATHS[metapath]["return"]}
+        LIMIT $limit
+    """
+
+
+def new_graph(metapath: str, all_properties: bool = False) -> CytoscapeGraph:
+    return CytoscapeGraph(METAPATHS[metapath]["node_types"], METAPATHS[metapath]["edge_types"],
+                          METAPATHS[metapath]["ranked_types"], all_properties)
+
+
+async def iter_metapath(graph: CytoscapeGraph, driver: "neo4j.AsyncDriver", metapath: str, target_gene: str,
+                        diseases: List[str], by_equivalent_identifiers: bool = False
+                        ) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    Run a metapath query, adding the records to `graph` as they are received.
+
+    At most MAX_GRAPH_RECORDS records are read, the graph is flagged as truncated if there are more.
+
+    Yields:
+        List[Dict[str, Any]]: The elements of a record not seen in the previous ones, nodes first.
+    """
+    async with driver.session() as session:
+        result = await session.run(
+            metapath_query(metapath, by_equivalent_identifiers),
+            parameters={"target_gene": target_gene, "diseases": diseases, "limit": MAX_GRAPH_RECORDS + 1}
+        )
+        async for record in result:
+            if graph.records == MAX_GRAPH_RECORDS:
+                graph.truncated = True
+                break
+            elements = graph.add(record)
+            if elements:
+                yield elements
+
+
+async def query_metapath(driver: "neo4j.AsyncDriver", metapath: str, target_gene: str, diseases: List[str],
+                         by_equivalent_identifiers: bool = False, all_properties: bool = False) -> CytoscapeGraph:
+    """
+    Run a metapath query, formatting the records as they are received (see `iter_metapath`).
+
+    Returns:
+        CytoscapeGraph: The graph of the records.
+    """
+    graph = new_graph(metapath, all_properties)
+    async for _ in iter_metapath(graph, driver, metapath, target_gene, diseases, by_equivalent_identifiers):
+        pass
+    return graph
+
+
+def _connect(path: str, read_only: bool) -> "DuckDBPyConnection":
+    # duckdb is only needed by the graph routes, import it on first use
+    import duckdb
+    return duckdb.connect(path, read_only=read_only)
+
+
+# mtime of the store, read-only connection to it and number of cursors open on the connection
+_store: Optional[Dict[str, Any]] = None
+_store_lock = threading.Lock()
+
+
+@contextmanager
+def _store_cursor() -> Iterator[Optional["DuckDBPyConnection"]]:
+    """
+    Cursor on the read-only connection to the store (None if the store is not built). When the store has been
+    rebuilt, the connection is closed and reopened once no cursor is open on it: closing it would close them, and
+    duckdb reuses the database of a connection still open on the path, the replaced file.
+    """
+    global _store
+    with _store_lock:
+        if not os.path.exists(SUBGRAPH_STORE_PATH):
+            store = None
+        else:
+            mtime = os.path.getmtime(SUBGRAPH_STORE_PATH)
+            if _store is not None and _store["mtime"] != mtime and _store["cursors"] == 0:
+                _store["conn"].close()
+                _store = None
+            if _store is None:
+                _store = {"mtime": mtime, "conn": _connect(SUBGRAPH_STORE_PATH, read_only=True), "cursors": 0}
+            store = _store
+            cursor = store["conn"].cursor()
+            store["cursors"] += 1
+    if store is None:
+        yield None
+        return
+    try:
+        yield cursor
+    finally:
+        cursor.close()
+        with _store_lock:
+            store["cursors"] -= 1
+
+
+def _identifier_forms(identifier: str) -> List[str]:
+    """ The identifier as given and as a CURIE (OpenTargets ids are EFO_0000270, ROBOKOP ones EFO:0000270) """
+    if ":" in identifier or "_" not in identifier:
+        return [identifier]
+    return [identifier, identifier.replace("_", ":", 1)]
+
+
+def _lookup_equivalent_ids(conn: "DuckDBPyConnection", identifiers: Iterable[str]) -> List[str]:
+    forms = sorted({form for identifier in identifiers if identifier for form in _identifier_forms(identifier)})
+    if not forms:
+        return []
+    rows = conn.execute("""
+        SELECT DISTINCT id FROM equivalent_identifiers WHERE equivalent_id IN (SELECT unnest(?::VARCHAR[])) ORDER BY id
+    """, [forms]).fetchall()
+    return [id for id, in rows]
+
+
+def resolve_disease_ids(identifiers: List[Optional[str]]) -> Optional[List[str]]:
+    """
+    Resolve disease identifiers (e.g. EFO ids) to the ids of the matching ROBOKOP disease nodes.
+
+    Args:
+        identifiers (List[Optional[str]]): Disease identifiers, any of the equivalent identifiers of a node.
+
+    Returns:
+        Optional[List[str]]: Ids of the disease nodes, None if the store is not built.
+    """
+    with _store_cursor() as conn:
+        if conn is None:
+            return None
+        return _lookup_equivalent_ids(conn, identifiers)
+
+
+def query_subgraphs(target_gene: str, diseases: List[str], metapath: str, top_k: Optional[int] = None,
+                    all_properties: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Fetch the graph of a target and diseases from the materialized subgraphs.
+
+    Args:
+        target_gene (str): Target gene symbol.
+        diseases (List[str]): Disease names.
+        metapath (str): DGPG or GGGD.
+        top_k (Optional[int]): Keep the top_k most connected intermediate nodes of each type (see
+            `CytoscapeGraph.elements`).
+        all_properties (bool): Return every property of the nodes and edges.
+
+    Returns:
+        Optional[Dict[str, Any]]: The /fetch-graph/ response, None if the store is not built or misses one of the
+            diseases.
+    """
+    disease_names = list(dict.fromkeys(disease.strip().lower() for disease in diseases))
+    with _store_cursor() as conn:
+        if conn is None:
+            return None
+        rows = conn.execute("""
+            SELECT disease, elements FROM subgraphs
+            WHERE target_gene = ? AND metapath = ? AND disease IN (SELECT unnest(?::VARCHAR[]))
+        """, [target_gene.strip().lower(), metapath, disease_names]).fetchall()
+    if len(rows) < len(disease_names):
+        return None
+
+    graph = new_graph(metapath, all_properties)
+    for _, elements in sorted(rows, key=lambda row: disease_names.index(row[0])):
+        graph.merge(loads(elements))
+    return graph.payload(top_k)
+
+
+async def _fetch_equivalent_identifiers(driver: "neo4j.AsyncDriver") -> pd.DataFrame:
+    """ Every identifier of every disease node (its id included) and the node id """
+    rows: List[Tuple[str, str]] = []
+    async with driver.session() as session:
+        result = await session.run(
+            "MATCH (d:`biolink:Disease`) RETURN d.id AS id, d.equivalent_identifiers AS equivalent_identifiers"
+        )
+        async for record in result:
+            for equivalent_id in {record["id"], *(record["equivalent_identifiers"] or [])}:
+                rows.append((equivalent_id, record["id"]))
+    return pd.DataFrame(rows, columns=["equivalent_id", "id"])
+
+
+def _write_store(equivalent_identifiers: pd.DataFrame, subgraphs: pd.DataFrame):
+    os.makedirs(os.path.dirname(SUBGRAPH_STORE_PATH) or ".", exist_ok=True)
+    # build next to the store and swap it in, readers keep using the previous file until then
+    tmp_path = f"{SUBGRAPH_STORE_PATH}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = _connect(tmp_path, read_only=False)
+    try:
+        conn.register("equivalent_identifiers_df", equivalent_identifiers)
+        conn.register("subgraphs_df", subgraphs)
+        conn.execute("""
+            CREATE TABLE equivalent_identifiers AS
+            SELECT DISTINCT equivalent_id, id FROM equivalent_identifiers_df ORDER BY equivalent_id
+        """)
+        conn.execute("CREATE TABLE subgraphs AS SELECT * FROM subgraphs_df ORDER BY target_gene, metapath, disease")
+        conn.execute("CHECKPOINT")
+    finally:
+        conn.close()
+    os.replace(tmp_path, SUBGRAPH_STORE_PATH)
+
+
+async def build_subgraph_store(driver: "neo4j.AsyncDriver") -> int:
+    """
+    Materialize the metapath subgraphs of every target/disease pair of target_disease.json.
+
+    Args:
+        driver (neo4j.AsyncDriver): Driver to ROBOKOP.
+
+    Returns:
+        int: Number of subgraphs stored. Pairs whose query failed are left out and queried live.
+    """
+    with open(TARGET_DISEASE_FILE, "rb") as f:
+        target_diseases: Dict[str, List[str]] = loads(f.read())
+    pairs = sorted({(target.strip().lower(), disease.strip().lower())
+                    for target, diseases in target_diseases.items() for disease in diseases})
+    disease_names = sorted({disease for _, disease in pairs})
+
+    print(f"Building the KG subgraph store: {len(pairs)} target/disease pairs")
+    efo_ids = dict(zip(disease_names, await asyncio.gather(
+        *(asyncio.to_thread(get_efo_id, disease) for disease in disease_names))))
+    equivalent_identifiers = await _fetch_equivalent_identifiers(driver)
+    node_ids: Dict[str, List[str]] = {}
+    for equivalent_id, id in equivalent_identifiers.itertuples(index=False):
+        node_ids.setdefault(equivalent_id, []).append(id)
+
+    semaphore = asyncio.Semaphore(BUILD_CONCURRENCY)
+
+    async def materialize(target: str, disease: str, metapath: str) -> Optional[Tuple[str, str, str, List[str], str]]:
+        efo_id = efo_ids[disease]
+        disease_ids = sorted({id for form in _identifier_forms(efo_id) for id in node_ids.get(form, [])}) \
+            if efo_id else []
+        graph = new_graph(metapath, all_properties=True)
+        if disease_ids:
+            try:
+                async with semaphore:
+                    graph = await query_metapath(driver, metapath, target.upper(), disease_ids, all_properties=True)
+            except Exception as e:
+                print(f"Error materializing {metapath} {target}/{disease}: {e}")
+                return None
+        return target, disease, metapath, disease_ids, dumps(graph.state()).decode("utf-8")
+
+    results = await asyncio.gather(*(materialize(target, disease, metapath)
+                                     for target, disease in pairs for metapath in METAPATHS))
+    subgraphs = pd.DataFrame([result for result in results if result is not None],
+                             columns=["target_gene", "disease", "metapath", "disease_ids", "elements"])
+    await asyncio.to_thread(_write_store, equivalent_identifiers, subgraphs)
+    print(f"KG subgraph store built: {len(subgraphs)}/{len(results)} subgraphs")
+    return len(subgraphs)
+
+
+def subgraph_store_age() -> Optional[float]:
+    """ Seconds since the store was built, None if it is not built """
+    if not os.path.exists(SUBGRAPH_STORE_PATH):
+        return None
+    return time.time() - os.path.getmtime(SUBGRAPH_STORE_PATH)
+
+
+async def refresh_subgraph_store(driver: "neo4j.AsyncDriver", force: bool = False) -> bool:
+    """
+    Rebuild the store if it is missing or older than REFRESH_INTERVAL, unless another process is rebuilding it.
+
+    Returns:
+        bool: True if the store was rebuilt.
+    """
+    age = subgraph_store_age()
+    if not force and age is not None and age < REFRESH_INTERVAL:
+        return False
+    os.makedirs(os.path.dirname(SUBGRAPH_STORE_PATH) or ".", exist_ok=True)
+    with open(f"{SUBGRAPH_STORE_PATH}.lock", "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        try:
+            age = subgraph_store_age()
+            if not force and age is not None and age < REFRESH_INTERVAL:
+                # another process rebuilt it meanwhile
+                return False
+            await build_subgraph_store(driver)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+    return True
+
+
+async def refresh_subgraph_store_periodically(driver: "neo4j.AsyncDriver"):
+    """ Keep the store fresh, for the lifetime of the application """
+    while True:
+        try:
+            await refresh_subgraph_store(driver)
+        except Exception as e:
+            print(f"Error refreshing the KG subgraph store: {e}")
+        await asyncio.sleep(min(REFRESH_INTERVAL, REFRESH_CHECK_INTERVAL))
@@ -1,77 +1,283 @@
+import os
+import threading
+import uuid
+from typing import TYPE_CHECKING, Dict, Optional
+
 import pandas as pd
-import numpy as np
-import os, csv
-# from populate_gwas_asso_data import filter_asso_by_efo_id, prepare_variants_data, fetch_ld_data
+
+if TYPE_CHECKING:
+    from duckdb import DuckDBPyConnection
 
 gwas_data_path = '/app/res-immunology-automation/res_immunology_automation/src/gwas_data'
+associations_file_path = os.path.join(gwas_data_path, 'associations.tsv')
+# Columnar copy of associations.tsv with a trait -> row index, built once and rebuilt when the TSV changes
+associations_store_path = os.path.join(gwas_data_path, 'associations.duckdb')
+
+CHROMOSOMES = [str(i) for i in range(1, 23)] + ["X", "Y"]
+# Association columns kept in the store and their name in the locus zoom file
+OTHER_COLUMNS = {"SNPS": "rsID", "PUBMEDID": "PubMed ID", "STRONGEST SNP-RISK ALLELE": "Variant and Risk Allele",
+                 "FIRST AUTHOR": "Author", "MAPPED_GENE": "Mapped gene(s)", "DISEASE/TRAIT": "Reported trait"}
+STORE_COLUMNS = ["CHR_ID", "CHR_POS", "P-VALUE", "MAPPED_TRAIT_URI"] + list(OTHER_COLUMNS)
+
+_build_lock = threading.Lock()
+# Builds of the per-trait files, one lock per file so concurrent first requests of a trait build it once
+_path_locks: Dict[str, threading.Lock] = {}
+_path_locks_lock = threading.Lock()
+
+
+def _path_lock(path: str) -> threading.Lock:
+    with _path_locks_lock:
+        return _path_locks.setdefault(path, threading.Lock())
+
 
-# # load Asso data Filter Asso data by EFOId and generate a variant df
-def filter_asso_by_efo_id(efo_id: str):
+def _tmp_path(path: str) -> str:
+    """ Unique temporary path next to `path`, concurrent builds (threads or processes) never share one """
+    return f"{path}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+
+
+def _quote(column: str) -> str:
+    return '"' + column.replace('"', '""') + '"'
+
+
+def _connect(read_only: bool, path: str = associations_store_path) -> "DuckDBPyConnection":
+    # duckdb is only needed by the locus zoom route, import it on first use
+    import duckdb
+    return duckdb.connect(path, read_only=read_only)
+
+
+def build_associations_store(force: bool = False) -> str:
     """
-    Filter the GWAS Association data for given efo_id
+    Ingest the GWAS Catalog associations.tsv into a DuckDB store.
+
+    The store holds the `associations` table (the columns needed for plotting, one row per association) and the
+    `trait_index` table mapping every trait id of MAPPED_TRAIT_URI to its rows, sorted by trait so a lookup only
+    scans the matching row groups.
+
+    Args:
+        force (bool): Rebuild even if the store is newer than associations.tsv.
+
+    Returns:
+        str: Path of the store.
     """
-    print("Filtering the Associations data")
-    filtered_df = None
-    associations_file_path = os.path.join(gwas_data_path, 'associations.tsv')
-    if os.path.exists(associations_file_path):
-        with open(associations_file_path, 'r') as file:
-            reader = csv.DictReader(file, delimiter='\t')
-            filtered_rows = [row for row in reader if efo_id in row.get('MAPPED_TRAIT_URI', '')]
-
-        if len(filtered_rows) > 0:
-            filtered_df = pd.DataFrame(filtered_rows)
-            return filtered_df
-        else:
-            raise ValueError(f"Associations data doesn't exists for given {efo_id}")
-    else:
-        raise FileNotFoundError("The GWAS Acssociations data file does not exist.")
-
-# Filter columns in variants file
-def prepare_variants_data(df):
+    with _build_lock:
+        if not os.path.exists(associations_file_path):
+            if os.path.exists(associations_store_path):
+                return associations_store_path
+            raise FileNotFoundError("The GWAS Acssociations data file does not exist.")
+
+        if (not force and os.path.exists(associations_store_path)
+                and os.path.getmtime(associations_store_path) >= os.path.getmtime(associations_file_path)):
+            return associations_store_path
+
+        print("Building the GWAS Associations store")
+        # build next to the store and swap it in, readers keep using the previous file until then
+        tmp_path = _tmp_path(associations_store_path)
+        columns = ", ".join(_quote(column) for column in STORE_COLUMNS)
+        conn = _connect(read_only=False, path=tmp_path)
+        try:
+            conn.execute(f"""
+                CREATE TABLE associations AS
+                SELECT row_number() OVER () AS row_id, {columns}
+                FROM read_csv(?, delim = '\t', header = true, all_varchar = true, null_padding = true)
+            """, [associations_file_path])
+            conn.execute("""
+                CREATE TABLE trait_index AS
+                SELECT DISTINCT regexp_extract(trim(uri), '[^/]+$') AS efo_id, row_id
+                FROM (SELECT row_id, unnest(string_split("MAPPED_TRAIT_URI", ',')) AS uri FROM associations)
+                WHERE trim(uri) <> ''
+                ORDER BY efo_id, row_id
+            """)
+            conn.execute('ALTER TABLE associations DROP COLUMN "MAPPED_TRAIT_URI"')
+            conn.execute("CHECKPOINT")
+        finally:
+            conn.close()
+        os.replace(tmp_path, associations_store_path)
+        return associations_store_path
+
+
+def query_variants_data(efo_id: str) -> pd.DataFrame:
     """
-    Drop unnecessary columns from variants data 
+    Fetch the plotting data of a trait from the associations store.
+
+    Filtering, type conversions, -log10 of the p-value and the chromosome ordering all run in a single query.
+
+    Args:
+        efo_id (str): Trait id, e.g. EFO_0000270.
+
+    Returns:
+        pd.DataFrame: pvalue, Neglog10(pvalue), Chromosome, Position and the OTHER_COLUMNS, sorted by chromosome.
+    """
+    store_path = build_associations_store()
+    print("Querying the Associations store")
+    chromosomes = ", ".join(f"'{chromosome}'" for chromosome in CHROMOSOMES)
+    other_columns = ", ".join(f"a.{_quote(column)} AS {_quote(name)}" for column, name in OTHER_COLUMNS.items())
+    conn = _connect(read_only=True, path=store_path)
+    try:
+        df = conn.execute(f"""
+            SELECT TRY_CAST(a."P-VALUE" AS DOUBLE) AS pvalue,
+                   -log10(NULLIF(TRY_CAST(a."P-VALUE" AS DOUBLE), 0)) AS "Neglog10(pvalue)",
+                   CASE WHEN a."CHR_ID" IN ({chromosomes}) THEN a."CHR_ID" END AS "Chromosome",
+                   TRY_CAST(a."CHR_POS" AS BIGINT) AS "Position",
+                   {other_columns}
+            FROM trait_index t JOIN associations a USING (row_id)
+            WHERE t.efo_id = ?
+            ORDER BY list_position([{chromosomes}], a."CHR_ID") NULLS LAST, a.row_id
+        """, [efo_id]).df()
+    finally:
+        conn.close()
+
+    if df.empty:
+        raise ValueError(f"Associations data doesn't exists for given {efo_id}")
+    return df
+
+
+def load_data(efo_id: str, refresh: bool = False) -> Optional[str]:
+    """
+    Return the path of the locus zoom file of a trait, generating it from the associations store if needed.
+
+    Args:
+        efo_id (str): Trait id.
+        refresh (bool): Regenerate the file even if it is newer than the store.
+
+    Returns:
+        Optional[str]: Path of the TSV file, None if the trait has no associations.
     """
-    print("Adjusting and Sorting by Chromosome")
-    new_df = pd.DataFrame() 
-    df.columns = [col.strip() for col in df.columns]  # Clean up column names
-    
-    # Detect necessary columns for plotting
-    required_columns = {"CHR_ID", "CHR_POS", "P-VALUE", "SNPS"}
-    other_cols = {"PUBMEDID":"PubMed ID", "STRONGEST SNP-RISK ALLELE": "Variant and Risk Allele","SNPS": "rsID", 
- "FIRST AUTHOR": "Author", "MAPPED_GENE": "Mapped gene(s)", "DISEASE/TRAIT":"Reported trait"}
-    if not required_columns.issubset(df.columns):
-        raise ValueError(f"TSV file must contain these columns: {required_columns}")
-    
-    # Add derived columns if necessary
-    if "Neglog10(pvalue)" not in df.columns:
-        df["P-VALUE"] = pd.to_numeric(df["P-VALUE"], errors="coerce")
-        new_df['pvalue'] = df['P-VALUE']
-        new_df["Neglog10(pvalue)"] = -np.log10(df["P-VALUE"].replace(0, np.nan))  # Avoid log(0) error
-
-    # Convert types
-    df["Chromosome"] = pd.Categorical(df["CHR_ID"], categories=[str(i) for i in range(1, 23)] + ["X", "Y"], ordered=True)
-    new_df["Chromosome"] = df["Chromosome"].cat.remove_unused_categories()
-    new_df["Position"] = pd.to_numeric(df["CHR_POS"], errors="coerce")
-    new_df['rsID'] = df['SNPS']
-    for k,v in other_cols.items():
-        new_df[v] = df[k]
-    return new_df.sort_values("Chromosome")
-
-def load_data(efo_id: str):
-
-    df = None
     try:
         variants_associate_path = os.path.join(gwas_data_path, f'{efo_id}.tsv')
-        if not os.path.exists(variants_associate_path):
-            df = filter_asso_by_efo_id(efo_id)
-            if df.empty:
-                return None
-            df = prepare_variants_data(df)
-            df.to_csv(variants_associate_path, sep='\t', index=False)
+        try:
+            store_path = build_associations_store()
+        except FileNotFoundError:
+            # deployments that only ship the per-trait files
+            if os.path.exists(variants_associate_path):
+                return variants_associate_path
+            raise
+        with _path_lock(variants_associate_path):
+            if (refresh or not os.path.exists(variants_associate_path)
+                    or os.path.getmtime(variants_associate_path) < os.path.getmtime(store_path)):
+                df = query_variants_data(efo_id)
+                tmp_path = _tmp_path(variants_associate_path)
+                df.to_csv(tmp_path, sep='\t', index=False)
+                os.replace(tmp_path, variants_associate_path)
         return variants_associate_path
     except ValueError as e:
         return None
 
     except FileNotFoundError as e:
         raise e
-    
\ No newline at end of file
+
+
+# Zoom levels of the Manhattan/locus zoom tiles: bin size in base pairs, the level after the last one is unbinned
+TILE_BIN_SIZES = [10_000_000, 1_000_000, 100_000, 10_000]
+MAX_ZOOM = len(TILE_BIN_SIZES)
+GENOME_WIDE_SIGNIFICANCE = 5e-8
+TILE_ROW_GROUP_SIZE = 4096
+
+
+def tiles_path(efo_id: str) -> str:
+    return os.path.join(gwas_data_path, f'{efo_id}.tiles.parquet')
+
+
+def build_variant_tiles(efo_id: str, refresh: bool = False) -> Optional[str]:
+    """
+    Precompute the multi-resolution tiles of a trait.
+
+    At every zoom level each chromosome is cut into bins of TILE_BIN_SIZES[zoom] base pairs. Genome-wide
+    significant hits are all kept, the other variants of a bin collapse into their strongest one, whose `count` is the
+    number of variants it stands for. Level MAX_ZOOM holds every variant. The tiles are written as one Parquet file
+    sorted by zoom, chromosome and position, so a window query only reads the row groups it overlaps.
+
+    Args:
+        efo_id (str): Trait id.
+        refresh (bool): Rebuild even if the tiles are newer than the locus zoom file.
+
+    Returns:
+        Optional[str]: Path of the tiles, None if the trait has no associations.
+    """
+    variants_path = load_data(efo_id)
+    if variants_path is None:
+        return None
+    path = tiles_path(efo_id)
+    with _path_lock(path):
+        if not refresh and os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(variants_path):
+            return path
+
+        print(f"Building the locus zoom tiles of {efo_id}")
+        import duckdb
+        variants = pd.read_csv(variants_path, sep='\t', dtype={"Chromosome": str, "rsID": str, "PubMed ID": str})
+        variants = variants[variants["Chromosome"].isin(CHROMOSOMES) & variants["Position"].notna()]
+        levels = ", ".join(f"({zoom}, {bin_size}::BIGINT)" for zoom, bin_size in enumerate(TILE_BIN_SIZES + ["NULL"]))
+        detail_columns = [_quote(name) for name in OTHER_COLUMNS.values()]
+        tmp_path = _tmp_path(path)
+        conn = duckdb.connect()
+        try:
+            conn.register("variants", variants)
+            conn.execute(f"""
+                COPY (
+                    WITH binned AS (
+                        SELECT l.zoom, v."Chromosome" AS chromosome, CAST(v."Position" AS BIGINT) AS position,
+                               v.pvalue, v."Neglog10(pvalue)", {", ".join(f"v.{column}" for column in detail_columns)},
+                               CASE WHEN l.bin_size IS NULL OR v.pvalue < {GENOME_WIDE_SIGNIFICANCE}
+                                    THEN NULL ELSE CAST(v."Position" AS BIGINT) // l.bin_size END AS bin
+                        FROM variants v CROSS JOIN (VALUES {levels}) l(zoom, bin_size)
+                    ), ranked AS (
+                        SELECT *,
+                               row_number() OVER (PARTITION BY zoom, chromosome, bin
+                                                  ORDER BY "Neglog10(pvalue)" DESC NULLS LAST, position) AS rank,
+                               count(*) OVER (PARTITION BY zoom, chromosome, bin) AS bin_count
+                        FROM binned
+                    )
+                    SELECT zoom, chromosome, position, pvalue, "Neglog10(pvalue)",
+                           CASE WHEN bin IS NULL THEN 1 ELSE bin_count END AS count, {", ".join(detail_columns)}
+                    FROM ranked
+                    WHERE bin IS NULL OR rank = 1
+                    ORDER BY zoom, list_position({CHROMOSOMES}, chromosome), position
+                ) TO '{tmp_path}' (FORMAT PARQUET, ROW_GROUP_SIZE {TILE_ROW_GROUP_SIZE})
+            """)
+        finally:
+            conn.close()
+        os.replace(tmp_path, path)
+        return path
+
+
+def query_variant_tiles(efo_id: str, zoom: int, chromosome: Optional[str] = None, start: Optional[int] = None,
+                        end: Optional[int] = None) -> Optional[Dict[str, list]]:
+    """
+    Fetch the points of a trait visible in a window at a zoom level.
+
+    Args:
+        efo_id (str): Trait id.
+        zoom (int): Zoom level, clamped to [0, MAX_ZOOM].
+        chromosome (Optional[str]): Chromosome of the window, all chromosomes if None.
+        start (Optional[int]): First position of the window.
+        end (Optional[int]): Last position of the window.
+
+    Returns:
+        Optional[Dict[str, list]]: Column name -> values of the points in genome order, None if the trait has no
+            associations.
+    """
+    path = build_variant_tiles(efo_id)
+    if path is None:
+        return None
+
+    import duckdb
+    zoom = min(max(zoom, 0), MAX_ZOOM)
+    conditions, params = ["zoom = ?"], [zoom]
+    if chromosome is not None:
+        conditions.append("chromosome = ?")
+        params.append(str(chromosome).upper().removeprefix("CHR"))
+    if start is not None:
+        conditions.append("position >= ?")
+        params.append(start)
+    if end is not None:
+        conditions.append("position <= ?")
+        params.append(end)
+    conn = duckdb.connect()
+    try:
+        cursor = conn.execute(f"""
+            SELECT * EXCLUDE (zoom) FROM read_parquet('{path}') WHERE {" AND ".join(conditions)}
+        """, params)
+        columns = [description[0] for description in cursor.description]
+        rows = cursor.fetchall()
+    finally:
+        conn.close()
+    return {column: [row[i] for row in rows] for i, column in enumerate(columns)}
@@ -3,7 +3,6 @@ from typing import List, Dict, Any, Tuple,Optional,Union
 import requests
 import json
 from xml.etree import ElementTree as ET
-from llmfactory.llm_provider import get_llm
 from xml.etree import ElementTree
 import time
 from fastapi import HTTPException
@@ -749,7 +748,6 @@ def get_combined_conclusions(pubmed_ids: List[str]) -> str:
 import os
 import json
 from typing import List
-from openai import OpenAI
 
 def get_outcome_status_openai(pubmed_ids: List[str], disease_name: str) -> str:
     """
@@ -790,6 +788,7 @@ def get_outcome_status_openai(pubmed_ids: List[str], disease_name: str) -> str:
 
             try:
                 # Create an OpenAI client
+                from openai import OpenAI
                 client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
                 # Make a call to OpenAI's GPT model
                 response = client.chat.completions.create(
@@ -863,6 +862,8 @@ def get_outcome_status(pubmed_ids: List[str],disease_name: str) -> str:
         with open("config.json", "w") as file:
             json.dump(config, file)
 
+        # llmfactory pulls in the langchain providers, load it only when an outcome has to be classified
+        from llmfactory.llm_provider import get_llm
         chat_llm = get_llm(config_path="config.json", interface_type="chat")
         # print("Llama chat initialized")
         pmids_string: str=",".join(pubmed_ids)
@@ -1,7 +1,40 @@
-from neo4j import GraphDatabase
+import os
+from typing import TYPE_CHECKING, Optional
 
-def get_neo4j_driver() -> GraphDatabase.driver:
-    URI = "neo4j://robokopkg.renci.org:7687"
-    AUTH = ("", "")
-    driver = GraphDatabase.driver(uri=URI, auth=AUTH)
-    return driver
\ No newline at end of file
+if TYPE_CHECKING:
+    import neo4j
+
+NEO4J_URI: str = os.getenv("NEO4J_URI", "neo4j://robokopkg.renci.org:7687")
+NEO4J_AUTH = ("", "")
+# Connections kept open to the graph, and how long a query waits for one when they are all in use
+NEO4J_MAX_POOL_SIZE: int = int(os.getenv("NEO4J_MAX_POOL_SIZE", "50"))
+NEO4J_ACQUISITION_TIMEOUT: float = float(os.getenv("NEO4J_ACQUISITION_TIMEOUT", "30"))
+NEO4J_CONNECTION_TIMEOUT: float = float(os.getenv("NEO4J_CONNECTION_TIMEOUT", "15"))
+
+_driver: Optional["neo4j.AsyncDriver"] = None
+
+
+def get_neo4j_driver() -> "neo4j.AsyncDriver":
+    """ Return the application's async driver, created on first use (at startup) and shared by every request """
+    global _driver
+    if _driver is None:
+        # the neo4j driver takes over half a second to import, only load it for the graph routes
+        from neo4j import AsyncGraphDatabase
+
+        _driver = AsyncGraphDatabase.driver(
+            uri=NEO4J_URI,
+            auth=NEO4J_AUTH,
+            max_connection_pool_size=NEO4J_MAX_POOL_SIZE,
+            connection_acquisition_timeout=NEO4J_ACQUISITION_TIMEOUT,
+            connection_timeout=NEO4J_CONNECTION_TIMEOUT,
+            keep_alive=True,
+        )
+    return _driver
+
+
+async def close_neo4j_driver():
+    """ Close the driver and its connection pool, at shutdown """
+    global _driver
+    if _driver is not None:
+        driver, _driver = _driver, None
+        await driver.close()
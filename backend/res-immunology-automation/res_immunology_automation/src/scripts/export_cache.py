@@ -0,0 +1,104 @@
+import hashlib
+import os
+import shutil
+import time
+from typing import Any, List, Optional
+
+from serialization import dumps
+
+# Directory holding generated Excel exports, reused while the data they were built from is unchanged
+EXPORT_CACHE_DIR: str = "cached_data_json/exports"
+EXPORT_CACHE_MAX_BYTES: int = int(os.getenv("EXPORT_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+EXPORT_CACHE_MAX_FILES: int = int(os.getenv("EXPORT_CACHE_MAX_FILES", "500"))
+# Exports used this recently are never evicted, a response may still be sending them
+EXPORT_CACHE_GRACE_SECONDS: int = int(os.getenv("EXPORT_CACHE_GRACE_SECONDS", "600"))
+
+
+def export_cache_key(endpoint: str, target: str, diseases: List[str], json_data: Any) -> str:
+    """
+    Build the cache key of an export.
+
+    Args:
+        endpoint (str): Endpoint whose data is exported.
+        target (str): Normalized target, empty for disease-only exports.
+        diseases (List[str]): Normalized diseases, the order does not matter.
+        json_data (Any): The exported payload, its content hash versions the key.
+
+    Returns:
+        str: Hex digest identifying the export.
+    """
+    data_hash: str = hashlib.sha256(dumps(json_data)).hexdigest()
+    scope: str = "|".join([endpoint, target or "", ",".join(sorted(set(diseases))), data_hash])
+    return hashlib.sha1(scope.encode("utf-8")).hexdigest()
+
+
+def _export_path(cache_key: str) -> str:
+    return os.path.join(EXPORT_CACHE_DIR, f"{cache_key}.xlsx")
+
+
+def get_cached_export(cache_key: str) -> Optional[str]:
+    """ Return the path of a stored export and mark it as recently used, None if it is not stored """
+    file_path: str = _export_path(cache_key)
+    try:
+        os.utime(file_path)
+    except OSError:
+        return None
+    return file_path
+
+
+def store_export(cache_key: str, generated_path: str) -> str:
+    """
+    Move a generated export into the cache and evict the least recently used exports beyond the size caps.
+
+    Args:
+        cache_key (str): Key from `export_cache_key`.
+        generated_path (str): Path of the freshly generated file, it is moved (not copied).
+
+    Returns:
+        str: Path of the stored export.
+    """
+    os.makedirs(EXPORT_CACHE_DIR, exist_ok=True)
+    file_path: str = _export_path(cache_key)
+    # generated files have unique names and may live on another filesystem, move them next to the final path
+    # first so the replace is atomic and concurrent exports of the same key never see a partial file
+    tmp_path: str = os.path.join(EXPORT_CACHE_DIR, f"{os.path.basename(generated_path)}.tmp")
+    shutil.move(generated_path, tmp_path)
+    os.replace(tmp_path, file_path)
+    evict_exports(keep=file_path)
+    return file_path
+
+
+def evict_exports(keep: Optional[str] = None):
+    """
+    Remove the least recently used exports until the cache is within EXPORT_CACHE_MAX_BYTES and _MAX_FILES.
+    Exports stored or returned by `get_cached_export` in the last EXPORT_CACHE_GRACE_SECONDS are kept.
+    """
+    if not os.path.isdir(EXPORT_CACHE_DIR):
+        return
+
+    entries = []
+    for entry in os.scandir(EXPORT_CACHE_DIR):
+        if not entry.name.endswith(".xlsx"):
+            continue
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    entries.sort()
+    grace_limit: float = time.time() - EXPORT_CACHE_GRACE_SECONDS
+    total_bytes: int = sum(size for _, size, _ in entries)
+    total_files: int = len(entries)
+    for mtime, size, file_path in entries:
+        if total_bytes <= EXPORT_CACHE_MAX_BYTES and total_files <= EXPORT_CACHE_MAX_FILES:
+            break
+        if file_path == keep or mtime > grace_limit:
+            continue
+        try:
+            os.remove(file_path)
+            print(f"Evicted cached export {file_path}")
+        except OSError:
+            continue
+        total_bytes -= size
+        total_files -= 1
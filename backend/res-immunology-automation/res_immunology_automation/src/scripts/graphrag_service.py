@@ -3,20 +3,23 @@ import os
 import urllib.parse
 import numpy as np
 import pandas as pd
-import tiktoken
 from os import getenv
 from redis import Redis
 import json
+from serialization import redis_json
 import re
-from graphrag.query.indexer_adapters import read_indexer_entities, read_indexer_reports
-from graphrag.query.llm.oai.chat_openai import ChatOpenAI
-from graphrag.query.llm.oai.typing import OpenaiApiType
-from graphrag.query.structured_search.global_search.community_context import (
-    GlobalCommunityContext,
-)
-from graphrag.query.structured_search.global_search.search import GlobalSearch
 # Your GraphRAG-related configurations and logic
 def create_graphrag_search_engine():
+    # graphrag and tiktoken take over a second to import, only load them for GraphRAG questions
+    import tiktoken
+    from graphrag.query.indexer_adapters import read_indexer_entities, read_indexer_reports
+    from graphrag.query.llm.oai.chat_openai import ChatOpenAI
+    from graphrag.query.llm.oai.typing import OpenaiApiType
+    from graphrag.query.structured_search.global_search.community_context import (
+        GlobalCommunityContext,
+    )
+    from graphrag.query.structured_search.global_search.search import GlobalSearch
+
     api_key = getenv("OPENAI_API_KEY", None)
     llm_model = getenv("LLM_MODEL", "gpt-4o")
     
@@ -97,7 +100,7 @@ def get_redis():
 def get_graphrag_answer(question: str):
     redis_client = get_redis()
     cache_key = f"graphrag:{question.strip()}"
-    cached_response = redis_client.json().get(cache_key)
+    cached_response = redis_json(redis_client).get(cache_key)
 
     if cached_response:
         return cached_response["response"], cached_response["llm_calls"], cached_response["prompt_tokens"]
@@ -111,7 +114,7 @@ def get_graphrag_answer(question: str):
         "prompt_tokens": result.prompt_tokens
     }
 
-    redis_client.json().set(cache_key, "$", response_data)
+    redis_json(redis_client).set(cache_key, "$", response_data)
 
     return result.response, result.llm_calls, result.prompt_tokens
 
@@ -0,0 +1,420 @@
+"""
+Local copy of the ROBOKOP nodes and edges we query, as a compressed sparse row (CSR) graph memory-mapped from disk.
+
+Shortest paths, k shortest paths and neighbourhoods are computed in process instead of sending variable length
+Cypher patterns to the public ROBOKOP instance. Edges are stored in both directions so traversals are undirected,
+like the `-[r]-` patterns they replace, and keep their original subject/object.
+
+Build it from the ROBOKOP KGX dump (nodes.jsonl / edges.jsonl), keeping only the node categories and predicates used:
+    python csr_graph.py --nodes nodes.jsonl --edges edges.jsonl \\
+        --categories biolink:Gene biolink:Disease biolink:Pathway biolink:BiologicalProcess
+The filters are recorded in meta.json, the neighbour queries they leave incomplete are sent to robokop.
+"""
+import argparse
+import json
+import os
+import shutil
+from array import array
+from collections import defaultdict
+
+import numpy as np
+
+CSR_GRAPH_PATH = os.getenv("KG_CSR_GRAPH_PATH", "../../kg_data/robokop_csr")
+
+_NO_PARENT = -2
+_ROOT = -1
+
+
+class CSRGraph:
+    """Undirected view of a directed multigraph in CSR format.
+    indptr (n + 1): row offsets, the edges of node i are the positions indptr[i]:indptr[i + 1]
+    indices: neighbour of each edge position
+    predicates: predicate code of each edge position
+    outgoing: 1 when the node of the row is the subject of the edge, 0 when it is the object
+    category_indptr / categories: categories of each node, in the same format
+    """
+
+    def __init__(self, path, mmap_mode='r'):
+        self.path = path
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+                  for name in ("indptr", "indices", "predicates", "outgoing", "category_indptr", "categories")}
+        self.indptr = arrays["indptr"]
+        self.indices = arrays["indices"]
+        self.predicates = arrays["predicates"]
+        self.outgoing = arrays["outgoing"]
+        self.category_indptr = arrays["category_indptr"]
+        self.categories = arrays["categories"]
+        with open(os.path.join(path, "meta.json")) as file:
+            meta = json.load(file)
+        self.predicate_names = meta["predicates"]
+        self.category_names = meta["categories"]
+        self.category_index = {category: code for code, category in enumerate(self.category_names)}
+        # categories and predicates the graph was built with (None: all of them), the other ones are missing. The
+        # filters of graphs built before they were recorded are unknown, none of their queries is complete
+        filters = meta.get("filters", {"categories": [], "predicates": []})
+        self.kept_categories = set(filters["categories"]) if filters["categories"] is not None else None
+        self.kept_predicates = set(filters["predicates"]) if filters["predicates"] is not None else None
+        with open(os.path.join(path, "node_ids.txt")) as file:
+            self.node_ids = file.read().split("\n")
+        self.node_index = {node_id: i for i, node_id in enumerate(self.node_ids)}
+        self._node_names = None
+        self._category_masks = {}
+
+    @property
+    def node_count(self):
+        return len(self.indptr) - 1
+
+    @property
+    def node_names(self):
+        if self._node_names is None:
+            with open(os.path.join(self.path, "node_names.txt")) as file:
+                self._node_names = file.read().split("\n")
+        return self._node_names
+
+    def has_node(self, node_id):
+        return node_id in self.node_index
+
+    def has_category(self, category):
+        return category in self.category_index
+
+    def covers_neighbors(self, category=None):
+        """Whether neighbors() returns all the neighbours robokop has: every edge was kept, and every node of the
+        category (of any category when None) was kept"""
+        if self.kept_predicates is not None:
+            return False
+        return self.kept_categories is None or (category is not None and category in self.kept_categories)
+
+    def node_categories(self, node_id):
+        node = self.node_index[node_id]
+        return [self.category_names[code]
+                for code in self.categories[self.category_indptr[node]:self.category_indptr[node + 1]]]
+
+    def category_mask(self, category):
+        """Boolean array of the nodes having the category (a label in Neo4j), cached"""
+        if category not in self._category_masks:
+            mask = np.zeros(self.node_count, dtype=bool)
+            code = self.category_index.get(category)
+            if code is not None:
+                owners = np.repeat(np.arange(self.node_count), np.diff(self.category_indptr))
+                mask[owners[np.asarray(self.categories) == code]] = True
+            self._category_masks[category] = mask
+        return self._category_masks[category]
+
+    def _edge_positions(self, frontier):
+        """Edge positions of all the nodes of the frontier, and the node each one starts from"""
+        starts = np.asarray(self.indptr[frontier], dtype=np.int64)
+        counts = np.asarray(self.indptr[frontier + 1], dtype=np.int64) - starts
+        total = int(counts.sum())
+        if not total:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        owners = np.repeat(frontier, counts)
+        positions = np.arange(total, dtype=np.int64) - np.repeat(np.cumsum(counts) - counts - starts, counts)
+        return owners, positions
+
+    def _edge(self, node, position):
+        """The edge at the position of the node row, as in the source graph"""
+        neighbour = int(self.indices[position])
+        subject, obj = (node, neighbour) if self.outgoing[position] else (neighbour, node)
+        return {"subject": self.node_ids[subject], "predicate": self.predicate_names[self.predicates[position]],
+                "object": self.node_ids[obj]}
+
+    def _bfs_level(self, frontier, parent_node, parent_edge, allowed=None):
+        """Visit the unvisited neighbours of the frontier, recording their parent
+        Returns: the new frontier"""
+        owners, positions = self._edge_positions(frontier)
+        neighbours = np.asarray(self.indices[positions], dtype=np.int64)
+        keep = parent_node[neighbours] == _NO_PARENT
+        if allowed is not None:
+            keep &= allowed[neighbours]
+        neighbours, first = np.unique(neighbours[keep], return_index=True)
+        parent_node[neighbours] = owners[keep][first]
+        parent_edge[neighbours] = positions[keep][first]
+        return neighbours
+
+    def _walk_back(self, node, parent_node, parent_edge):
+        """Nodes and edge positions from the node back to the BFS root"""
+        nodes, edges = [node], []
+        while parent_node[node] != _ROOT:
+            edges.append((int(parent_node[node]), int(parent_edge[node])))
+            node = int(parent_node[node])
+            nodes.append(node)
+        return nodes, edges
+
+    def _format_path(self, nodes, edges):
+        return {"nodes": [{"id": self.node_ids[node], "name": self.node_names[node]} for node in nodes],
+                "edges": [self._edge(node, position) for node, position in edges]}
+
+    def shortest_path(self, source_id, target_id, max_hops=3):
+        """Shortest undirected path, bidirectional BFS
+        Args: source_id (str), target_id (str): node ids (CURIEs)
+              max_hops (int): Maximum path length
+        Returns: {"nodes": [{"id", "name"}], "edges": [{"subject", "predicate", "object"}]} or None"""
+        if source_id not in self.node_index or target_id not in self.node_index:
+            return None
+        source, target = self.node_index[source_id], self.node_index[target_id]
+        if source == target:
+            return self._format_path([source], [])
+
+        sides = []
+        for root in (source, target):
+            parent_node = np.full(self.node_count, _NO_PARENT, dtype=np.int64)
+            parent_edge = np.full(self.node_count, _NO_PARENT, dtype=np.int64)
+            parent_node[root] = _ROOT
+            sides.append([np.array([root], dtype=np.int64), parent_node, parent_edge])
+
+        for _ in range(max_hops):
+            # expand the side with the smallest frontier by a full level
+            side, other = (sides[0], sides[1]) if len(sides[0][0]) <= len(sides[1][0]) else (sides[1], sides[0])
+            side[0] = self._bfs_level(*side)
+            met = side[0][other[1][side[0]] != _NO_PARENT]
+            if len(met):
+                meeting = int(met[0])
+                source_nodes, source_edges = self._walk_back(meeting, sides[0][1], sides[0][2])
+                target_nodes, target_edges = self._walk_back(meeting, sides[1][1], sides[1][2])
+                return self._format_path(source_nodes[::-1] + target_nodes[1:],
+                                         source_edges[::-1] + [(node, position) for node, position in target_edges])
+            if not len(side[0]):
+                return None
+        return None
+
+    def distances(self, root_id, max_hops, allowed=None, targets=None):
+        """Hop distance of every node from the root, -1 when further than max_hops
+        Args: allowed (np.ndarray, optional): boolean mask of the nodes the BFS may go through
+              targets (np.ndarray, optional): stop as soon as all these nodes are reached"""
+        distance = np.full(self.node_count, -1, dtype=np.int16)
+        parent_node = np.full(self.node_count, _NO_PARENT, dtype=np.int64)
+        parent_edge = np.full(self.node_count, _NO_PARENT, dtype=np.int64)
+        root = self.node_index[root_id]
+        frontier = np.array([root], dtype=np.int64)
+        parent_node[root] = _ROOT
+        distance[root] = 0
+        for hop in range(1, max_hops + 1):
+            frontier = self._bfs_level(frontier, parent_node, parent_edge, allowed)
+            if not len(frontier):
+                break
+            distance[frontier] = hop
+            if targets is not None and (distance[targets] >= 0).all():
+                break
+        return distance, parent_node, parent_edge
+
+    def k_shortest_paths(self, source_id, target_id, k=5, max_hops=3):
+        """The k shortest simple paths (each parallel edge gives its own path, as in Cypher), shortest first
+        Returns: list of paths, as in shortest_path"""
+        if source_id not in self.node_index or target_id not in self.node_index:
+            return []
+        source, target = self.node_index[source_id], self.node_index[target_id]
+        to_target = self.distances(target_id, max_hops)[0]
+        if to_target[source] < 0:
+            return []
+
+        paths = []
+
+        def extend(nodes, edges, length):
+            node = nodes[-1]
+            hops_left = length - len(edges) - 1
+            positions = np.arange(self.indptr[node], self.indptr[node + 1], dtype=np.int64)
+            neighbours = np.asarray(self.indices[positions], dtype=np.int64)
+            distance = to_target[neighbours]
+            # only the neighbours from which the target is still reachable in the hops left
+            for position, neighbour in zip(positions[(distance >= 0) & (distance <= hops_left)],
+                                           neighbours[(distance >= 0) & (distance <= hops_left)]):
+                neighbour = int(neighbour)
+                if neighbour in nodes or (neighbour == target and hops_left):
+                    continue
+                if neighbour == target:
+                    paths.append((nodes + [neighbour], edges + [(node, int(position))]))
+                else:
+                    extend(nodes + [neighbour], edges + [(node, int(position))], length)
+                if len(paths) >= k:
+                    return
+
+        for length in range(max(int(to_target[source]), 1), max_hops + 1):
+            extend([source], [], length)
+            if len(paths) >= k:
+                break
+        return [self._format_path(nodes, edges) for nodes, edges in paths[:k]]
+
+    def batch_shortest_paths(self, pairs, max_hops=3, single_source_threshold=8):
+        """Shortest paths of many (source_id, target_id) pairs. The sources with more than single_source_threshold
+        targets get one BFS for all their targets (stopped once they are all reached), the others a bidirectional
+        BFS per pair, which visits far fewer nodes
+        Returns: list of paths (or None), in the order of the pairs"""
+        targets_by_source = defaultdict(list)
+        for i, (source_id, target_id) in enumerate(pairs):
+            targets_by_source[source_id].append((i, target_id))
+
+        results = [None] * len(pairs)
+        for source_id, targets in targets_by_source.items():
+            if source_id not in self.node_index:
+                continue
+            if len(targets) <= single_source_threshold:
+                for i, target_id in targets:
+                    results[i] = self.shortest_path(source_id, target_id, max_hops)
+                continue
+            target_nodes = np.array([self.node_index[target_id] for _, target_id in targets
+                                     if target_id in self.node_index], dtype=np.int64)
+            distance, parent_node, parent_edge = self.distances(source_id, max_hops, targets=target_nodes)
+            for i, target_id in targets:
+                target = self.node_index.get(target_id)
+                if target is not None and distance[target] >= 0:
+                    nodes, edges = self._walk_back(target, parent_node, parent_edge)
+                    results[i] = self._format_path(nodes[::-1], edges[::-1])
+        return results
+
+    def neighbors(self, node_id, category=None, predicate=None):
+        """Direct neighbours of a node, optionally only of a category and through a predicate
+        Returns: list of {"node_id", "node_name", "relationship", "outgoing"}, one per edge"""
+        if node_id not in self.node_index:
+            return []
+        node = self.node_index[node_id]
+        positions = np.arange(self.indptr[node], self.indptr[node + 1], dtype=np.int64)
+        neighbours = np.asarray(self.indices[positions], dtype=np.int64)
+        keep = np.ones(len(positions), dtype=bool)
+        if category is not None:
+            keep &= self.category_mask(category)[neighbours]
+        if predicate is not None:
+            if predicate not in self.predicate_names:
+                return []
+            keep &= np.asarray(self.predicates[positions]) == self.predicate_names.index(predicate)
+        return [{"node_id": self.node_ids[neighbour], "node_name": self.node_names[neighbour],
+                 "relationship": self.predicate_names[self.predicates[position]],
+                 "outgoing": bool(self.outgoing[position])}
+                for position, neighbour in zip(positions[keep], neighbours[keep])]
+
+    def expand(self, node_ids, hops=1, categories=None):
+        """Neighbourhood of the nodes up to `hops`, only going through nodes of the categories when given
+        Returns: dict: node id -> hop distance (the start nodes are at 0)"""
+        allowed = None
+        if categories:
+            allowed = np.zeros(self.node_count, dtype=bool)
+            for category in categories:
+                allowed |= self.category_mask(category)
+        starts = [self.node_index[node_id] for node_id in node_ids if node_id in self.node_index]
+        if not starts:
+            return {}
+        distance = np.full(self.node_count, -1, dtype=np.int16)
+        parent_node = np.full(self.node_count, _NO_PARENT, dtype=np.int64)
+        parent_edge = np.full(self.node_count, _NO_PARENT, dtype=np.int64)
+        frontier = np.unique(np.array(starts, dtype=np.int64))
+        parent_node[frontier] = _ROOT
+        distance[frontier] = 0
+        for hop in range(1, hops + 1):
+            frontier = self._bfs_level(frontier, parent_node, parent_edge, allowed)
+            if not len(frontier):
+                break
+            distance[frontier] = hop
+        reached = np.flatnonzero(distance >= 0)
+        return {self.node_ids[node]: int(distance[node]) for node in reached}
+
+
+_local_graph = None
+
+
+def get_local_graph(path=CSR_GRAPH_PATH):
+    """The memory-mapped local graph, loaded once, or None when it has not been built"""
+    global _local_graph
+    if _local_graph is None or _local_graph.path != path:
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            return None
+        _local_graph = CSRGraph(path)
+    return _local_graph
+
+
+def _read_jsonl(path):
+    with open(path) as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def build_csr_graph(nodes_path, edges_path, output_path=CSR_GRAPH_PATH, categories=None, predicates=None):
+    """Import KGX nodes/edges jsonl files into a CSR graph directory, replaced atomically
+    Args: nodes_path (str), edges_path (str): KGX jsonl files of the ROBOKOP dump
+          output_path (str): Directory of the graph
+          categories (list, optional): Only keep the nodes having one of these categories
+          predicates (list, optional): Only keep the edges of these predicates
+    Returns: (int, int): number of nodes and edges"""
+    categories, predicates = set(categories or []), set(predicates or [])
+    node_ids, node_names = [], []
+    node_index = {}
+    category_names, category_index = [], {}
+    category_indptr, category_codes = array('q', [0]), array('h')
+    for node in _read_jsonl(nodes_path):
+        node_categories = node.get("category") or []
+        if isinstance(node_categories, str):
+            node_categories = [node_categories]
+        if categories and not categories.intersection(node_categories):
+            continue
+        node_index[node["id"]] = len(node_ids)
+        node_ids.append(node["id"])
+        node_names.append(" ".join(str(node.get("name") or node["id"]).split()))
+        for category in node_categories:
+            if category not in category_index:
+                category_index[category] = len(category_names)
+                category_names.append(category)
+            category_codes.append(category_index[category])
+        category_indptr.append(len(category_codes))
+
+    predicate_names, predicate_index = [], {}
+    subjects, objects, edge_predicates = array('i'), array('i'), array('h')
+    for edge in _read_jsonl(edges_path):
+        subject, obj = node_index.get(edge["subject"]), node_index.get(edge["object"])
+        if subject is None or obj is None or (predicates and edge["predicate"] not in predicates):
+            continue
+        if edge["predicate"] not in predicate_index:
+            predicate_index[edge["predicate"]] = len(predicate_names)
+            predicate_names.append(edge["predicate"])
+        subjects.append(subject)
+        objects.append(obj)
+        edge_predicates.append(predicate_index[edge["predicate"]])
+
+    subjects, objects = np.frombuffer(subjects, dtype=np.int32), np.frombuffer(objects, dtype=np.int32)
+    edge_predicates = np.frombuffer(edge_predicates, dtype=np.int16)
+    # every edge in both directions, grouped by the node of the row
+    rows = np.concatenate([subjects, objects])
+    order = np.argsort(rows, kind="stable")
+    indices = np.concatenate([objects, subjects])[order]
+    both_predicates = np.concatenate([edge_predicates, edge_predicates])[order]
+    outgoing = np.concatenate([np.ones(len(subjects), dtype=np.int8), np.zeros(len(subjects), dtype=np.int8)])[order]
+    indptr = np.zeros(len(node_ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(node_ids)), out=indptr[1:])
+
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    for name, values in (("indptr", indptr), ("indices", indices), ("predicates", both_predicates),
+                         ("outgoing", outgoing), ("category_indptr", np.frombuffer(category_indptr, dtype=np.int64)),
+                         ("categories", np.frombuffer(category_codes, dtype=np.int16))):
+        np.save(os.path.join(tmp_path, f"{name}.npy"), values)
+    with open(os.path.join(tmp_path, "node_ids.txt"), "w") as file:
+        file.write("\n".join(node_ids))
+    with open(os.path.join(tmp_path, "node_names.txt"), "w") as file:
+        file.write("\n".join(node_names))
+    with open(os.path.join(tmp_path, "meta.json"), "w") as file:
+        json.dump({"categories": category_names, "predicates": predicate_names,
+                   "filters": {"categories": sorted(categories) or None, "predicates": sorted(predicates) or None}},
+                  file)
+
+    # swap the directories, the old one stays readable by the processes having it mapped
+    old_path = f"{output_path}.{os.getpid()}.old"
+    if os.path.exists(output_path):
+        os.replace(output_path, old_path)
+    os.replace(tmp_path, output_path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return len(node_ids), len(subjects)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", required=True, help="KGX nodes jsonl file")
+    parser.add_argument("--edges", required=True, help="KGX edges jsonl file")
+    parser.add_argument("--output", default=CSR_GRAPH_PATH, help="Graph directory")
+    parser.add_argument("--categories", nargs="*", help="Node categories to keep (all by default)")
+    parser.add_argument("--predicates", nargs="*", help="Predicates to keep (all by default)")
+    args = parser.parse_args()
+    nodes, edges = build_csr_graph(args.nodes, args.edges, args.output, args.categories, args.predicates)
+    print(f"CSR graph written to {args.output}: {nodes} nodes, {edges} edges")
+
+
+if __name__ == "__main__":
+    main()
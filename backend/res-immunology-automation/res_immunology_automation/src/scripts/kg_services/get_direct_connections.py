@@ -1,5 +1,8 @@
 from neo4j_connector import fetch_data_from_neo4j
+from kg_utils import find_local_direct_connections
+from csr_graph import get_local_graph
 from json_utils import load_json
+from graph_model import KnowledgeGraph
 
 import pandas as pd
 import json
@@ -17,6 +20,15 @@ def find_direct_connections_online(source_node_type, source_node_id, target_node
             node_type: Type/label of the node
             relation: Label of the relationship between the source node and the neighbour node
           """
+    # node ids of the local graph are the ROBOKOP CURIEs, the element ids are only known by robokop
+    local_connections = find_local_direct_connections(source_node_type, source_node_id, target_node_type)
+    if local_connections is not None:
+        graph = get_local_graph()
+        for connection in local_connections:
+            connection['node_label'] = target_node_type or graph.node_categories(connection['node_id'])[-1]
+        if not local_connections:
+            print("No direct connections found for the specified node.")
+        return local_connections
 
     try:
         if target_node_type:
@@ -55,12 +67,11 @@ def find_direct_connections_online(source_node_type, source_node_id, target_node
 
 # Function to get the node name and type by id for offline mode
 def get_node_type_by_id(node_id, json_data):
-    """Find and return the name and type of a node given its ID from JSON data."""
+    """Find and return the name and type of a node given its ID from JSON data (or its KnowledgeGraph)."""
 
-    for item in json_data['elements']:
-        entry = item.get('data', {})
-        if entry.get('id') == str(node_id):
-            return entry.get('type'), entry.get('label')
+    entry = KnowledgeGraph.from_json(json_data).node_data(node_id)
+    if entry is not None:
+        return entry.get('type'), entry.get('label')
     return None
 
 
@@ -68,7 +79,8 @@ def get_node_type_by_id(node_id, json_data):
 def find_direct_connections_offline(source_node_id, json_data, target_node_type=None):
     """Find direct neighbors of a node along with their edge connections using JSON data.
     Args: source_node_id(str): Unique id of the source node
-          json data (dict): existing graph data (nodes and relations)
+          json data (dict or KnowledgeGraph): existing graph data (nodes and relations), pass the KnowledgeGraph
+                                              when querying the same graph repeatedly
           target_node_type (str, optional): Type of the target node to filter the connection
 
     Returns: List of dictionaries for the connected node. Each dictionary contains
@@ -77,23 +89,15 @@ def find_direct_connections_offline(source_node_id, json_data, target_node_type=
             node_type: Type/label of the node
             relation: Label of the relationship between the source node and the neighbour node
           """
+    graph = KnowledgeGraph.from_json(json_data)
     neighbors_with_edges = []
 
-    for item in json_data['elements']:
-        entry = item.get('data', {})
-        source = entry.get('source')
-        target = entry.get('target')
-        edge_label = entry.get('label')
-
-        if source == str(source_node_id):
-            node_type, node_name = get_node_type_by_id(target, json_data)
-            if not target_node_type or (target_node_type == node_type):
-                neighbors_with_edges.append({'node_id': target, 'node_name': node_name, 'relationship': edge_label, 'node_label':node_type})
-
-        elif target == str(source_node_id):
-            node_type, node_name = get_node_type_by_id(source, json_data)
-            if not target_node_type or (target_node_type == node_type):
-                neighbors_with_edges.append({'node_id': source, 'node_name': node_name, 'relationship': edge_label, 'node_label':node_type})
+    # only the edges of the node, through the adjacency index
+    for (source, target, edge_label), _ in graph.incident_edges(source_node_id):
+        neighbour_id = target if source == str(source_node_id) else source
+        node_type, node_name = get_node_type_by_id(neighbour_id, graph) or (None, None)
+        if not target_node_type or (target_node_type == node_type):
+            neighbors_with_edges.append({'node_id': neighbour_id, 'node_name': node_name, 'relationship': edge_label, 'node_label':node_type})
 
     print("neighbors_with_edges", len(neighbors_with_edges))
     if neighbors_with_edges:
@@ -110,7 +114,7 @@ def find_direct_connections(mode, source_node_type, source_node_id, json_data=No
     Args: mode (str): The mode of operation, 'online' or 'offline'
           source_node_type (str): Type/label of the source node
           source_node_id (str):  Unique id of source node
-          json_data (dict): Provide data for offline mode
+          json_data (dict or KnowledgeGraph): Provide data for offline mode, a KnowledgeGraph is indexed only once
           target_node_type (str,optional):  type/label of the target node to filter the connections
 
    Returns: List of dictionaries for the connected node. Each dictionary contains
@@ -137,7 +141,8 @@ target_node = "biolink:Gene"
 
 # # offline
 json_file_path = "/Users/reetikaM1/PycharmProjects/target-dossier/frontend/src/assets/dgpg.graph.json"
-data = load_json(json_file_path)
+# indexed once here, the offline lookups then reuse the same KnowledgeGraph
+data = KnowledgeGraph.from_json(load_json(json_file_path))
 source_node_id = "5445223"
 # target_node = "Gene"
 
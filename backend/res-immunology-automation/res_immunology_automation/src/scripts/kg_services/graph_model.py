@@ -0,0 +1,89 @@
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+EdgeKey = Tuple[str, str, str]
+
+
+class KnowledgeGraph:
+    """In-memory index of a Cytoscape.js graph json ({"elements": [{"data": {...}}, ...]}) for offline mode.
+    Built once, then kept up to date as nodes are added or merged, so lookups never scan the elements.
+    nodes: node id -> node element
+    edges: (source, target, label) -> edge elements (parallel edges share a key)
+    adjacency: node id -> keys of the edges it is an end of, in insertion order
+    """
+
+    def __init__(self, elements: Iterable[dict] = ()):
+        self.nodes: Dict[str, dict] = {}
+        self.edges: Dict[EdgeKey, List[dict]] = {}
+        self.adjacency: Dict[str, Dict[EdgeKey, None]] = {}
+        self.add_elements(elements)
+
+    @classmethod
+    def from_json(cls, json_data: Union[dict, "KnowledgeGraph"]) -> "KnowledgeGraph":
+        """Index a graph json, graphs already indexed are returned as is"""
+        if isinstance(json_data, KnowledgeGraph):
+            return json_data
+        return cls(json_data.get('elements', []) if json_data else [])
+
+    def add_elements(self, elements: Iterable[dict]):
+        for element in elements:
+            self.add_element(element)
+
+    def add_element(self, element: dict):
+        """Add a node (its data has an id) or an edge (its data has a source and a target)"""
+        data = element.get('data', {})
+        if data.get('source') is not None and data.get('target') is not None:
+            key = (str(data['source']), str(data['target']), data.get('label') or data.get('relationship'))
+            self.edges.setdefault(key, []).append(element)
+            self.adjacency.setdefault(key[0], {})[key] = None
+            self.adjacency.setdefault(key[1], {})[key] = None
+        elif data.get('id') is not None:
+            node_id = str(data['id'])
+            self.nodes[node_id] = element
+            self.adjacency.setdefault(node_id, {})
+
+    def node_data(self, node_id) -> Optional[dict]:
+        node = self.nodes.get(str(node_id))
+        return node.get('data', {}) if node is not None else None
+
+    def node_types(self) -> set:
+        return {node.get('data', {}).get('type') for node in self.nodes.values()}
+
+    def incident_edges(self, node_id) -> Iterable[Tuple[EdgeKey, dict]]:
+        """Edges having the node as source or target"""
+        for key in self.adjacency.get(str(node_id), {}):
+            for edge in self.edges[key]:
+                yield key, edge
+
+    def edges_between(self, source_id, target_id) -> List[dict]:
+        """Edges from source to target, whatever their label"""
+        source_id, target_id = str(source_id), str(target_id)
+        return [edge for key, edge in self.incident_edges(source_id) if key[0] == source_id and key[1] == target_id]
+
+    def remove_node(self, node_id) -> List[dict]:
+        """Remove a node and its edges
+        Returns: the removed edges"""
+        node_id = str(node_id)
+        removed = []
+        for key in list(self.adjacency.get(node_id, {})):
+            removed.extend(self.edges.pop(key, []))
+            for end in key[:2]:
+                self.adjacency.get(end, {}).pop(key, None)
+        self.adjacency.pop(node_id, None)
+        self.nodes.pop(node_id, None)
+        return removed
+
+    def replace_node(self, old_ids: Iterable[str], node: dict):
+        """Replace nodes by a single node, their edges are moved to it (edges between them become self loops)"""
+        new_id = str(node['data']['id'])
+        old_ids = {str(old_id) for old_id in old_ids}
+        removed = [edge for old_id in old_ids for edge in self.remove_node(old_id)]
+        self.add_element(node)
+        for edge in removed:
+            data = dict(edge['data'])
+            for end in ('source', 'target'):
+                if str(data[end]) in old_ids:
+                    data[end] = new_id
+            self.add_element({**edge, 'data': data})
+
+    def to_json(self) -> dict:
+        return {'elements': list(self.nodes.values()) + [edge for edges in self.edges.values() for edge in edges]}
@@ -42,12 +42,11 @@ def create_source_destination_relation_dict(json_df):
 
     pair_dict = defaultdict(list)
 
-    # Iterate over the DataFrame rows
-    for idx, row in json_df.iterrows():
+    # Iterate over the DataFrame columns (iterrows builds a Series per row)
+    for source, destination, relation in zip(json_df['source'], json_df['destination'], json_df['relation']):
 
         # Create a key from the (source, destination) pair
-        key = (row['source'], row['destination'])
-        relation = row['relation']
+        key = (source, destination)
 
         # Append the relation to the list if it doesn't already exist
         if relation not in pair_dict[key]:
@@ -1,4 +1,5 @@
 from neo4j_connector import fetch_data_from_neo4j
+from csr_graph import get_local_graph
 import pandas as pd
 import json
 
@@ -91,7 +92,47 @@ def find_node_id_by_node_name(node_type, node_name):
         raise RuntimeError(f"An error occurred while fetching node types: {e}")
 
 
+def format_metapath(nodes, edges):
+    """Format a path as [{"node": {"name"}}, {"relationship": {"type"}}, ..., {"node": {"name"}}]"""
+    formatted_path = []
+
+    for i in range(len(edges)):
+        formatted_path.append({
+            "node": {"name": nodes[i]['name']}
+        })
+        formatted_path.append({
+            "relationship": {"type": edges[i]}
+        })
+
+    formatted_path.append({
+        "node": {"name": nodes[-1]['name']}
+    })
+
+    return {"path": formatted_path}
+
+
+def get_local_metapath(source_node_id, target_node_id, max_hops=3):
+    """Shortest path from the local CSR graph
+    Returns: the formatted metapaths, or None when the local graph is not built, does not have both nodes or has no
+    path between them (it may only hold a subset of robokop)"""
+    graph = get_local_graph()
+    if graph is None:
+        return None
+    path = graph.shortest_path(source_node_id, target_node_id, max_hops)
+    if path is None:
+        return None
+    return [format_metapath(path['nodes'], [edge['predicate'] for edge in path['edges']])]
+
+
 def get_metapath(source_node_id, target_node_id, max_hops=3):
+    """Shortest path between two nodes, from the local CSR graph, or from robokop when it does not have it"""
+    local_metapaths = get_local_metapath(source_node_id, target_node_id, max_hops)
+    if local_metapaths is not None:
+        return local_metapaths
+    return get_robokop_metapath(source_node_id, target_node_id, max_hops)
+
+
+def get_robokop_metapath(source_node_id, target_node_id, max_hops=3):
     try:
         query = (
             f"match p = shortestpath((g) - [*..{max_hops}]-(d)) where "
@@ -107,27 +148,7 @@ def get_metapath(source_node_id, target_node_id, max_hops=3):
         if not metapaths:
             raise ValueError(f"No metapaths found between nodes {source_node_id} and {target_node_id}.")
 
-        formatted_metapaths = []
-        nodes = metapaths[0]['nodes']
-        edges = metapaths[0]['edges']
-
-        formatted_path = []
-
-        for i in range(len(edges)):
-            formatted_path.append({
-                "node": {"name": nodes[i]['name']}
-            })
-            formatted_path.append({
-                "relationship": {"type": edges[i]}
-            })
-
-        formatted_path.append({
-            "node": {"name": nodes[-1]['name']}
-        })
-
-        formatted_metapaths.append({"path": formatted_path})
-
-        return formatted_metapaths
+        return [format_metapath(metapaths[0]['nodes'], metapaths[0]['edges'])]
 
     except ValueError as ve:
         print(f"ValueError: {ve}")
@@ -136,7 +157,43 @@ def get_metapath(source_node_id, target_node_id, max_hops=3):
         print(f"An error occurred while fetching the metapaths: {e}")
 
 
+def get_metapaths_batch(node_id_pairs, max_hops=3):
+    """Shortest paths of many (source node id, target node id) pairs, one local BFS per distinct source, the pairs
+    without a local path are sent to robokop
+    Returns: list of formatted metapaths (None when no path was found), in the order of the pairs"""
+    graph = get_local_graph()
+    paths = graph.batch_shortest_paths(node_id_pairs, max_hops) if graph is not None else [None] * len(node_id_pairs)
+    return [[format_metapath(path['nodes'], [edge['predicate'] for edge in path['edges']])] if path is not None
+            else get_robokop_metapath(source_node_id, target_node_id, max_hops)
+            for (source_node_id, target_node_id), path in zip(node_id_pairs, paths)]
+
+
+def find_local_direct_connections(source_node_type, source_node_id, target_node_type=None):
+    """Direct connections from the local CSR graph
+    Returns: list of {"node_name", "node_id", "relationship"}, or None when the local graph is not built, does not
+    have the node or the node types, or was built without some of the connections (--categories/--predicates)"""
+    graph = get_local_graph()
+    if graph is None or not graph.has_node(source_node_id) or not graph.has_category(source_node_type):
+        return None
+    if not graph.covers_neighbors(target_node_type or None):
+        return None
+    if target_node_type and not graph.has_category(target_node_type):
+        return None
+    if not graph.category_mask(source_node_type)[graph.node_index[source_node_id]]:
+        return []
+    return [{"node_name": neighbour["node_name"], "node_id": neighbour["node_id"],
+             "relationship": neighbour["relationship"]}
+            for neighbour in graph.neighbors(source_node_id, category=target_node_type or None)]
+
+
 def find_direct_connections(source_node_type, source_node_id, target_node_type=None):
+    """Direct connections of a node, from the local CSR graph, or from robokop when it does not have the node"""
+    local_connections = find_local_direct_connections(source_node_type, source_node_id, target_node_type)
+    if local_connections is not None:
+        if not local_connections:
+            print("No direct connections found for the specified node.")
+        return local_connections
+
     try:
         if target_node_type:
             # Cypher query when both source and target labels are known
@@ -1,22 +1,23 @@
+from graph_model import KnowledgeGraph
+
+
 def merge_nodes(node_id_1, node_id_2, preferred_node_name, preferred_node_properties, json_data):
     """Merges two nodes based on user preferences for name and properties.
     Args:node_id_1 (str): ID of the first node to merge.
         node_id_2 (str): ID of the second node to merge.
         preferred_name_node (str): ID of the node whose name should be used in the merged node.
         preferred_properties_node (str): ID of the node whose properties should be used in the merged node.
-        nodes (list): List of dictionaries representing all nodes in the graph.
+        json_data (dict or KnowledgeGraph): the graph, a KnowledgeGraph is updated in place: the two nodes are
+                                            replaced by the merged node and their edges moved to it
     Returns (dict): The merged node
     """
     merged_node = dict()
     merged_node["id"] = node_id_1 + '_' + node_id_2
 
     # Find nodes by ID
-    node_1_data = next(
-        (item.get('data', {}) for item in json_data['elements'] if item.get('data', {}).get('id') == str(node_id_1)),
-        None)
-    node_2_data = next(
-        (item.get('data', {}) for item in json_data['elements'] if item.get('data', {}).get('id') == str(node_id_2)),
-        None)
+    graph = KnowledgeGraph.from_json(json_data)
+    node_1_data = graph.node_data(node_id_1)
+    node_2_data = graph.node_data(node_id_2)
 
     # Choose name based on user preference
     if preferred_node_name == node_id_1:
@@ -33,5 +34,8 @@ def merge_nodes(node_id_1, node_id_2, preferred_node_name, preferred_node_proper
         merged_node["properties"] = node_2_data.get('properties')
 
     # Update nodes: Remove old nodes and add the merged node
+    if graph is json_data:
+        preferred_data = node_1_data if preferred_node_name == node_id_1 else node_2_data
+        graph.replace_node([node_id_1, node_id_2], {"data": {**merged_node, "type": preferred_data.get('type')}})
 
     return merged_node
@@ -1,3 +1,5 @@
+import weakref
+
 import pandas as pd
 from collections import defaultdict
 from json_utils import process_json_to_dataframe
@@ -11,6 +13,182 @@ df = process_json_to_dataframe(json_file_path)
 source_destination_relation_dict = create_source_destination_relation_dict(df)
 
 
+class MetaGraph:
+    """Node type graph of robokop (source type -> destination types), with the node types encoded as integers.
+    Counts, paths and intermediate node types are computed per hop level for a root type, a maximum number of hops
+    and an optional destination type, the same way explore_paths walks the graph: a path stops at the destination.
+    Results are cached per (root, destination, max_hops).
+    """
+
+    def __init__(self, edges):
+        """Args: edges (iterable): (source type, destination type) pairs"""
+        self.types = []
+        self.index = {}
+        successors = defaultdict(set)
+        for source, destination in edges:
+            successors[self._encode(source)].add(self._encode(destination))
+        self.successors = [tuple(sorted(successors[i])) for i in range(len(self.types))]
+        self._cache = {}
+
+    @classmethod
+    def from_dataframe(cls, graph_df):
+        """Args: graph_df (pd.DataFrame): dataframe of process_json_to_dataframe"""
+        return cls(zip(graph_df['source'], graph_df['destination']))
+
+    def _encode(self, node_type):
+        if node_type not in self.index:
+            self.index[node_type] = len(self.types)
+            self.types.append(node_type)
+        return self.index[node_type]
+
+    def _cached(self, kind, root, max_hops, destination, compute):
+        key = (kind, root, destination, max_hops)
+        if key not in self._cache:
+            self._cache[key] = compute()
+        return self._cache[key]
+
+    def _reaches_destination(self, destination, max_hops):
+        """Per number of remaining hops j, whether each type has a path of exactly j hops to the destination
+        (or of j hops at all without a destination)"""
+        return self._cached('reaches', None, max_hops, destination,
+                            lambda: self._compute_reaches(destination, max_hops))
+
+    def _compute_reaches(self, destination, max_hops):
+        n_types = len(self.types)
+        destination_id = self.index.get(destination, -1)
+        if destination is None:
+            reaches = [[True] * n_types]
+        else:
+            reaches = [[i == destination_id for i in range(n_types)]]
+        for _ in range(max_hops):
+            previous = reaches[-1]
+            reaches.append([i != destination_id and any(previous[j] for j in self.successors[i])
+                            for i in range(n_types)])
+        return reaches
+
+    def count_paths(self, root, max_hops, destination=None):
+        """Number of paths per hop level, without building them (dynamic programming over the hop levels)
+        Args: root (str): The start node type
+              max_hops (int): Maximum number of hops
+              destination (str, optional): The destination node type
+        Returns: dict: {'1_hop': count, ..., 'n_hop': count}"""
+        return self._cached('count', root, max_hops, destination,
+                            lambda: self._count_paths(root, max_hops, destination))
+
+    def _count_paths(self, root, max_hops, destination):
+        counts = {f'{hop}_hop': 0 for hop in range(1, max_hops + 1)}
+        if root not in self.index:
+            return counts
+        root_id, destination_id = self.index[root], self.index.get(destination, -1)
+        if destination is not None and root_id == destination_id:
+            return {'0_hop': 1, **counts}
+
+        # walks[i]: number of paths from the root ending on type i at the current hop level
+        walks = {root_id: 1}
+        for hop in range(1, max_hops + 1):
+            next_walks = defaultdict(int)
+            for node, count in walks.items():
+                if node == destination_id:
+                    continue  # paths stop at the destination
+                for successor in self.successors[node]:
+                    next_walks[successor] += count
+            walks = next_walks
+            counts[f'{hop}_hop'] = walks.get(destination_id, 0) if destination is not None else sum(walks.values())
+        return counts
+
+    def iter_paths(self, root, max_hops, destination=None):
+        """Stream the paths without keeping them in memory, depth first like explore_paths.
+        Branches that cannot reach the destination in the hops left are not explored.
+        Args: root (str): The start node type
+              max_hops (int): Maximum number of hops
+              destination (str, optional): The destination node type
+        Yields: (int, tuple): hop level and the node types of the path"""
+        if root not in self.index:
+            return
+        root_id = self.index[root]
+        destination_id = self.index.get(destination, -1)
+        if destination is not None and destination_id < 0:
+            return
+        if destination is not None and root_id == destination_id:
+            yield 0, (root,)
+            return
+
+        reaches = self._reaches_destination(destination, max_hops)
+        # within[j][i]: type i has a path to the destination in at most j hops
+        within = [reaches[0]]
+        for j in range(1, max_hops + 1):
+            within.append([a or b for a, b in zip(within[-1], reaches[j])])
+        types = self.types
+        path = [root_id]
+        stack = [iter(self.successors[root_id])]
+        while stack:
+            hops_left = max_hops - len(path)
+            for successor in stack[-1]:
+                # only the successors having a path to the destination in the hops left
+                if within[hops_left][successor]:
+                    break
+            else:
+                stack.pop()
+                path.pop()
+                continue
+            path.append(successor)
+            hop = len(path) - 1
+            if destination is None or successor == destination_id:
+                yield hop, tuple(types[i] for i in path)
+            if hop < max_hops and successor != destination_id:
+                stack.append(iter(self.successors[successor]))
+            else:
+                path.pop()
+
+    def paths(self, root, max_hops, destination=None):
+        """The paths of iter_paths grouped by hop level, as strings
+        Returns: dict: {'1_hop': ['type-type', ...], ..., 'n_hop': [...]}"""
+        return self._cached('paths', root, max_hops, destination,
+                            lambda: self._paths(root, max_hops, destination))
+
+    def _paths(self, root, max_hops, destination):
+        hop_chain_paths = {f'{hop}_hop': [] for hop in range(1, max_hops + 1)}
+        for hop, path in self.iter_paths(root, max_hops, destination):
+            hop_chain_paths.setdefault(f'{hop}_hop', []).append('-'.join(path))
+        return hop_chain_paths
+
+    def intermediate_types(self, root, max_hops, destination=None):
+        """Node types found at each intermediate position of the paths of each hop level, computed from the types
+        reachable from the root and the types reaching the destination, without enumerating the paths
+        Returns: dict: {'1_hop': {}, 'n_hop': {'intermediate_node_1': [...], ..., 'intermediate_node_n-1': [...]}}
+        (same as process_metapath.build_unique_nodes_by_n_hop)"""
+        return self._cached('intermediate', root, max_hops, destination,
+                            lambda: self._intermediate_types(root, max_hops, destination))
+
+    def _intermediate_types(self, root, max_hops, destination):
+        result_dict = {'1_hop': dict()}
+        for hop in range(2, max_hops + 1):
+            result_dict[f'{hop}_hop'] = dict()
+        destination_id = self.index.get(destination, -1)
+        if root not in self.index or (destination is not None and destination_id < 0):
+            return result_dict
+        root_id = self.index[root]
+        if destination is not None and root_id == destination_id:
+            return result_dict
+
+        reaches = self._reaches_destination(destination, max_hops)
+        # reachable[i]: types at position i of a path from the root, paths stop at the destination
+        reachable = [{root_id}]
+        for _ in range(1, max_hops):
+            reachable.append({successor for node in reachable[-1] if node != destination_id
+                              for successor in self.successors[node]})
+
+        for hop in range(2, max_hops + 1):
+            result_dict[f'{hop}_hop'] = {
+                f'intermediate_node_{i}': [self.types[node] for node in sorted(reachable[i])
+                                           if node != destination_id and reaches[hop - i][node]]
+                for i in range(1, hop)
+            }
+            if not all(result_dict[f'{hop}_hop'].values()):
+                result_dict[f'{hop}_hop'] = dict()
+        return result_dict
+
+
 # Recursive function to create hop chain paths
 def explore_paths(graph, current_node, path, current_hop, max_hops, hop_chain_paths, destination):
     """Recursively explores paths in robokop upto a specified maximum number of hops.
@@ -41,36 +219,42 @@ def explore_paths(graph, current_node, path, current_hop, max_hops, hop_chain_pa
                       destination)
 
 
-# Function to initialize the adjacency list and start recursion
-def get_hop_chain_paths_with_recursion(graph_df, root, n, destination=None):
-
-    # Create an adjacency list with relations from the DataFrame
-    adjacency_list = defaultdict(set)
-
-    for idx, row in graph_df.iterrows():
-        adjacency_list[row['source']].add(row['destination'])
+meta_graph = MetaGraph.from_dataframe(df)
 
-    # Dictionary to store the paths for each hop level
-    hop_chain_paths = defaultdict(list)
+# MetaGraphs of the other dataframes (e.g. the one each importing script loads), keyed on id(graph_df) with a
+# weak reference to the frame so that a recycled id is not mistaken for the same frame
+_meta_graphs = {}
 
-    # Start the recursive exploration from the root node
-    explore_paths(adjacency_list, root, [root], 0, n, hop_chain_paths, destination)
 
-    # Ensure that each hop level has an empty list if no paths were found
-    for i in range(1, n + 1):
-        hop_chain_paths[f'{i}_hop'] = hop_chain_paths.get(f'{i}_hop', [])
+def get_meta_graph(graph_df):
+    """The MetaGraph of the dataframe, built once per dataframe so its cache is reused across calls"""
+    if graph_df is df:
+        return meta_graph
+    key = id(graph_df)
+    entry = _meta_graphs.get(key)
+    if entry is None or entry[0]() is not graph_df:
 
-    return dict(hop_chain_paths)
+        def forget(ref):
+            if _meta_graphs.get(key, (None,))[0] is ref:
+                del _meta_graphs[key]
 
+        entry = (weakref.ref(graph_df, forget), MetaGraph.from_dataframe(graph_df))
+        _meta_graphs[key] = entry
+    return entry[1]
 
-root_node = "biolink:Gene"
-n_levels = 2
-destination_node = "biolink:Disease"
-
-hop_chain_paths_with_destination = get_hop_chain_paths_with_recursion(df, root_node, n_levels)
-print(hop_chain_paths_with_destination)
-# print(hop_chain_paths_with_destination['1_hop'][:2])
 
+# Function to initialize the adjacency list and start recursion
+def get_hop_chain_paths_with_recursion(graph_df, root, n, destination=None):
+    """Paths from the root per hop level, see MetaGraph.paths (use MetaGraph.iter_paths to stream them, or
+    MetaGraph.count_paths when only the number of paths is needed)"""
+    return {hop: list(paths) for hop, paths in get_meta_graph(graph_df).paths(root, n, destination).items()}
 
 
+if __name__ == "__main__":
+    root_node = "biolink:Gene"
+    n_levels = 2
+    destination_node = "biolink:Disease"
 
+    hop_chain_paths_with_destination = get_hop_chain_paths_with_recursion(df, root_node, n_levels)
+    print(hop_chain_paths_with_destination)
+    # print(hop_chain_paths_with_destination['1_hop'][:2])
@@ -1,18 +1,42 @@
+import atexit
+import os
+import threading
+
 from neo4j import GraphDatabase
 
+URI = os.getenv("NEO4J_URI", "neo4j://robokopkg.renci.org:7687")
+AUTH = ("", "")
+MAX_POOL_SIZE = int(os.getenv("NEO4J_MAX_POOL_SIZE", "50"))
+ACQUISITION_TIMEOUT = float(os.getenv("NEO4J_ACQUISITION_TIMEOUT", "30"))
+
+_driver = None
+_driver_lock = threading.Lock()
+
 
 def get_neo4j_driver() -> GraphDatabase.driver:
-    URI = "neo4j://robokopkg.renci.org:7687"
-    AUTH = ("", "")
-    driver = GraphDatabase.driver(uri=URI, auth=AUTH)
-    return driver
+    """Return the process-wide driver, so every query reuses its connection pool instead of reconnecting"""
+    global _driver
+    with _driver_lock:
+        if _driver is None:
+            _driver = GraphDatabase.driver(uri=URI, auth=AUTH, max_connection_pool_size=MAX_POOL_SIZE,
+                                           connection_acquisition_timeout=ACQUISITION_TIMEOUT, keep_alive=True)
+            atexit.register(close_neo4j_driver)
+        return _driver
+
+
+def close_neo4j_driver():
+    global _driver
+    with _driver_lock:
+        if _driver is not None:
+            _driver.close()
+            _driver = None
 
 
 def fetch_data_from_neo4j(query: str):
-    # Get the driver instance
+    # Get the shared driver instance
     driver = get_neo4j_driver()
 
-    # Open a new session
+    # Open a new session, its connection goes back to the pool when it closes
     with driver.session() as session:
         # Run the Cypher query
         result = session.run(query)
@@ -20,7 +44,4 @@ def fetch_data_from_neo4j(query: str):
         # Extract the data from the result
         data = [record.data() for record in result]
 
-    # Close the driver connection
-    driver.close()
     return data
-
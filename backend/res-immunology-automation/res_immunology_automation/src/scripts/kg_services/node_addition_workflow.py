@@ -1,9 +1,10 @@
 from neo4j_connector import fetch_data_from_neo4j
 from kg_utils import get_all_node_types
+from csr_graph import get_local_graph
 from json_utils import load_json
+from graph_model import KnowledgeGraph
 from qdrant_client import models, QdrantClient
 from sentence_transformers import SentenceTransformer
-import json
 
 
 def get_node_types_online():  # Might need to fetch from config
@@ -17,13 +18,7 @@ def get_node_types_offline(json_file_path):   # Might need to fetch from config
     """To show all the available node types in the dropdown when mode is offline
     Args: json_file_path(str): Path of the backned graph json
     Returns : List of all the uniqie node types available in the backend graph json"""
-    all_labels = set()
-    json_data = load_json(json_file_path)
-    for item in json_data['elements']:
-        entry = item.get('data', {})
-        node_type = entry.get('type')
-        all_labels.add(node_type)
-    return all_labels
+    return KnowledgeGraph.from_json(load_json(json_file_path)).node_types()
 
 
 def get_nodes_based_on_user_query(mode, node_type, user_query):
@@ -47,26 +42,52 @@ def get_nodes_based_on_user_query(mode, node_type, user_query):
 
 
 def get_existing_nodes_in_graph(json_data):
-    """To get all the existing nodes in the subgraph json"""
-    existing_nodes_in_subgraph = set()
-    for item in json_data['elements']:
-        nodes = dict()
+    """To get all the existing nodes in the subgraph json (or its KnowledgeGraph)"""
+    existing_nodes_in_subgraph = []
+    for item in KnowledgeGraph.from_json(json_data).nodes.values():
         entry = item.get('data', {})
-        nodes['node_id'] =  entry.get('id')
-        nodes['node_name'] = entry.get('label')
-        nodes['node_type'] = entry.get('type')
-        existing_nodes_in_subgraph.add(nodes)
+        existing_nodes_in_subgraph.append({'node_id': entry.get('id'), 'node_name': entry.get('label'),
+                                           'node_type': entry.get('type')})
 
     return existing_nodes_in_subgraph
 
 
+def find_newly_added_node_connections_local(node_type, node_id, lst_of_target_nodes):
+    """The connections of find_newly_added_node_connections_online from the local CSR graph, the node and edges only
+    carry the properties it holds (id, name, category / predicate)
+    Returns: list of elements, or None when the local graph is not built, does not have the node or was built without
+             some of its connections"""
+    graph = get_local_graph()
+    if graph is None or not graph.has_node(node_id) or not graph.covers_neighbors():
+        return None
+    target_ids = set(lst_of_target_nodes)
+    connections = [neighbour for neighbour in graph.neighbors(node_id) if neighbour['node_id'] in target_ids]
+    if not connections:
+        return []
+
+    categories = graph.node_categories(node_id)
+    name = graph.node_names[graph.node_index[node_id]]
+    data_to_be_added = [{"data": {'id': node_id, 'label': name, 'type': node_type, 'labels': categories,
+                                  'properties': {'id': node_id, 'name': name, 'category': categories}}}]
+    for connection in connections:
+        data_to_be_added.append({"data": {'source': node_id, 'target': connection['node_id'],
+                                          'label': connection['relationship'],
+                                          'properties': {'predicate': connection['relationship']}}})
+    return data_to_be_added
+
+
 def find_newly_added_node_connections_online(node_type, node_id, lst_of_target_nodes):
-    """When node needs to be added in online mode (from robokop to the backend subgraph)
+    """When node needs to be added in online mode (from robokop to the backend subgraph), answered from the local CSR
+    graph when it has the node (by its CURIE)
     Args: node_type (str): Label of the node to optimize the query
           node_id (str): node id of the selected node among top 10 results
           lst_of_target_nodes (list): list of existing nodes in the backend graph to get the connections
     Returns: list of dictionaries containing the new node data along with its connections with the existing nodes
            """
+    local_connections = find_newly_added_node_connections_local(node_type, node_id, lst_of_target_nodes)
+    if local_connections is not None:
+        return local_connections
+
     try:
         query = (f"MATCH(source: `{node_type}`) - [r] - (target) "
                  f"WHERE elementID(source) ends with '{node_id}' and target.id IN{lst_of_target_nodes} "
@@ -110,51 +131,54 @@ def find_newly_added_node_connections_online(node_type, node_id, lst_of_target_n
 def find_newly_added_node_connections_offline(node_id, lst_of_target_nodes, backend_json_data):
     """When node needs to be added form the backend subgraph to the graph which will be shown on the UI
     Args: node_id(str): node id of the selected node among top 10 results
-          lst_of_target_nodes (list): list of existing nodes in the UI graph to get the connections with new node
-          backend_json_data: To get the node data from the backend graph json to the dynamic json
+          lst_of_target_nodes (list): list of existing node ids in the UI graph to get the connections with new node
+          backend_json_data: To get the node data from the backend graph json (or its KnowledgeGraph) to the dynamic json
     Returns: list of dictionaries containing the new node data along with its connections with the existing nodes"""
+    backend_graph = KnowledgeGraph.from_json(backend_json_data)
     node_connections = []
-    for target_id in lst_of_target_nodes:
-        for item in backend_json_data['elements']:
-            data = item.get('data', {})
-
-            # Check if the item itself matches the node_id
-            if item.get('id') == str(node_id):
-                node_connections.append(item)
-
-            # Check for connections between the node_id and target_id
-            if data.get('source') == node_id and data.get('target') == target_id:
-                node_connections.append({"data": {
-                    'source': data['source'],
-                    'target': data['target'],
-                    'relationship': data['label'],
-                    'properties': data.get('properties', {})
-                }})
+
+    node = backend_graph.nodes.get(str(node_id))
+    if node is not None:
+        node_connections.append(node)
+
+    # Only the edges of the node are looked at, through the adjacency index
+    target_ids = {str(target_id) for target_id in lst_of_target_nodes}
+    for (source, target, label), edge in backend_graph.incident_edges(node_id):
+        if source == str(node_id) and target in target_ids:
+            data = edge.get('data', {})
+            node_connections.append({"data": {
+                'source': data['source'],
+                'target': data['target'],
+                'relationship': label,
+                'properties': data.get('properties', {})
+            }})
 
     return node_connections  # JSON will be updated
 
 
-def update_json(connection):
-    for data in connection:
-        json.dumps(data)
+def update_json(connection, graph):
+    """Add the new node and its connections to the graph, its indexes are updated in place
+    Args: connection (list): elements returned by find_newly_added_node_connections_*
+          graph (KnowledgeGraph): graph to update"""
+    graph.add_elements(connection)
+    return graph
 
 
 def add_new_node_relations(mode, node_type, node_id, backend_json_data, json_data):
-    """Add node based on the mode selected by user"""
+    """Add node based on the mode selected by user
+    Args: backend_json_data, json_data (dict or KnowledgeGraph): backend graph and UI graph, pass KnowledgeGraphs to
+          keep them indexed across additions
+    Returns (KnowledgeGraph): The updated UI graph, to_json() gives back the Cytoscape.js json"""
+    backend_graph = KnowledgeGraph.from_json(backend_json_data)
+    graph = KnowledgeGraph.from_json(json_data)
+
     if mode == 'online':
         # From robokop to backend graph
-        lst_of_target_nodes_backend = get_existing_nodes_in_graph(backend_json_data)
+        lst_of_target_nodes_backend = [node['node_id'] for node in get_existing_nodes_in_graph(backend_graph)]
         bac_node_connections = find_newly_added_node_connections_online(node_type, node_id, lst_of_target_nodes_backend)
-        update_json(bac_node_connections)
-
-        # From backend graph to UI graph
-        lst_of_target_nodes = get_existing_nodes_in_graph(json_data)
-        node_connections = find_newly_added_node_connections_offline(node_id, lst_of_target_nodes, backend_json_data)
-        update_json(node_connections)
-
-    else:
-        # From backend graph to UI graph
-        lst_of_target_nodes = get_existing_nodes_in_graph(json_data)
-        node_connections = find_newly_added_node_connections_offline(node_id, lst_of_target_nodes, backend_json_data)
-        update_json(node_connections)
+        update_json(bac_node_connections or [], backend_graph)
 
+    # From backend graph to UI graph
+    lst_of_target_nodes = [node['node_id'] for node in get_existing_nodes_in_graph(graph)]
+    node_connections = find_newly_added_node_connections_offline(node_id, lst_of_target_nodes, backend_graph)
+    return update_json(node_connections, graph)
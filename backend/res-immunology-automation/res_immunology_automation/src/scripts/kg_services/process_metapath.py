@@ -1,6 +1,6 @@
 import pandas as pd
 from collections import defaultdict
-from metapaths import get_hop_chain_paths_with_recursion
+from metapaths import get_hop_chain_paths_with_recursion, get_meta_graph
 from json_utils import process_json_to_dataframe
 from json_utils import create_source_destination_relation_dict
 
@@ -14,6 +14,8 @@ source_destination_relation_dict = create_source_destination_relation_dict(df)
 
 # Function to build unique intermediate nodes based on dynamic hop levels
 def build_unique_nodes_by_n_hop(hop_dict):
+    """Intermediate node types per position from already built paths.
+    MetaGraph.intermediate_types gives the same result straight from the meta graph, without the paths"""
     result_dict = {}
 
     # For 1_hop, no intermediate nodes, return an empty set
@@ -54,7 +56,10 @@ def build_unique_nodes_by_n_hop(hop_dict):
 
 
 def generate_edges_for_n_hops(n_hop_node_dict, relation_dict):
-    """Get edges for each node for each hop in the hop node dict"""
+    """Get edges for each node for each hop in the hop node dict
+    Args: n_hop_node_dict (dict): paths per hop level, 'type-type' strings or tuples of node types
+          (MetaGraph.iter_paths), the values can be generators
+          relation_dict (dict): relations per (source, destination) pair"""
     n_hop_inter_nodes_and_edges_dict = dict()
 
     for key, value in n_hop_node_dict.items():
@@ -71,7 +76,7 @@ def generate_edges_for_n_hops(n_hop_node_dict, relation_dict):
 
         lst_of_all_paths_with_their_relations = []
         for path in value:
-            elements = path.split('-')
+            elements = path.split('-') if isinstance(path, str) else list(path)
             intermediate_nodes = elements[1:-1]
 
             # Create a list of tuples, starting from the first element and progressively adding more
@@ -93,9 +98,14 @@ source = 'biolink:Gene'
 target = 'biolink:Disease'
 n_levels = 4
 
+meta_graph = get_meta_graph(df)
 hop_chain_paths_with_destination = get_hop_chain_paths_with_recursion(df, source, n_levels, target)
 edges_result = generate_edges_for_n_hops(hop_chain_paths_with_destination, source_destination_relation_dict)
 
+# Counts and intermediate node types without building the paths
+# print(meta_graph.count_paths(source, n_levels, target))
+# print(meta_graph.intermediate_types(source, n_levels, target))
+
 # print(hop_chain_paths_with_destination.keys())
 # for k, v in hop_chain_paths_with_destination.items():
 #     print(k, len(v))
@@ -1,6 +1,26 @@
+"""
+Semantic matching of user queries with the ROBOKOP disease nodes.
+
+The node descriptions are embedded into a local index: a memory-mapped float32 matrix of normalized vectors
+(vectors.npy) and the table of the nodes of its rows (nodes.csv, with the hash of the embedded text). Rebuilding only
+embeds the nodes whose text changed. match_query searches it in process, exactly or through the IVF lists built for
+large indexes, Qdrant is only used when a client is given.
+
+Usage (from the kg_services directory):
+    python semantic_search.py                  # update the index from disease_nodes_all.csv
+    python semantic_search.py --qdrant         # also upload the nodes to the Qdrant collection
+    python semantic_search.py --query "atopic dermatitis"
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
 import pandas as pd
-from qdrant_client import models, QdrantClient
-from sentence_transformers import SentenceTransformer
 
 
 # # lst_of_dict_for_labels = fetch_data_from_neo4j(
@@ -9,36 +29,224 @@ from sentence_transformers import SentenceTransformer
 # # csv_path = "../../kg_data/disease_nodes_all.csv"  # Specify the path to save the CSV
 # # df.to_csv(csv_path, index=False)
 
-nodes = pd.read_csv("../../kg_data/disease_nodes_all.csv")
-data_list = nodes.to_dict(orient="records")
+NODES_CSV_PATH = "../../kg_data/disease_nodes_all.csv"
+INDEX_PATH = os.getenv("DISEASE_INDEX_PATH", "../../kg_data/disease_nodes_index")
+QDRANT_URL = "http://localhost:6333"
+ENCODER_MODEL = "all-MiniLM-L6-v2"
+collection_name = "disease_nodes_description_only"
+batch_size = 1000
 
+# Indexes with more rows get IVF lists: ~sqrt(n) k-means clusters, IVF_PROBES of them searched per query
+IVF_MIN_ROWS = 200000
+IVF_PROBES = 16
+
+SearchHit = namedtuple("SearchHit", ["id", "score", "payload"])
+
+
+@lru_cache(maxsize=1)
+def get_encoder():
+    """ Load the sentence encoder once, it is slow """
+    from sentence_transformers import SentenceTransformer
+
+    return SentenceTransformer(ENCODER_MODEL)
+
+
+def get_encoder_and_client():
+    """ Load the sentence encoder and connect to Qdrant, both are slow so this is only done when needed """
+    from qdrant_client import QdrantClient
+
+    client = QdrantClient(url=QDRANT_URL)
+    return get_encoder(), client
+
+
+def node_text(doc):
+    """ Text embedded for a node: its description, or its name when it has none """
+    description = doc.get('node_description')
+    if description is None or pd.isna(description) or not str(description).strip():
+        return str(doc.get('node_name') or '')
+    return str(description)
+
+
+def text_hash(text):
+    return hashlib.sha1(f"{ENCODER_MODEL}\n{text}".encode()).hexdigest()
+
+
+def encode_texts(encoder, texts, workers=None):
+    """ Normalized float32 embeddings of the texts, encoded by one process per CPU core for large inputs """
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and len(texts) >= workers * batch_size:
+        pool = encoder.start_multi_process_pool(["cpu"] * workers)
+        try:
+            vectors = encoder.encode_multi_process(texts, pool, batch_size=64)
+        finally:
+            encoder.stop_multi_process_pool(pool)
+    else:
+        vectors = encoder.encode(texts, batch_size=64)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def build_ivf(vectors, n_lists, iterations=10, seed=0):
+    """ Spherical k-means of the vectors
+    Returns: the centroids and, per list, the rows of the vectors (as offsets into a flat array of rows) """
+    rng = np.random.default_rng(seed)
+    centroids = np.array(vectors[rng.choice(len(vectors), n_lists, replace=False)], dtype=np.float32)
+    for _ in range(iterations):
+        assignments = np.concatenate([np.argmax(vectors[start:start + 65536] @ centroids.T, axis=1)
+                                      for start in range(0, len(vectors), 65536)])
+        for cluster in range(n_lists):
+            members = assignments == cluster
+            if members.any():
+                centroid = vectors[members].sum(axis=0)
+                centroids[cluster] = centroid / (np.linalg.norm(centroid) or 1)
+    rows = np.argsort(assignments, kind="stable")
+    offsets = np.zeros(n_lists + 1, dtype=np.int64)
+    np.cumsum(np.bincount(assignments, minlength=n_lists), out=offsets[1:])
+    return centroids, offsets, rows
 
-# # Initialize the encoder and client
-encoder = SentenceTransformer("all-MiniLM-L6-v2")
-client = QdrantClient(url="http://localhost:6333")
-collection_name = "disease_nodes_description_only"
 
-# client.delete_collection(collection_name=collection_name)
-client.create_collection(
-    collection_name=collection_name,
-    vectors_config=models.VectorParams(
-        size=encoder.get_sentence_embedding_dimension(),
-        distance=models.Distance.COSINE,
-        on_disk=True
-    ),
-)
+def build_index(nodes_csv_path=NODES_CSV_PATH, index_path=INDEX_PATH, encoder=None, workers=None):
+    """ Update the local index from the nodes csv, only the nodes whose text changed are embedded again
+    Args: nodes_csv_path (str): csv with node_id, node_name, node_description columns
+          index_path (str): index directory, replaced atomically
+          encoder: sentence encoder (get_encoder() by default)
+          workers (int, optional): encoding processes, one per CPU core by default
+    Returns: (int, int): number of nodes and of nodes embedded """
+    nodes = pd.read_csv(nodes_csv_path)
+    texts = [node_text(doc) for doc in nodes.to_dict(orient="records")]
+    nodes["text_hash"] = [text_hash(text) for text in texts]
 
+    # reuse the vectors of the unchanged texts
+    previous, previous_vectors = {}, None
+    if os.path.exists(os.path.join(index_path, "vectors.npy")):
+        previous_vectors = np.load(os.path.join(index_path, "vectors.npy"), mmap_mode="r")
+        previous_hashes = pd.read_csv(os.path.join(index_path, "nodes.csv"), usecols=["text_hash"])["text_hash"]
+        previous = {hash_: row for row, hash_ in enumerate(previous_hashes)}
 
-# Function to encode a batch of documents and upload
-def encode_and_upload_batch(batch_data, batch_start_idx):
-    batch_vectors = encoder.encode(
-        [f"{doc['node_description']}" for doc in batch_data]
-    ).tolist()
+    changed = [i for i, hash_ in enumerate(nodes["text_hash"]) if hash_ not in previous]
+    new_vectors = None
+    if changed:
+        new_vectors = encode_texts(encoder or get_encoder(), [texts[i] for i in changed], workers)
+    if new_vectors is not None:
+        dimension = new_vectors.shape[1]
+    elif previous_vectors is not None:
+        dimension = previous_vectors.shape[1]
+    else:
+        # no node and no previous index, the index is written empty
+        dimension = (encoder or get_encoder()).get_sentence_embedding_dimension()
+
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    vectors = np.lib.format.open_memmap(os.path.join(tmp_path, "vectors.npy"), mode="w+", dtype=np.float32,
+                                        shape=(len(nodes), dimension))
+    reused = [(i, previous[hash_]) for i, hash_ in enumerate(nodes["text_hash"]) if hash_ in previous]
+    if reused:
+        rows, previous_rows = map(np.array, zip(*reused))
+        vectors[rows] = previous_vectors[previous_rows]
+    if changed:
+        vectors[np.array(changed)] = new_vectors
+    vectors.flush()
+    nodes.to_csv(os.path.join(tmp_path, "nodes.csv"), index=False)
+
+    meta = {"model": ENCODER_MODEL, "dimension": int(dimension), "count": len(nodes), "ivf": False}
+    if len(nodes) >= IVF_MIN_ROWS:
+        centroids, offsets, rows = build_ivf(vectors, int(np.sqrt(len(nodes))))
+        for name, values in (("ivf_centroids", centroids), ("ivf_offsets", offsets), ("ivf_rows", rows)):
+            np.save(os.path.join(tmp_path, f"{name}.npy"), values)
+        meta["ivf"] = True
+    with open(os.path.join(tmp_path, "meta.json"), "w") as file:
+        json.dump(meta, file)
+    del vectors
+
+    old_path = f"{index_path}.{os.getpid()}.old"
+    if os.path.exists(index_path):
+        os.replace(index_path, old_path)
+    os.replace(tmp_path, index_path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return len(nodes), len(changed)
+
+
+class VectorIndex:
+    """ The local index, memory-mapped, for top-k cosine similarity search """
+
+    def __init__(self, index_path=INDEX_PATH):
+        self.path = index_path
+        with open(os.path.join(index_path, "meta.json")) as file:
+            self.meta = json.load(file)
+        self.vectors = np.load(os.path.join(index_path, "vectors.npy"), mmap_mode="r")
+        nodes = pd.read_csv(os.path.join(index_path, "nodes.csv")).drop(columns=["text_hash"])
+        self.payloads = nodes.astype(object).where(nodes.notna(), None).to_dict(orient="records")
+        self.ivf = None
+        if self.meta.get("ivf"):
+            self.ivf = tuple(np.load(os.path.join(index_path, f"{name}.npy"))
+                             for name in ("ivf_centroids", "ivf_offsets", "ivf_rows"))
+
+    def search(self, query_vector, limit=20, exact=False, probes=IVF_PROBES):
+        """ Rows with the highest cosine similarity to the query vector
+        Args: query_vector (np.ndarray): query embedding
+              limit (int): number of hits
+              exact (bool): score every row even when the index has IVF lists
+              probes (int): IVF lists searched
+        Returns: list of SearchHit(id, score, payload), best first """
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1)
+        if self.ivf is None or exact:
+            rows = None
+            scores = self.vectors @ query
+        else:
+            centroids, offsets, ivf_rows = self.ivf
+            lists = np.argsort(centroids @ query)[::-1][:probes]
+            rows = np.sort(np.concatenate([ivf_rows[offsets[cluster]:offsets[cluster + 1]] for cluster in lists]))
+            scores = self.vectors[rows] @ query
+        limit = min(limit, len(scores))
+        if not limit:
+            return []
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [SearchHit(int(row if rows is None else rows[row]), float(scores[row]),
+                          self.payloads[row if rows is None else rows[row]])
+                for row in top]
+
+
+@lru_cache(maxsize=4)
+def _load_index(index_path, mtime):
+    return VectorIndex(index_path)
+
+
+def get_index(index_path=INDEX_PATH):
+    """ The local index, reloaded when it is rebuilt """
+    return _load_index(index_path, os.path.getmtime(os.path.join(index_path, "meta.json")))
+
+
+def create_collection(client, encoder, collection_name):
+    from qdrant_client import models
+
+    # Reruns keep the collection and overwrite its points
+    if client.collection_exists(collection_name=collection_name):
+        return
+    client.create_collection(
+        collection_name=collection_name,
+        vectors_config=models.VectorParams(
+            size=encoder.get_sentence_embedding_dimension(),
+            distance=models.Distance.COSINE,
+            on_disk=True
+        ),
+    )
+
+
+# Function to upload a batch of documents with their vectors
+def encode_and_upload_batch(client, encoder, collection_name, batch_data, batch_start_idx, batch_vectors=None):
+    from qdrant_client import models
+
+    if batch_vectors is None:
+        batch_vectors = encode_texts(encoder, [node_text(doc) for doc in batch_data], workers=1)
 
     points = [
         models.PointStruct(
             id=batch_start_idx + idx,
-            vector=batch_vectors[idx],
+            vector=batch_vectors[idx].tolist(),
             payload=doc
         )
         for idx, doc in enumerate(batch_data)
@@ -48,33 +256,54 @@ def encode_and_upload_batch(batch_data, batch_start_idx):
     client.upload_points(collection_name=collection_name, points=points)
 
 
-# Batch processing
-batch_size = 1000
-for batch_start in range(0, len(data_list), batch_size):
-    batch_data = data_list[batch_start:batch_start + batch_size]
-    encode_and_upload_batch(batch_data, batch_start)
-    print(f"Uploaded batch starting at index {batch_start}")
-
-print("All data uploaded successfully.")
+def upload_index_to_qdrant(client, encoder, collection_name, index_path=INDEX_PATH):
+    """ Upload the nodes of the local index to Qdrant with their vectors, nothing is embedded again """
+    index = get_index(index_path)
+    create_collection(client, encoder, collection_name)
+    for batch_start in range(0, len(index.payloads), batch_size):
+        batch_data = index.payloads[batch_start:batch_start + batch_size]
+        encode_and_upload_batch(client, encoder, collection_name, batch_data, batch_start,
+                                index.vectors[batch_start:batch_start + batch_size])
+        print(f"Uploaded batch starting at index {batch_start}")
 
 
 # Function to match user query with the vector embeddings
-def match_query(client, encoder, collection_name, disease_name):
-    hits = client.query_points(
-        collection_name=collection_name,
-        query=encoder.encode(disease_name).tolist(),
-        limit=20,
-    ).points
-    return hits
+def match_query(disease_name, limit=20, encoder=None, client=None, collection_name=collection_name,
+                index_path=INDEX_PATH):
+    """ Disease nodes closest to the query, from the local index, or from the Qdrant collection when a client is given
+    Returns: list of hits with id, score and payload (the node_id, node_name and node_description of the node) """
+    encoder = encoder or get_encoder()
+    if client is not None:
+        return client.query_points(
+            collection_name=collection_name,
+            query=encoder.encode(disease_name).tolist(),
+            limit=limit,
+        ).points
+    return get_index(index_path).search(encoder.encode(disease_name), limit)
 
 
-results_name = match_query(client, encoder, "disease_nodes_names_only", "atopic dermatitis")
-results_combined = match_query(client, encoder, "disease_nodes_all", "atopic dermatitis")
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", default=NODES_CSV_PATH, help="Disease nodes csv")
+    parser.add_argument("--index", default=INDEX_PATH, help="Index directory")
+    parser.add_argument("--workers", type=int, default=None, help="Encoding processes (one per CPU core)")
+    parser.add_argument("--qdrant", action="store_true", help="Also upload the nodes to the Qdrant collection")
+    parser.add_argument("--query", help="Only match a query against the index")
+    args = parser.parse_args()
 
-# for result in results:
-#     print(result.payload, result.score)
+    if args.query:
+        for hit in match_query(args.query, index_path=args.index):
+            print(hit.payload, hit.score)
+        return
 
-# hidradenitis suppurativa
+    count, embedded = build_index(args.nodes, args.index, workers=args.workers)
+    print(f"Index updated: {count} nodes, {embedded} embedded")
 
+    if args.qdrant:
+        encoder, client = get_encoder_and_client()
+        upload_index_to_qdrant(client, encoder, collection_name, args.index)
+        print("All data uploaded successfully.")
 
 
+if __name__ == "__main__":
+    main()
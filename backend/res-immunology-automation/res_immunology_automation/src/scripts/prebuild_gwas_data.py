@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Prebuild the GWAS locus zoom data.
+
+Ingests the GWAS Catalog associations.tsv into the columnar associations store (if it is missing or older than the
+TSV) and generates the locus zoom file and tiles of every disease listed in diseases_to_cache.json, so
+/genomics/locus-zoom and /genomics/locus-zoom/tiles never build them on a request.
+
+Usage (from the scripts directory):
+    python prebuild_gwas_data.py [--rebuild] [--diseases-file PATH]
+"""
+import argparse
+import json
+from typing import List
+
+from component_services.locus_zoom_services import build_associations_store, build_variant_tiles, load_data
+from utils import get_efo_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rebuild", action="store_true",
+                        help="re-ingest associations.tsv and regenerate every locus zoom file and tiles")
+    parser.add_argument("--diseases-file", default="../disease_data/diseases_to_cache.json",
+                        help="JSON list of the diseases to prebuild")
+    args = parser.parse_args()
+
+    print(f"Associations store: {build_associations_store(force=args.rebuild)}")
+
+    with open(args.diseases_file) as f:
+        diseases: List[str] = sorted({disease.strip().lower() for disease in json.load(f)})
+
+    missing: List[str] = []
+    for disease in diseases:
+        efo_id = get_efo_id(disease)
+        if not efo_id:
+            missing.append(disease)
+            continue
+        file_path = load_data(efo_id, refresh=args.rebuild)
+        if file_path is None:
+            missing.append(disease)
+        else:
+            build_variant_tiles(efo_id, refresh=args.rebuild)
+        print(f"{disease} ({efo_id}): {file_path}")
+
+    print(f"Prebuilt {len(diseases) - len(missing)}/{len(diseases)} diseases")
+    if missing:
+        print(f"No GWAS associations for: {', '.join(missing)}")
+
+
+if __name__ == "__main__":
+    main()
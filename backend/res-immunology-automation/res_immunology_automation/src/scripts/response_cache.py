@@ -0,0 +1,199 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+
+from serialization import dumps
+
+# Directory holding the precompressed payloads and their ETag metadata
+RESPONSE_CACHE_DIR: str = "cached_data_json/responses"
+
+
+def _cache_paths(cache_key: str) -> Dict[str, str]:
+    """ Return the metadata file path and the blob file name prefix used for a cache key """
+    digest: str = hashlib.sha1(cache_key.encode("utf-8")).hexdigest()
+    return {
+        "digest": digest,
+        "meta": os.path.join(RESPONSE_CACHE_DIR, f"{digest}.meta.json"),
+    }
+
+
+def _blob_path(meta: Dict[str, Any]) -> str:
+    return os.path.join(RESPONSE_CACHE_DIR, meta["blob"])
+
+
+def _write_atomically(path: str, content: bytes) -> None:
+    """ Write to a unique temporary file first so concurrent readers and writers never see a partial file """
+    fd, tmp_path = tempfile.mkstemp(dir=RESPONSE_CACHE_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def fingerprint_sources(source_files: List[str]) -> Optional[Dict[str, List[int]]]:
+    """
+    Fingerprint the cached JSON files a response is built from.
+
+    Args:
+        source_files (List[str]): Paths of the cached JSON files.
+
+    Returns:
+        Optional[Dict[str, List[int]]]: Mapping of path to [mtime_ns, size], or None if a file is missing.
+    """
+    fingerprint: Dict[str, List[int]] = {}
+    for file_path in source_files:
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        fingerprint[file_path] = [stat.st_mtime_ns, stat.st_size]
+    return fingerprint
+
+
+def load_payload_meta(cache_key: str, source_files: List[str]) -> Optional[Dict[str, Any]]:
+    """
+    Return the stored ETag metadata for a cache key if the source files are unchanged since it was written.
+    Only the small metadata file is read, never the payload itself.
+    """
+    paths = _cache_paths(cache_key)
+    fingerprint = fingerprint_sources(source_files)
+    if fingerprint is None or not os.path.isfile(paths["meta"]):
+        return None
+    try:
+        with open(paths["meta"], "r") as file:
+            meta: Dict[str, Any] = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if meta.get("sources") != fingerprint or "blob" not in meta or not os.path.isfile(_blob_path(meta)):
+        return None
+    return meta
+
+
+def store_payload(cache_key: str, payload: Any, source_files: List[str]) -> Dict[str, Any]:
+    """
+    Serialize a payload once, store it gzip-compressed together with its content hash.
+
+    The blob is named after its ETag and the metadata points to it, so replacing the metadata file (one rename)
+    switches the ETag and the body together.
+
+    Args:
+        cache_key (str): Key identifying the response (endpoint and entities).
+        payload (Any): The response payload.
+        source_files (List[str]): Cached JSON files the payload was built from.
+
+    Returns:
+        Dict[str, Any]: The metadata record, including the ETag.
+    """
+    os.makedirs(RESPONSE_CACHE_DIR, exist_ok=True)
+    paths = _cache_paths(cache_key)
+
+    body: bytes = dumps(payload)
+    body_hash: str = hashlib.sha256(body).hexdigest()
+    meta: Dict[str, Any] = {
+        "key": cache_key,
+        "etag": f'"{body_hash}"',
+        "blob": f"{paths['digest']}.{body_hash[:16]}.json.gz",
+        "sources": fingerprint_sources(source_files),
+    }
+
+    try:
+        with open(paths["meta"], "r") as file:
+            previous_blob: Optional[str] = json.load(file).get("blob")
+    except (OSError, ValueError):
+        previous_blob = None
+
+    if not os.path.isfile(_blob_path(meta)):
+        _write_atomically(_blob_path(meta), gzip.compress(body, compresslevel=6))
+    _write_atomically(paths["meta"], json.dumps(meta).encode("utf-8"))
+
+    if previous_blob and previous_blob != meta["blob"]:
+        # readers still holding the previous metadata rebuild the payload when its blob is gone
+        try:
+            os.remove(os.path.join(RESPONSE_CACHE_DIR, previous_blob))
+        except OSError:
+            pass
+    return meta
+
+
+def _etag_matches(http_request: Request, etag: str) -> bool:
+    if_none_match: str = http_request.headers.get("if-none-match", "")
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def _payload_response(http_request: Request, meta: Dict[str, Any]) -> Optional[Response]:
+    """
+    Build a response for a stored payload, answering conditional requests with 304.
+    Returns None when the blob was replaced since the metadata was read.
+    """
+    headers: Dict[str, str] = {"ETag": meta["etag"], "Vary": "Accept-Encoding"}
+    if _etag_matches(http_request, meta["etag"]):
+        return Response(status_code=304, headers=headers)
+
+    try:
+        with open(_blob_path(meta), "rb") as file:
+            compressed: bytes = file.read()
+    except FileNotFoundError:
+        return None
+
+    if "gzip" in http_request.headers.get("accept-encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+        return Response(content=compressed, media_type="application/json", headers=headers)
+    return Response(content=gzip.decompress(compressed), media_type="application/json", headers=headers)
+
+
+async def conditional_cached_response(
+        http_request: Optional[Request],
+        cache_key: str,
+        get_source_files: Callable[[], List[str]],
+        build_payload: Callable[[], Awaitable[Any]],
+) -> Any:
+    """
+    Serve a large cached payload with an ETag.
+
+    When the cached JSON files behind a response have not changed, a matching `If-None-Match` is answered with a 304
+    and other requests get the precompressed body, without loading or re-encoding the payload. Otherwise the payload
+    is rebuilt by `build_payload` and stored again. Internal callers pass no request and get the plain payload.
+
+    The cached endpoints are read-only POST queries whose cache key covers the request body, so their ETag is honoured
+    like on a GET: a client repeating a query with the ETag it got gets a 304 while the response is unchanged.
+
+    Args:
+        http_request (Optional[Request]): The incoming HTTP request, None for in-process calls.
+        cache_key (str): Key identifying the response (endpoint and entities).
+        get_source_files (Callable[[], List[str]]): Returns the cached JSON files the response is built from.
+        build_payload (Callable[[], Awaitable[Any]]): Coroutine factory producing the payload on a miss.
+
+    Returns:
+        Any: A Response for HTTP requests, otherwise the payload.
+    """
+    if http_request is None:
+        return await build_payload()
+
+    meta = load_payload_meta(cache_key, get_source_files())
+    if meta is not None:
+        response = _payload_response(http_request, meta)
+        if response is not None:
+            print(f"Returning precompressed response for {cache_key}")
+            return response
+
+    payload = await build_payload()
+    if isinstance(payload, Response):
+        return payload
+
+    meta = store_payload(cache_key, payload, get_source_files())
+    if meta["sources"] is None:
+        # some source files were not written (e.g. partial failures), don't trust the stored blob next time
+        os.remove(_cache_paths(cache_key)["meta"])
+    return _payload_response(http_request, meta) or Response(content=dumps(payload), media_type="application/json",
+                                                             headers={"ETag": meta["etag"]})
@@ -0,0 +1,119 @@
+"""
+JSON serialization shared by the file cache, Redis and HTTP responses.
+
+Everything goes through orjson, which encodes and decodes several times faster than the stdlib `json` module
+and natively handles numpy arrays and scalars, datetimes and dataclasses. The remaining types found in our
+payloads (sets/frozensets from the Neo4j driver, pandas objects and missing values) are handled in `_default`.
+"""
+import datetime
+import decimal
+import json
+import os
+import tempfile
+from typing import Any, Iterable, Iterator, Union
+
+import numpy as np
+import orjson
+import pandas as pd
+from fastapi.responses import JSONResponse
+
+OPTIONS: int = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def _default(obj: Any) -> Any:
+    """ Convert the types orjson does not support natively """
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, pd.DataFrame):
+        return obj.to_dict(orient="records")
+    if isinstance(obj, (pd.Series, pd.Index)):
+        return obj.tolist()
+    if isinstance(obj, pd.Timestamp):
+        return None if pd.isna(obj) else obj.isoformat()
+    if isinstance(obj, (pd.Timedelta, datetime.timedelta)):
+        return str(obj)
+    if obj is pd.NA or obj is pd.NaT:
+        return None
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, bytes):
+        return obj.decode("utf-8")
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj: Any) -> bytes:
+    """ Serialize an object to JSON bytes """
+    return orjson.dumps(obj, default=_default, option=OPTIONS)
+
+
+def loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+    """
+    Deserialize JSON from bytes or str.
+    orjson rejects the NaN/Infinity literals written by the stdlib `json` module into older cache files, those are
+    decoded with `json.loads` instead.
+    """
+    try:
+        return orjson.loads(data)
+    except orjson.JSONDecodeError:
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return json.loads(data)
+
+
+def dump_file(file_path: str, obj: Any):
+    """ Write an object as JSON to a file, atomically replacing any existing file """
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(file_path) or ".", suffix=".tmp", delete=False) as file:
+        tmp_path: str = file.name
+        try:
+            file.write(dumps(obj))
+        except BaseException:
+            file.close()
+            os.remove(tmp_path)
+            raise
+    os.replace(tmp_path, file_path)
+
+
+def load_file(file_path: str) -> Any:
+    """ Read a JSON file """
+    with open(file_path, "rb") as file:
+        return loads(file.read())
+
+
+class RedisJSONEncoder:
+    """ Encoder passed to `redis.json()`, which expects an object with an `encode` method returning str """
+
+    def encode(self, obj: Any) -> str:
+        return dumps(obj).decode("utf-8")
+
+
+class RedisJSONDecoder:
+    """ Decoder passed to `redis.json()`, which expects an object with a `decode` method """
+
+    def decode(self, data: Union[bytes, str]) -> Any:
+        return loads(data)
+
+
+def redis_json(redis):
+    """ Return the RedisJSON command interface of a client using the orjson encoder and decoder """
+    return redis.json(encoder=RedisJSONEncoder(), decoder=RedisJSONDecoder())
+
+
+def iter_ndjson(items: Iterable[Any], batch_size: int = 512) -> Iterator[bytes]:
+    """ Encode items as newline-delimited JSON, in chunks of `batch_size` lines for a streaming response """
+    batch = []
+    for item in items:
+        batch.append(orjson.dumps(item, default=_default, option=OPTIONS | orjson.OPT_APPEND_NEWLINE))
+        if len(batch) == batch_size:
+            yield b"".join(batch)
+            batch = []
+    if batch:
+        yield b"".join(batch)
+
+
+class FastJSONResponse(JSONResponse):
+    """ Default response class of the API, renders the content with orjson """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -1,6 +1,5 @@
 import pandas as pd
 from target_analyzer import TargetAnalyzer
-from helper import get_disease_descendants
 import requests
 from typing import *
 from utils import fetch_all_publications
@@ -971,7 +970,7 @@ def parse_disease_association(target):
 
         for disease in selected_diseases:
             parent_efo_id = TARGET_DISEASES[disease]
-            descendants_efo_ids = get_disease_descendants(disease)
+            descendants_efo_ids = TargetAnalyzer(disease).get_descendants(disease)
             descendants_efo_ids.append(parent_efo_id)
             efo_ids_set = set(descendants_efo_ids)
 
@@ -0,0 +1,118 @@
+"""
+Single-flight execution of expensive endpoint computations.
+
+Concurrent calls for the same key (endpoint and canonical entities) share one computation, calls for different
+keys run in parallel. Within a worker, followers await the leader's future. Across workers, the leader holds a
+Redis lock for the key: a worker that finds the lock taken waits for it to be released and then runs the
+computation itself, which is served from the cache the other worker has just filled.
+"""
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+from redis import Redis
+from redis.exceptions import LockError, RedisError
+from redis.lock import Lock
+
+from graphrag_service import get_redis
+
+# Expiry of the cross-worker lock, so a crashed worker never blocks a key for longer than this
+LOCK_TIMEOUT: int = int(os.getenv("SINGLE_FLIGHT_LOCK_TIMEOUT", "1800"))
+LOCK_POLL_INTERVAL: float = float(os.getenv("SINGLE_FLIGHT_POLL_INTERVAL", "0.5"))
+# After a Redis failure, skip the cross-worker lock for this long instead of paying the connection timeout per call
+REDIS_RETRY_AFTER: float = float(os.getenv("SINGLE_FLIGHT_REDIS_RETRY_AFTER", "30"))
+
+_in_flight: Dict[str, "asyncio.Future[Any]"] = {}
+_redis: Optional[Redis] = None
+_redis_down_until: float = 0.0
+
+
+def single_flight_key(endpoint: str, diseases: Optional[Iterable[str]] = None, target: Optional[str] = None) -> str:
+    """
+    Build the coalescing key of a request.
+
+    Args:
+        endpoint (str): Endpoint path.
+        diseases (Optional[Iterable[str]]): Requested diseases, normalized and sorted so their order doesn't matter.
+        target (Optional[str]): Requested target.
+
+    Returns:
+        str: The key.
+    """
+    parts = [endpoint]
+    if target:
+        parts.append(target.strip().lower())
+    if diseases:
+        parts.append(",".join(sorted({disease.strip().lower().replace(" ", "_") for disease in diseases})))
+    return ":".join(parts)
+
+
+def _lock_client() -> Redis:
+    global _redis
+    if _redis is None:
+        _redis = get_redis()
+    return _redis
+
+
+async def _acquire_lock(key: str) -> Optional[Lock]:
+    """ Wait for the cross-worker lock of a key, None if Redis is unavailable """
+    global _redis_down_until
+    if time.monotonic() < _redis_down_until:
+        return None
+    try:
+        lock = _lock_client().lock(f"single-flight:{key}", timeout=LOCK_TIMEOUT)
+        # the client is synchronous, keep its round trips off the event loop
+        while not await asyncio.to_thread(lock.acquire, blocking=False):
+            await asyncio.sleep(LOCK_POLL_INTERVAL)
+        return lock
+    except RedisError as e:
+        _redis_down_until = time.monotonic() + REDIS_RETRY_AFTER
+        print(f"Redis lock unavailable for {key}, coalescing within this worker only: {e}")
+        return None
+
+
+async def _release_lock(key: str, lock: Optional[Lock]):
+    if lock is None:
+        return
+    try:
+        await asyncio.to_thread(lock.release)
+    except (LockError, RedisError) as e:
+        # the lock expired or Redis went away, another worker may already be computing the key
+        print(f"Failed to release the lock for {key}: {e}")
+
+
+async def _run(key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+    lock = await _acquire_lock(key)
+    try:
+        return await compute()
+    finally:
+        await _release_lock(key, lock)
+
+
+async def single_flight(key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    Run a computation once for all concurrent callers of the same key.
+
+    Args:
+        key (str): Key from `single_flight_key`.
+        compute (Callable[[], Awaitable[Any]]): Coroutine factory producing the result.
+
+    Returns:
+        Any: The result, shared by all callers. Exceptions are raised to all callers.
+    """
+    future = _in_flight.get(key)
+    if future is not None:
+        print(f"Joining in-flight computation for {key}")
+        return await asyncio.shield(future)
+
+    future = asyncio.ensure_future(_run(key, compute))
+    _in_flight[key] = future
+
+    def _forget(done: "asyncio.Future[Any]"):
+        if _in_flight.get(key) is done:
+            del _in_flight[key]
+
+    future.add_done_callback(_forget)
+    # shield so a cancelled caller (e.g. a client disconnect) doesn't cancel the computation for the others
+    return await asyncio.shield(future)
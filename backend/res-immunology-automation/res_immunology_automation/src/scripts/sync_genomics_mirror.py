@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+"""
+Sync the local mirror of the GWAS Catalog studies and the PGS Catalog scores.
+
+Downloads the catalogs that changed since the last sync and rebuilds the DuckDB store queried by
+/genomics/gwas-studies and /genomics/pgscatalog. Meant to run periodically (e.g. a weekly cron job), both catalogs
+are released about once a week.
+
+Usage (from the scripts directory):
+    python sync_genomics_mirror.py [--force]
+"""
+import argparse
+
+from component_services.genomics_mirror import MIRROR_PATH, sync_mirror
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--force", action="store_true", help="download and rebuild everything even if nothing changed")
+    args = parser.parse_args()
+
+    if sync_mirror(force=args.force):
+        print(f"Genomics mirror rebuilt: {MIRROR_PATH}")
+
+
+if __name__ == "__main__":
+    main()
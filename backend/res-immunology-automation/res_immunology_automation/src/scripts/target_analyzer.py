@@ -11,6 +11,7 @@ from gql_variables import DiseaseAssociationQueryVariables, TargetAssociationQue
 from typing import Dict, List
 import requests
 import json
+from serialization import loads
 from tqdm import tqdm
 import pandas as pd
 from utils import get_efo_id
@@ -83,7 +84,7 @@ class TargetAnalyzer:
         variables = {"id": ensembl_id}
 
         r = requests.post(self.otp_base_url, json={"query": GetTargetUniProt, "variables": variables})
-        api_response = json.loads(r.text)
+        api_response = loads(r.content)
         if 'errors' in api_response:
             print("Error in API response:", api_response['errors'])
             return None
@@ -107,7 +108,7 @@ class TargetAnalyzer:
         """
         variables = variables.replace("{efo_id}", efo_id)
         r = requests.post(self.otp_base_url, json={"query": DiseaseDescendantsQuery, "variables": variables})
-        api_response = json.loads(r.text)
+        api_response = loads(r.content)
         return api_response['data']['disease']['descendants']
 
     def get_target_gene_map(self,target:str=None):
@@ -122,7 +123,7 @@ class TargetAnalyzer:
         print(f"varaible {variables}")
         print(f"ensemblId",{ensembl_id})
         r = requests.post(self.otp_base_url, json={"query": GeneEssentialityMapTargetQuery, "variables": variables})
-        api_response = json.loads(r.text)
+        api_response = loads(r.content)
         print(api_response)
         return api_response
     
@@ -138,7 +139,7 @@ class TargetAnalyzer:
         variables = variables.replace("sort_by", sort_by)
 
         r = requests.post(self.otp_base_url, json={"query": TargetAssociationsQuery, "variables": variables})
-        api_response = json.loads(r.text)
+        api_response = loads(r.content)
 
         return api_response
 
@@ -150,7 +151,7 @@ class TargetAnalyzer:
         variables = variables.replace("sort_by", sort_by)
 
         r = requests.post(self.otp_base_url, json={"query": DiseaseAssociationsQuery, "variables": variables})
-        api_response = json.loads(r.text)
+        api_response = loads(r.content)
 
         return api_response
 
@@ -309,7 +310,7 @@ class TargetAnalyzer:
         variables = variables.replace("{geneId}", ensembl_id)
 
         r = requests.post(self.otg_base_url, json={"query": GenePageL2GPipelineQuery, "variables": variables})
-        api_response = json.loads(r.text)
+        api_response = loads(r.content)
 
         return api_response
 
@@ -365,7 +366,7 @@ class TargetAnalyzer:
         variables = GeneOntologyVariables.replace('{ensembl_id}', ensembl_id)
 
         r = requests.post(self.otp_base_url, json={"query": GeneOntologyQuery, "variables": variables})
-        api_response = json.loads(r.text)
+        api_response = loads(r.content)
 
         return api_response
 
@@ -383,7 +384,7 @@ class TargetAnalyzer:
         variables = {"id": ensembl_id}
 
         r = requests.post(self.otp_base_url, json={"query": TargetDescriptionQuery, "variables": variables})
-        api_response = json.loads(r.text)
+        api_response = loads(r.content)
         print(api_response)
 
         if 'errors' in api_response:
@@ -408,7 +409,7 @@ class TargetAnalyzer:
         variables = {"ensemblId": ensembl_id}
 
         r = requests.post(self.otp_base_url, json={"query": MousePhenotypesQuery, "variables": variables})
-        api_response = json.loads(r.text)
+        api_response = loads(r.content)
 
         if 'errors' in api_response:
             print("Error in API response:", api_response['errors'])
@@ -449,7 +450,7 @@ class TargetAnalyzer:
         variables = TargetabilityVariables.replace('{efo_id}', efo_id).replace('{target}', target)
 
         r = requests.post(self.otp_base_url, json={"query": TargetabilityQuery, "variables": variables})
-        api_response = json.loads(r.text)
+        api_response = loads(r.content)
         if 'errors' in api_response:
             print("Error in API response:", api_response['errors'])
 
@@ -472,7 +473,7 @@ class TargetAnalyzer:
         variables = {"id": ensembl_id}
 
         r = requests.post(self.otp_base_url, json={"query": TractabilityQuery, "variables": variables})
-        api_response = json.loads(r.text)
+        api_response = loads(r.content)
         if 'errors' in api_response:
             print("Error in API response:", api_response['errors'])
 
@@ -495,7 +496,7 @@ class TargetAnalyzer:
     #     variables = {"ensemblId": ensembl_id}
 
     #     r = requests.post(self.otp_base_url, json={"query": CompGenomicsQuery, "variables": variables})
-    #     api_response = json.loads(r.text)
+    #     api_response = loads(r.content)
     #     if 'errors' in api_response:
     #         print("Error in API response:", api_response['errors'])
     #     return api_response
@@ -558,7 +559,7 @@ class TargetAnalyzer:
         variables = {"id": ensembl_id}
 
         r = requests.post(self.otp_base_url, json={"query": DifferentialRNAQuery, "variables": variables})
-        api_response = json.loads(r.text)
+        api_response = loads(r.content)
         if 'errors' in api_response:
             print("Error in API response:", api_response['errors'])
         return api_response
@@ -633,7 +634,7 @@ class TargetAnalyzer:
         variables = {"id": ensembl_id}
 
         r = requests.post(self.otp_base_url, json={"query": KnownDrugsQuery, "variables": variables})
-        api_response = json.loads(r.text)
+        api_response = loads(r.content)
         if 'errors' in api_response:
             print("Error in API response:", api_response['errors'])
         return api_response
@@ -652,7 +653,7 @@ class TargetAnalyzer:
         variables = {"ensemblId": ensembl_id}
 
         r = requests.post(self.otp_base_url, json={"query": SafetyQuery, "variables": variables})
-        api_response = json.loads(r.text)
+        api_response = loads(r.content)
         if 'errors' in api_response:
             print("Error in API response:", api_response['errors'])
         return api_response
@@ -670,7 +671,7 @@ class TargetAnalyzer:
         variables = variables.replace('{efo_id}', efo_id)
 
         r = requests.post(self.otp_base_url, json={"query": PublicationQuery, "variables": variables})
-        api_response = json.loads(r.text)
+        api_response = loads(r.content)
         if 'errors' in api_response:
             print("Error in API response:", api_response['errors'])
         return api_response
@@ -683,7 +684,7 @@ class TargetAnalyzer:
         variables = {"efoId": efo_id}
         otp_base_url = "https://api.platform.opentargets.org/api/v4/graphql"
         r = requests.post(otp_base_url, json={"query": DiseaseKnownDrugs, "variables": variables})
-        api_response = json.loads(r.text)
+        api_response = loads(r.content)
         if 'errors' in api_response:
             print("Error in API response:", api_response['errors'])
         return api_response
@@ -18,65 +18,16 @@ import html
 import os
 from component_services.evidence_services import get_network_biology_strapi
 from component_services.market_intelligence_service import get_pmids_for_nct_ids,add_outcome_status,get_indication_pipeline_strapi
-
-class CustomJSONEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, frozenset):
-            return list(obj)  # Convert frozenset to list
-        return super().default(obj)
+from component_services.cytoscape_formatter import CytoscapeGraph, get_type_from_labels
+from serialization import dump_file, load_file
 
 
 def format_for_cytoscape(query_result, node_types, edge_types):
-    nodes = {}
-    edges = {}
-
+    graph = CytoscapeGraph(node_types, edge_types, all_properties=True)
     for record in query_result:
-        # Add nodes
-        for node in node_types:
-            node_data = record[node]
-            if node_data.id not in nodes:
-                nodes[node_data.id] = {
-                    "data": {
-                        "id": str(node_data.id),
-                        "label": node_data.get("name") or node_data.get("id"),
-                        "type": get_type_from_labels(node_data.labels),
-                        "labels": node_data.labels,
-                        "properties": dict(node_data)
-                    }
-                }
-
-        # Add edges
-        for rel in edge_types:
-            rel_data = record[rel]
-            if rel_data.id not in edges:
-                prop_dict = dict(rel_data)
-                prop_dict["source"] = str(rel_data.start_node.get("name") or rel_data.start_node.get("id"))
-                prop_dict["target"] = str(rel_data.end_node.get("name") or rel_data.end_node.get("id"))
-
-                edges[rel_data.id] = {
-                    "data": {
-                        "source": str(rel_data.start_node.id),
-                        "target": str(rel_data.end_node.id),
-                        "label": rel_data.type,
-                        "properties": prop_dict
-                    }
-                }
-
-    elements = list(nodes.values()) + list(edges.values())
-
-    return elements
-
-
-def get_type_from_labels(labels) -> str:
-    node_types = {
-        "biolink:Gene": "Gene",
-        "biolink:Disease": "Disease",
-        "biolink:Pathway": "Pathway"
-    }
+        graph.add(record)
 
-    for type in node_types:
-        if type in labels:
-            return node_types[type]
+    return graph.elements()
 
 
 # def get_efo_id(disease_name: str) -> str:
@@ -226,21 +177,17 @@ def send_graphql_request(query: str, variables: Dict[str, Any]) -> Dict[str, Any
 
 def save_response_to_file(file_path: str, response: Dict):
     """ Save response to a file in JSON format """
-    with open(file_path, 'w') as file:
-        json.dump(response, file)
+    dump_file(file_path, response)
 
 
 def save_big_response_to_file(file_path: str, response: Dict):
-    """ Save response to a file in JSON format """
-    with open(file_path, 'w') as file:
-        json.dump(response, file, cls=CustomJSONEncoder)
-        file.flush()
+    """ Save response to a file in JSON format, frozensets from the Neo4j driver are written as lists """
+    dump_file(file_path, response)
 
 
 def load_response_from_file(file_path: str) -> Dict:
     """ Load response from a file in JSON format """
-    with open(file_path, 'r') as file:
-        return json.load(file)
+    return load_file(file_path)
 
 
 def add_years(date_str: str, years: int) -> str:
@@ -3,6 +3,8 @@ import json
 from pathlib import Path
 from redis import Redis
 
+from conversation_store import iter_conversations
+
 # Path to your static directory
 STATIC_DIR = Path("static")  
 
@@ -11,16 +13,7 @@ def list_conversations(redis_conn: Redis) -> list:
     Fetch all conversations from Redis.
     """
     try:
-        cursor = '0'
-        conversations = []
-        while cursor != 0:  
-            cursor, keys = redis_conn.scan(cursor=cursor, match="conversation:*")
-            for key in keys:
-                conversation_data = redis_conn.get(key)
-                if conversation_data:
-                    conversation = json.loads(conversation_data)
-                    conversations.append(conversation)
-        return conversations
+        return list(iter_conversations(redis_conn))
     except Exception as e:
         print(f"An error occurred while fetching conversations: {e}")
         return []
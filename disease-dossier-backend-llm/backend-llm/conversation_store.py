@@ -0,0 +1,239 @@
+"""
+Saved conversations.
+
+A conversation is stored as JSON at "conversation:{id}:{chat_name}". Saving it also writes its metadata (the hash
+"conversation_meta:{id}:{chat_name}", with the key of its cached summary) and indexes it in the sorted set
+"conversations:index" by update time. Conversations are listed newest first, either all of them with their chat and
+summary read in batches (`iter_conversations_with_summaries`), or a page of their metadata at a time
+(`list_conversations`), the chat and the summary then being loaded when a conversation is opened.
+
+Conversations saved before the index existed are indexed (as the oldest ones, in no particular order) by
+`index_conversations` when the server starts, until a run of it completes ("conversations:backfilled").
+"""
+import json
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from redis import Redis
+
+CONVERSATION_INDEX = "conversations:index"
+# Set once the conversations saved before the index are indexed, saves create the index before that
+CONVERSATION_BACKFILLED = "conversations:backfilled"
+INDEX_LOCK_TIMEOUT = 600
+
+
+def conversation_key(conversation_id: str, chat_name: str) -> str:
+    return f"conversation:{conversation_id}:{chat_name}"
+
+
+def _meta_key(key: str) -> str:
+    return f"conversation_meta:{key[len('conversation:'):]}"
+
+
+def _metadata(conversation: Dict[str, Any], updated_at: float, summary_key: str) -> Dict[str, str]:
+    return {
+        "id": conversation.get("id") or "",
+        "chat_name": conversation.get("chat_name") or "",
+        "selected_ctx": json.dumps(conversation.get("selected_ctx", [])),
+        "dataSource": conversation.get("dataSource") or "",
+        "messages": len(conversation.get("chat") or []),
+        "updated_at": updated_at,
+        "summary_key": summary_key,
+    }
+
+
+def _parse_metadata(meta: Dict[str, str]) -> Dict[str, Any]:
+    return {
+        "id": meta["id"],
+        "chat_name": meta["chat_name"],
+        "selected_ctx": json.loads(meta["selected_ctx"]),
+        "dataSource": meta["dataSource"] or None,
+        "messages": int(meta["messages"]),
+        "updated_at": float(meta["updated_at"]),
+    }
+
+
+def save_conversation(redis_conn: Redis, conversation: Dict[str, Any], summary_key: str):
+    """Store the conversation, its metadata and its place in the index in one transaction"""
+    key = conversation_key(conversation["id"], conversation["chat_name"])
+    updated_at = time.time()
+    pipeline = redis_conn.pipeline()
+    pipeline.set(key, json.dumps(conversation))
+    pipeline.hset(_meta_key(key), mapping=_metadata(conversation, updated_at, summary_key))
+    pipeline.zadd(CONVERSATION_INDEX, {key: updated_at})
+    pipeline.execute()
+
+
+def index_conversations(redis_conn: Redis, summary_key_for: Callable[[Dict[str, Any]], str]) -> int:
+    """
+    Index the conversations saved before the index existed, unless this was done already. Conversations saved since
+    (they have their metadata) are left as they are, the ones that can't be read are skipped.
+
+    Args:
+        summary_key_for: The key of the cached summary of a conversation.
+
+    Returns:
+        The number of conversations indexed.
+    """
+    if redis_conn.exists(CONVERSATION_BACKFILLED):
+        return 0
+    # the workers start together, one of them indexes
+    lock = redis_conn.lock(f"{CONVERSATION_INDEX}:lock", timeout=INDEX_LOCK_TIMEOUT)
+    if not lock.acquire(blocking=False):
+        return 0
+    try:
+        if redis_conn.exists(CONVERSATION_BACKFILLED):
+            return 0
+        indexed = 0
+        for keys in _scan_conversation_keys(redis_conn):
+            pipeline = redis_conn.pipeline()
+            for key in keys:
+                pipeline.exists(_meta_key(key))
+            saved = pipeline.execute()
+            keys = [key for key, has_meta in zip(keys, saved) if not has_meta]
+            if not keys:
+                continue
+            pipeline = redis_conn.pipeline()
+            for key, data in zip(keys, redis_conn.mget(keys)):
+                if not data:
+                    continue
+                try:
+                    conversation = json.loads(data)
+                except ValueError as e:
+                    print(f"Skipping conversation {key}: {e}")
+                    continue
+                if not isinstance(conversation, dict):
+                    print(f"Skipping conversation {key}: not a JSON object")
+                    continue
+                # the id and the chat name are part of the key, for entries saved without them
+                conversation_id, _, chat_name = key[len("conversation:"):].partition(":")
+                conversation = {"id": conversation_id, "chat_name": chat_name, **conversation}
+                try:
+                    summary_key = summary_key_for(conversation)
+                except Exception as e:
+                    print(f"No summary key for {key}: {e}")
+                    summary_key = ""
+                indexed += 1
+                pipeline.hset(_meta_key(key), mapping=_metadata(conversation, 0, summary_key))
+                # their update time is unknown, distinct scores older than any save keep the pages free of ties
+                pipeline.zadd(CONVERSATION_INDEX, {key: indexed}, nx=True)
+            pipeline.execute()
+        redis_conn.set(CONVERSATION_BACKFILLED, 1)
+        return indexed
+    finally:
+        lock.release()
+
+
+def _scan_conversation_keys(redis_conn: Redis) -> Iterator[List[str]]:
+    cursor = 0
+    while True:
+        cursor, keys = redis_conn.scan(cursor=cursor, match="conversation:*", count=500)
+        if keys:
+            yield keys
+        if cursor == 0:
+            return
+
+
+def list_conversations(redis_conn: Redis, cursor: Optional[str] = None, limit: int = 50
+                       ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    A page of the conversations' metadata, most recently updated first.
+
+    Args:
+        cursor (str): The cursor returned with the previous page, None for the first page.
+        limit (int): Conversations per page.
+
+    Returns:
+        The metadata of the conversations, and the cursor of the next page (None after the last page).
+
+    Raises:
+        ValueError: The cursor is not one returned by this function.
+    """
+    if cursor:
+        # the score and key of the last conversation of the previous page
+        max_score, separator, last_key = cursor.partition(":")
+        if not separator:
+            raise ValueError(f"Invalid cursor: {cursor}")
+        max_score = float(max_score)
+        # conversations with the same score come in reverse key order, skip the ones already listed
+        ties = redis_conn.zcount(CONVERSATION_INDEX, max_score, max_score)
+    else:
+        max_score, last_key, ties = "+inf", None, 0
+    entries = redis_conn.zrevrangebyscore(CONVERSATION_INDEX, max_score, "-inf", start=0, num=limit + ties + 1,
+                                          withscores=True)
+    if last_key is not None:
+        entries = [(key, score) for key, score in entries if score != max_score or key < last_key]
+    page = entries[:limit]
+
+    pipeline = redis_conn.pipeline()
+    for key, _ in page:
+        pipeline.hgetall(_meta_key(key))
+    conversations = [_parse_metadata(meta) for meta in pipeline.execute() if meta]
+
+    next_cursor = f"{page[-1][1]!r}:{page[-1][0]}" if len(entries) > limit else None
+    return conversations, next_cursor
+
+
+def _add_summary(conversation: Dict[str, Any], cached_summary: Optional[str]) -> Dict[str, Any]:
+    if cached_summary:
+        cached_summary = json.loads(cached_summary)
+        conversation["summaryPrompt"] = cached_summary.get("summary_prompt", "")
+        conversation["summaryResponse"] = cached_summary.get("summary_text", "")
+    return conversation
+
+
+def load_conversation(redis_conn: Redis, conversation_id: str, chat_name: str) -> Optional[Dict[str, Any]]:
+    """The saved conversation with its cached summary ("summaryPrompt", "summaryResponse"), None when not saved"""
+    key = conversation_key(conversation_id, chat_name)
+    pipeline = redis_conn.pipeline()
+    pipeline.get(key)
+    pipeline.hget(_meta_key(key), "summary_key")
+    data, summary_key = pipeline.execute()
+    if not data:
+        return None
+    return _add_summary(json.loads(data), redis_conn.get(summary_key) if summary_key else None)
+
+
+def _key_batches(redis_conn: Redis, batch_size: int, newest_first: bool = False) -> Iterator[List[str]]:
+    """The keys of the saved conversations, in index order once it is complete, otherwise in the SCAN order"""
+    if redis_conn.exists(CONVERSATION_BACKFILLED, CONVERSATION_INDEX) < 2:
+        yield from _scan_conversation_keys(redis_conn)
+        return
+    read = redis_conn.zrevrange if newest_first else redis_conn.zrange
+    for start in range(0, redis_conn.zcard(CONVERSATION_INDEX), batch_size):
+        keys = read(CONVERSATION_INDEX, start, start + batch_size - 1)
+        if keys:
+            yield keys
+
+
+def iter_conversations(redis_conn: Redis, batch_size: int = 100) -> Iterator[Dict[str, Any]]:
+    """All the saved conversations, read a batch (one MGET) at a time"""
+    for keys in _key_batches(redis_conn, batch_size):
+        for data in redis_conn.mget(keys):
+            if data:
+                yield json.loads(data)
+
+
+def iter_conversations_with_summaries(redis_conn: Redis, summary_key_for: Callable[[Dict[str, Any]], str],
+                                      batch_size: int = 100) -> Iterator[Dict[str, Any]]:
+    """
+    All the saved conversations with their cached summary (as `load_conversation`), most recently updated first.
+    Each batch is read with one pipeline for the conversations and their summary keys and one MGET for the summaries.
+
+    Args:
+        summary_key_for: The key of the cached summary of a conversation not indexed yet.
+    """
+    for keys in _key_batches(redis_conn, batch_size, newest_first=True):
+        pipeline = redis_conn.pipeline()
+        pipeline.mget(keys)
+        for key in keys:
+            pipeline.hget(_meta_key(key), "summary_key")
+        data, *summary_keys = pipeline.execute()
+        conversations = [(json.loads(conversation), summary_key)
+                         for conversation, summary_key in zip(data, summary_keys) if conversation]
+        conversations = [(conversation, summary_key if summary_key is not None else summary_key_for(conversation))
+                         for conversation, summary_key in conversations]
+        present = [summary_key for _, summary_key in conversations if summary_key]
+        summaries = dict(zip(present, redis_conn.mget(present))) if present else {}
+        for conversation, summary_key in conversations:
+            yield _add_summary(conversation, summaries.get(summary_key))
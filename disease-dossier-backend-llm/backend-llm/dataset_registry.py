@@ -0,0 +1,120 @@
+"""
+Registry of the datasets behind the LLM contexts.
+
+A dataset is uploaded once (POST /datasets) and stored as an uncompressed Arrow IPC file named after the SHA-256 of
+its CSV text. Contexts then reference it by that id ("dataset_id") instead of sending the CSV with every request.
+Files are memory-mapped when loaded and the DataFrames kept in a small LRU, so a dataset is parsed once, not on every
+call.
+"""
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from io import StringIO
+from typing import Any, Dict, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+DATASET_DIR = os.getenv("DATASET_DIR", "datasets")
+DATASET_CACHE_SIZE = int(os.getenv("DATASET_CACHE_SIZE", "32"))
+
+_DATASET_ID = re.compile(r"^[0-9a-f]{64}$")
+_cache: "OrderedDict[str, pd.DataFrame]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class DatasetNotFound(KeyError):
+    pass
+
+
+def dataset_id_for(csv_text: str) -> str:
+    return hashlib.sha256(csv_text.strip().encode()).hexdigest()
+
+
+def dataset_path(dataset_id: str) -> str:
+    if not _DATASET_ID.match(dataset_id):
+        raise DatasetNotFound(dataset_id)
+    return os.path.join(DATASET_DIR, f"{dataset_id}.arrow")
+
+
+def read_csv_text(csv_text: str) -> pd.DataFrame:
+    """Parse the CSV (or TSV, when it has no comma) text sent by the frontend"""
+    return pd.read_csv(StringIO(csv_text.strip()), sep="," if "," in csv_text else "\t")
+
+
+def register_dataset(csv_text: str) -> str:
+    """Store the dataset unless it already is, and return its id"""
+    dataset_id = dataset_id_for(csv_text)
+    path = dataset_path(dataset_id)
+    if not os.path.exists(path):
+        os.makedirs(DATASET_DIR, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        feather.write_feather(read_csv_text(csv_text), tmp_path, compression="uncompressed")
+        os.replace(tmp_path, path)
+    return dataset_id
+
+
+def _read_table(dataset_id: str) -> pa.Table:
+    path = dataset_path(dataset_id)
+    if not os.path.exists(path):
+        raise DatasetNotFound(dataset_id)
+    return pa.ipc.open_file(pa.memory_map(path)).read_all()
+
+
+def load_dataset(dataset_id: str) -> pd.DataFrame:
+    """
+    The DataFrame of a dataset.
+
+    The cached DataFrame is converted without copying from the memory-mapped file (its numeric columns are read only
+    views), a deep copy of it is returned so the caller can modify it in place without touching the cache.
+    """
+    with _cache_lock:
+        df = _cache.get(dataset_id)
+        if df is not None:
+            _cache.move_to_end(dataset_id)
+    if df is None:
+        df = _read_table(dataset_id).to_pandas(split_blocks=True)
+        with _cache_lock:
+            _cache[dataset_id] = df
+            while len(_cache) > DATASET_CACHE_SIZE:
+                _cache.popitem(last=False)
+    return df.copy(deep=True)
+
+
+def dataset_info(dataset_id: str) -> Dict[str, Any]:
+    table = _read_table(dataset_id)
+    return {"dataset_id": dataset_id, "rows": table.num_rows, "columns": table.column_names}
+
+
+def context_dataset_hash(context: Dict[str, Any]) -> str:
+    """The dataset id of a context without registering the dataset (the hash of the CSV it may still carry as "data")"""
+    return context.get("dataset_id") or dataset_id_for(context["data"])
+
+
+def context_dataset_id(context: Dict[str, Any]) -> str:
+    """The dataset id of a context, registering the dataset when the context still carries its CSV as "data" """
+    if context.get("dataset_id"):
+        return context["dataset_id"]
+    return register_dataset(context["data"])
+
+
+def resolve_context_datasets(context_variables: Dict[str, Dict[str, Any]]
+                             ) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, pd.DataFrame]]:
+    """
+    Load the DataFrames of the contexts.
+
+    Returns:
+        The context variables with "data" replaced by "dataset_id", and the DataFrames by name ("{context}_df").
+    """
+    resolved, dataframes = {}, {}
+    for key, value in context_variables.items():
+        if not value.get("dataset_id") and "data" not in value:
+            resolved[key] = dict(value)
+            continue
+        dataset_id = context_dataset_id(value)
+        resolved[key] = {**{k: v for k, v in value.items() if k != "data"}, "dataset_id": dataset_id}
+        dataframes[f"{key}_df"] = load_dataset(dataset_id)
+    return resolved, dataframes
@@ -1,58 +1,228 @@
-
-from langchain.chat_models import ChatOpenAI
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
+import ast
+import difflib
+import hashlib
 import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import pandas as pd
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import PromptTemplate
+from langchain_openai import ChatOpenAI
 
 api_key =os.getenv('OPENAI_API_KEY')
+ERROR_FEEDBACK_CACHE_SIZE = int(os.getenv("ERROR_FEEDBACK_CACHE_SIZE", "256"))
+
+template: str = """
+    You are a python coding assistant. You will be given a code and the output(if any errors) after execution.
+    Your job is to provide a precise and helpful feedback. The feedback should be just under 20 words.
+
+     Example 1:
+    Code:
+    adata.uns['B cells_before_vs_after_deseq2_res'].index[adata.uns['B cells_before_vs_after_deseq2_res'].pvalue < 0.05]
+
+    Python_interpreter_output:
+    KeyError: 'B cells_before_vs_after_deseq2_res'
+
+    Feedback:
+    The key error is because the key 'B cells_before_vs_after_deseq2_res' does not exist in the dictionary.
+    You can check if the key exists before accessing it using `adata.uns`
+
+    Example 2:
+    Code:
+    adata.obs.refs_harmonized.str.contains('B cells').sum()/adata.obs.n_obs.sum()
+
+    Python_interpreter_output:
+    AttributeError: 'DataFrame' object has no attribute 'n_obs'
+
+    Feedback:
+    The code is trying to calculate the percentage of B cells in the dataset.
+    However, it is encountering an error due to the absence of the 'n_obs' attribute in the DataFrame.
+
+    Code:
+    {tool_input}
+
+    Output:
+    {observation}
+
+    Feedback:
+"""
+prompt = PromptTemplate(template=template, input_variables=["tool_input", "observation"])
 
+# Modules the generated code often uses without importing them
+MODULE_ALIASES = {
+    "pd": "import pandas as pd",
+    "np": "import numpy as np",
+    "px": "import plotly.express as px",
+    "go": "import plotly.graph_objects as go",
+    "random": "import random",
+}
 
-def intelligent_interpreter(model: str, tool_input: str, observation: str) -> str:
+_chains: Dict[str, Any] = {}
+_feedback_cache: "OrderedDict[str, str]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def _get_chain(model: str):
+    """The feedback chain of the model, its client created once and reused by every call"""
+    with _lock:
+        if model not in _chains:
+            # llm = OpenAI(model_name="Mistral-7B-v0.1", openai_api_key="NULL", openai_api_base="https://aganitha-llm.own1.aganitha.ai/v1", temperature=0)
+            llm = ChatOpenAI(model=model, temperature=0, api_key=api_key)
+            _chains[model] = prompt | llm | StrOutputParser()
+        return _chains[model]
+
+
+def error_signature(observation: str) -> str:
+    """
+    The exception line of the observation without the parts that change between runs of the same error (numbers,
+    object addresses, spacing), so the feedback on an error of the same code is requested once.
+    """
+    lines = [line for line in observation.strip().splitlines() if line.strip()]
+    error_lines = [line for line in lines if re.match(r"^\w+(Error|Exception|Warning)?: ", line)]
+    signature = (error_lines or lines or [""])[-1]
+    signature = re.sub(r"0x[0-9a-fA-F]+", "0x", signature)
+    signature = re.sub(r"\d+", "N", signature)
+    return re.sub(r"\s+", " ", signature).strip()[:300]
+
+
+def _feedback_key(model: str, tool_input: str, observation: str) -> str:
+    """
+    The feedback cache key: the model, a hash of the code that failed and the error signature. The feedback explains
+    the error in that code, the same error raised by other code (another query, another session) asks for its own.
+    """
+    code_hash = hashlib.sha1(tool_input.strip().encode("utf-8")).hexdigest()
+    return f"{model}:{code_hash}:{error_signature(observation)}"
+
+
+def _parse_error(observation: str):
+    match = re.match(r"^(\w+): (.*)$", observation.strip().splitlines()[0] if observation.strip() else "")
+    return (match.group(1), match.group(2)) if match else (None, None)
+
+
+def _literal(text: str) -> Any:
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return text
+
+
+def _closest(word: str, candidates) -> list:
+    candidates = [str(candidate) for candidate in candidates]
+    same_case = [candidate for candidate in candidates if candidate.lower() == word.lower() and candidate != word]
+    return same_case or difflib.get_close_matches(word, candidates, n=3, cutoff=0.6)
+
+
+def _columns_hint(dataframes: Dict[str, pd.DataFrame]) -> str:
+    return " ".join(f"Columns of {name}: {list(df.columns)[:30]}." for name, df in list(dataframes.items())[:3])
+
+
+def rule_based_feedback(observation: str, namespace: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    """
+    Feedback on the common errors on the DataFrames (KeyError, AttributeError, NameError) from the variables of the
+    REPL, without calling the LLM.
+
+    Returns:
+        The feedback, None when no rule applies.
+    """
+    error_type, message = _parse_error(observation)
+    namespace = namespace or {}
+    dataframes = {name: value for name, value in namespace.items() if isinstance(value, pd.DataFrame)}
+    columns = {column for df in dataframes.values() for column in df.columns}
+
+    if error_type == "KeyError" and dataframes:
+        key = _literal(message)
+        if isinstance(key, int):
+            return f"There is no label {key}, use .iloc[{key}] to select by position. {_columns_hint(dataframes)}"
+        keys = [str(key)]
+        # df[[...]] with missing columns: "None of [Index([...], dtype='object')] are in the [columns]",
+        # "['...'] not in index"
+        if re.search(r"are in the \[\w+\]|not in index", str(key)):
+            keys = re.findall(r"'([^']*)'", re.sub(r"dtype='\w+'", "", str(key))) or keys
+        feedback = []
+        for missing in keys:
+            matches = _closest(missing, columns)
+            feedback.append(f"The column {missing!r} does not exist"
+                            + (f", did you mean {', '.join(map(repr, matches))}?" if matches else "."))
+        if not any("did you mean" in line for line in feedback):
+            feedback.append(_columns_hint(dataframes))
+        return " ".join(feedback)
+
+    if error_type == "AttributeError":
+        match = re.match(r"^'(\w+)' object has no attribute '(\w+)'", message)
+        if not match or match.group(1) not in ("DataFrame", "Series", "DataFrameGroupBy", "SeriesGroupBy"):
+            return None
+        object_type, attribute = match.groups()
+        column_matches = _closest(attribute, columns)
+        if column_matches:
+            return (f"{attribute!r} is not a {object_type} attribute, access the column with "
+                    f"df[{column_matches[0]!r}] instead of df.{attribute}.")
+        attribute_matches = _closest(attribute, [name for name in dir(getattr(pd, object_type, pd.DataFrame))
+                                                 if not name.startswith("_")])
+        if attribute_matches:
+            return f"{object_type} has no attribute {attribute!r}, did you mean .{attribute_matches[0]}?"
+        return f"{object_type} has no attribute {attribute!r}. {_columns_hint(dataframes)}"
+
+    if error_type == "NameError":
+        match = re.match(r"^name '(\w+)' is not defined", message)
+        if not match:
+            return None
+        name = match.group(1)
+        if name in MODULE_ALIASES:
+            return f"{name} is not imported, add `{MODULE_ALIASES[name]}` at the top of the code."
+        matches = _closest(name, [variable for variable in namespace if not variable.startswith("_")])
+        if matches:
+            return f"The variable {name!r} is not defined, did you mean {', '.join(matches)}?"
+        if dataframes:
+            return f"The variable {name!r} is not defined. The preloaded DataFrames are {', '.join(dataframes)}."
+    return None
+
+
+def _cached_feedback(signature: str) -> Optional[str]:
+    with _lock:
+        feedback = _feedback_cache.get(signature)
+        if feedback is not None:
+            _feedback_cache.move_to_end(signature)
+        return feedback
+
+
+def _cache_feedback(signature: str, feedback: str):
+    with _lock:
+        _feedback_cache[signature] = feedback
+        while len(_feedback_cache) > ERROR_FEEDBACK_CACHE_SIZE:
+            _feedback_cache.popitem(last=False)
+
+
+def intelligent_interpreter(model: str, tool_input: str, observation: str,
+                            namespace: Optional[Dict[str, Any]] = None) -> str:
     """
         This method receives the observation from the python tool if there's any error in code execution.
-        It then sends the error to "gpt-3.5-turbo" and gets a feed back on the error.
+        It answers common DataFrame errors from the variables of the REPL (`namespace`), otherwise sends the error to
+        `model` once per code and error signature and gets a feed back on the error.
         The purpose is to give a nice precise and detailed feedback back to GPT-4.
     """
+    feedback = rule_based_feedback(observation, namespace)
+    if feedback is not None:
+        return feedback
+    signature = _feedback_key(model, tool_input, observation)
+    feedback = _cached_feedback(signature)
+    if feedback is None:
+        feedback = _get_chain(model).invoke({'tool_input': tool_input, 'observation': observation})
+        _cache_feedback(signature, feedback)
+    return feedback
+
 
-    template: str = """
-        You are a python coding assistant. You will be given a code and the output(if any errors) after execution. 
-        Your job is to provide a precise and helpful feedback. The feedback should be just under 20 words.
-        
-         Example 1:
-        Code:
-        adata.uns['B cells_before_vs_after_deseq2_res'].index[adata.uns['B cells_before_vs_after_deseq2_res'].pvalue < 0.05]
-
-        Python_interpreter_output:
-        KeyError: 'B cells_before_vs_after_deseq2_res'
-
-        Feedback:
-        The key error is because the key 'B cells_before_vs_after_deseq2_res' does not exist in the dictionary.
-        You can check if the key exists before accessing it using `adata.uns`
-
-        Example 2:
-        Code:
-        adata.obs.refs_harmonized.str.contains('B cells').sum()/adata.obs.n_obs.sum()
-        
-        Python_interpreter_output:
-        AttributeError: 'DataFrame' object has no attribute 'n_obs'
-
-        Feedback:
-        The code is trying to calculate the percentage of B cells in the dataset. 
-        However, it is encountering an error due to the absence of the 'n_obs' attribute in the DataFrame.
-
-        Code:
-        {tool_input}
-
-        Output:
-        {observation}
-
-        Feedback:
-    """
-    prompt = PromptTemplate(template=template, input_variables=["tool_input", "observation"])
-    # llm = OpenAI(model_name="Mistral-7B-v0.1", openai_api_key="NULL", openai_api_base="https://aganitha-llm.own1.aganitha.ai/v1", temperature=0)
-    llm = ChatOpenAI(model_name=model, temperature=0, openai_api_key=api_key)
-    # print("Hello")
-    llm_chain = LLMChain(prompt=prompt, llm=llm)
-    intelligent_observation = llm_chain.run({'tool_input': tool_input, 'observation': observation})
-    # print(observation)
-    return intelligent_observation
+async def aintelligent_interpreter(model: str, tool_input: str, observation: str,
+                                   namespace: Optional[Dict[str, Any]] = None) -> str:
+    """`intelligent_interpreter` awaiting the LLM"""
+    feedback = rule_based_feedback(observation, namespace)
+    if feedback is not None:
+        return feedback
+    signature = _feedback_key(model, tool_input, observation)
+    feedback = _cached_feedback(signature)
+    if feedback is None:
+        feedback = await _get_chain(model).ainvoke({'tool_input': tool_input, 'observation': observation})
+        _cache_feedback(signature, feedback)
+    return feedback
@@ -4,9 +4,10 @@ import ast
 import asyncio
 import re
 import sys
-from contextlib import redirect_stdout
+import threading
+from contextlib import contextmanager
 from io import StringIO
-from typing import Any, Dict, Optional, Type
+from typing import Any, Dict, Optional, Tuple, Type
 import logging
 
 # Configure logging
@@ -22,13 +23,55 @@ from langchain.tools.base import BaseTool
 
 from langchain_experimental.utilities.python import PythonREPL
 
-from intelligent_interpreter import intelligent_interpreter
+from intelligent_interpreter import aintelligent_interpreter, intelligent_interpreter
 
 
 
 
 
 
+class _ThreadStdout:
+    """
+    sys.stdout writing to the buffer of the REPL execution running in the current thread, or to the real stdout.
+    Agent runs execute their code concurrently in executor threads, `contextlib.redirect_stdout` would swap the
+    process-wide sys.stdout under all of them.
+    """
+
+    def __init__(self, stdout):
+        self._stdout = stdout
+        self._local = threading.local()
+
+    def _target(self):
+        return getattr(self._local, "buffer", None) or self._stdout
+
+    def write(self, text: str) -> int:
+        return self._target().write(text)
+
+    def flush(self):
+        self._target().flush()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._target(), name)
+
+
+_install_lock = threading.Lock()
+
+
+@contextmanager
+def _capture_stdout(buffer: StringIO):
+    """Send what the current thread prints to `buffer`"""
+    with _install_lock:
+        if not isinstance(sys.stdout, _ThreadStdout):
+            sys.stdout = _ThreadStdout(sys.stdout)
+        stdout = sys.stdout
+    previous = getattr(stdout._local, "buffer", None)
+    stdout._local.buffer = buffer
+    try:
+        yield buffer
+    finally:
+        stdout._local.buffer = previous
+
+
 def _get_default_python_repl() -> PythonREPL:
     return PythonREPL(_globals=globals(), _locals=None)
 
@@ -120,13 +163,8 @@ class PythonAstREPLTool(BaseTool):
             )
         return values
 
-    def _run(
-            self,
-            query: str,
-            run_manager: Optional[CallbackManagerForToolRun] = None,
-    ) -> str:
-        """Use the tool."""
-        logger.info(f"PythonAstREPLTool _run called with query##############################: {query}")
+    def _execute(self, query: str) -> Tuple[Any, Optional[Exception]]:
+        """Run the code, returns its output (the value of its last expression or what it printed) or the exception"""
         try:
             if self.sanitize_input:
                 query = sanitize_input(query)
@@ -137,70 +175,43 @@ class PythonAstREPLTool(BaseTool):
             module_end_str = ast.unparse(module_end)  # type: ignore
             io_buffer = StringIO()
             try:
-                with redirect_stdout(io_buffer):
+                with _capture_stdout(io_buffer):
                     ret = eval(module_end_str, self.globals, self.locals)
-                    if ret is None:
-                        output = io_buffer.getvalue()
-                        if "Error" in str(output):
-                            intelligent_output = intelligent_interpreter("gpt-3.5-turbo", query, output)
-                            output = output + "\n" + intelligent_output
-                        if "SyntaxError" in str(output):
-                            output = output + " " + "Action Input should be a valid python code."
-                        if len(str(output)) == 0:
-                            output = "Code executed successfully"
-                        # Calculate the number of tokens using tiktokens
-                        # encoding = tiktoken.get_encoding("cl100k_base") # From openai cookbook #https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
-                        # num_tokens = len(encoding.encode(str(output)))
-                        # if num_tokens > 100:
-                        #     output = """The length of the output of your Action Input is too long. All the values are stored in the variables that you declared in your Action Input and are available. Take the next step as specified in the output format(Thought, Action, Action Input and Final Answer)"""
-                        return output
-                    else:
-                        output = ret
-                        if "Error" in str(output):
-                            intelligent_output = intelligent_interpreter("gpt-3.5-turbo", query, output)
-                            output = output + "\n" + intelligent_output
-                        if "SyntaxError" in str(output):
-                            output = output + " " + "Action Input should be a valid python code."
-                        if len(str(output)) == 0:
-                            output = "Code executed successfully."
-                        # Calculate the number of tokens using tiktokens
-                        # encoding = tiktoken.get_encoding("cl100k_base") # From openai cookbook #https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
-                        # num_tokens = len(encoding.encode(str(output)))
-                        # if num_tokens > 100:
-                        #     output = """The length of the output of your Action Input is too long. All the values are stored in the variables that you declared in your Action Input and are available. Take the next step as specified in the output format(Thought, Action, Action Input and Final Answer)"""
-                        return output
+                    output = io_buffer.getvalue() if ret is None else ret
             except Exception:
-                with redirect_stdout(io_buffer):
+                with _capture_stdout(io_buffer):
                     exec(module_end_str, self.globals, self.locals)
                     output = io_buffer.getvalue()
-                    if "Error" in str(output):
-                        intelligent_output = intelligent_interpreter("gpt-3.5-turbo", query, output)
-                        output = output + "\n" + intelligent_output
-                    if "SyntaxError" in str(output):
-                        output = output + " " + "Action Input should be a valid python code."
-                    if len(str(output)) == 0:
-                        output = "Code executed successfully."
-                    # Calculate the number of tokens using tiktokens
-                    # encoding = tiktoken.get_encoding("cl100k_base") # From openai cookbook #https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
-                    # num_tokens = len(encoding.encode(str(output)))
-                    # if num_tokens > 100:
-                    #     output = """The length of the output of your Action Input is too long. All the values are stored in the variables that you declared in your Action Input and are available. Take the next step as specified in the output format(Thought, Action, Action Input and Final Answer)"""
-                return output
-        except Exception as e:
-            output = "{}: {}".format(type(e).__name__, str(e))
-            if "Error" in str(output):
-                intelligent_output = intelligent_interpreter("gpt-3.5-turbo", query, output)
-                output = output + "\n" + intelligent_output
-            if "SyntaxError" in str(output):
-                output = output + " " + "Action Input should be a valid python code."
             if len(str(output)) == 0:
-                output = "Code executed successfully"
+                output = "Code executed successfully."
             # Calculate the number of tokens using tiktokens
             # encoding = tiktoken.get_encoding("cl100k_base") # From openai cookbook #https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
             # num_tokens = len(encoding.encode(str(output)))
-            # if num_tokens > 1000:
+            # if num_tokens > 100:
             #     output = """The length of the output of your Action Input is too long. All the values are stored in the variables that you declared in your Action Input and are available. Take the next step as specified in the output format(Thought, Action, Action Input and Final Answer)"""
+            return output, None
+        except Exception as e:
+            return "{}: {}".format(type(e).__name__, str(e)), e
+
+    def _error_output(self, output: str, error: Exception, feedback: str) -> str:
+        output = output + "\n" + feedback
+        if isinstance(error, SyntaxError):
+            output = output + " " + "Action Input should be a valid python code."
+        return output
+
+    def _run(
+            self,
+            query: str,
+            run_manager: Optional[CallbackManagerForToolRun] = None,
+    ) -> str:
+        """Use the tool."""
+        logger.info(f"PythonAstREPLTool _run called with query##############################: {query}")
+        output, error = self._execute(query)
+        if error is None:
+            # the output of code that ran, even when it mentions an "Error", needs no feedback
             return output
+        feedback = intelligent_interpreter("gpt-3.5-turbo", query, output, namespace={**self.globals, **self.locals})
+        return self._error_output(output, error, feedback)
 
     async def _arun(
             self,
@@ -210,6 +221,9 @@ class PythonAstREPLTool(BaseTool):
         """Use the tool asynchronously."""
         logger.info(f"PythonAstREPLTool _run called with query##############################2: {query}")
         loop = asyncio.get_running_loop()
-        result = await loop.run_in_executor(None, self._run, query)
-
-        return result
\ No newline at end of file
+        output, error = await loop.run_in_executor(None, self._execute, query)
+        if error is None:
+            return output
+        feedback = await aintelligent_interpreter("gpt-3.5-turbo", query, output,
+                                                  namespace={**self.globals, **self.locals})
+        return self._error_output(output, error, feedback)
@@ -0,0 +1,159 @@
+"""
+Conversation state of each chat session: the datasets of its contexts and its chat history.
+
+Clients identify their session with the X-Session-Id header or the session cookie. Requests with neither get a new
+session from `issue_session_id`, sent back in the cookie (which browsers then send with the next requests) and in the
+X-Session-Id header. The state is persisted in Redis, so any worker can serve any session, and the deserialized
+states are kept in an in-process LRU, revalidated against the version stored in Redis. A session is updated under a
+per-session lock held across the workers (a Redis lock, plus an asyncio lock so the requests of one worker queue
+without polling Redis).
+"""
+import asyncio
+import json
+import os
+import uuid
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field, replace
+from typing import Dict, List, Optional
+
+import anyio
+from fastapi import Header, Request
+from fastapi.concurrency import run_in_threadpool
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from redis import Redis
+from redis.exceptions import LockError
+
+from dataset_registry import load_dataset
+
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "256"))
+SESSION_TTL = int(os.getenv("SESSION_TTL", str(7 * 24 * 3600)))
+SESSION_HISTORY_LENGTH = int(os.getenv("SESSION_HISTORY_LENGTH", "20"))
+# A session lock expires after SESSION_LOCK_TIMEOUT seconds (a crashed worker), requests wait for it
+# SESSION_LOCK_WAIT seconds at most
+SESSION_LOCK_TIMEOUT = int(os.getenv("SESSION_LOCK_TIMEOUT", "600"))
+SESSION_LOCK_WAIT = int(os.getenv("SESSION_LOCK_WAIT", "300"))
+SESSION_COOKIE = "llm_session_id"
+
+
+class SessionBusy(Exception):
+    pass
+
+
+async def issue_session_id(request: Request, call_next):
+    """
+    HTTP middleware giving the requests without a session id a new session, returned in the session cookie and the
+    X-Session-Id header.
+    """
+    if request.headers.get("x-session-id") or request.cookies.get(SESSION_COOKIE):
+        return await call_next(request)
+    request.state.session_id = uuid.uuid4().hex
+    response = await call_next(request)
+    response.headers["X-Session-Id"] = request.state.session_id
+    response.set_cookie(SESSION_COOKIE, request.state.session_id, max_age=SESSION_TTL, httponly=True, samesite="lax")
+    return response
+
+
+def get_session_id(request: Request, x_session_id: Optional[str] = Header(None)) -> str:
+    return x_session_id or request.cookies.get(SESSION_COOKIE) or request.state.session_id
+
+
+@dataclass
+class SessionState:
+    session_id: str
+    # DataFrame name ("{context}_df") -> dataset id in the registry
+    dataset_ids: Dict[str, str] = field(default_factory=dict)
+    chat_history: List[BaseMessage] = field(default_factory=list)
+    version: int = 0
+
+    @property
+    def dataframes(self):
+        return {name: load_dataset(dataset_id) for name, dataset_id in self.dataset_ids.items()}
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "dataset_ids": self.dataset_ids,
+            "chat_history": [{"role": "user" if isinstance(message, HumanMessage) else "assistant",
+                              "content": message.content}
+                             for message in self.chat_history[-SESSION_HISTORY_LENGTH:]],
+        })
+
+    @classmethod
+    def from_json(cls, session_id: str, data: str, version: int) -> "SessionState":
+        state = json.loads(data)
+        return cls(session_id=session_id, dataset_ids=state["dataset_ids"], version=version,
+                   chat_history=[HumanMessage(content=message["content"]) if message["role"] == "user"
+                                 else AIMessage(content=message["content"]) for message in state["chat_history"]])
+
+
+class SessionStore:
+    def __init__(self, max_sessions: int = SESSION_CACHE_SIZE):
+        self.max_sessions = max_sessions
+        self._states: "OrderedDict[str, SessionState]" = OrderedDict()
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    @staticmethod
+    def _key(session_id: str) -> str:
+        return f"llm_session:{session_id}"
+
+    def _cache(self, state: SessionState):
+        self._states[state.session_id] = state
+        self._states.move_to_end(state.session_id)
+        while len(self._states) > self.max_sessions:
+            session_id, _ = self._states.popitem(last=False)
+            lock = self._locks.get(session_id)
+            if lock is not None and not lock.locked():
+                del self._locks[session_id]
+
+    def _load(self, session_id: str, redis_conn: Redis) -> SessionState:
+        """The session state, from the LRU when Redis still has the same version"""
+        key = self._key(session_id)
+        version = redis_conn.hget(key, "version")
+        if version is None:
+            return SessionState(session_id=session_id)
+        cached = self._states.get(session_id)
+        if cached is not None and cached.version == int(version):
+            # a copy, the cached state only changes once saved
+            return replace(cached, dataset_ids=dict(cached.dataset_ids), chat_history=list(cached.chat_history))
+        data, version = redis_conn.hmget(key, ["state", "version"])
+        return SessionState.from_json(session_id, data, int(version))
+
+    def _save(self, state: SessionState, redis_conn: Redis):
+        key = self._key(state.session_id)
+        state.version += 1
+        state.chat_history = state.chat_history[-SESSION_HISTORY_LENGTH:]
+        pipeline = redis_conn.pipeline()
+        pipeline.hset(key, mapping={"state": state.to_json(), "version": state.version})
+        pipeline.expire(key, SESSION_TTL)
+        pipeline.execute()
+        self._cache(state)
+
+    @asynccontextmanager
+    async def session(self, session_id: str, redis_conn: Redis):
+        """
+        Lock the session and yield its state, saved when the block exits without an exception.
+
+        Raises:
+            SessionBusy: The session stayed locked (by another request) for SESSION_LOCK_WAIT seconds.
+        """
+        lock = self._locks.setdefault(session_id, asyncio.Lock())
+        async with lock:
+            redis_lock = redis_conn.lock(f"llm_session_lock:{session_id}", timeout=SESSION_LOCK_TIMEOUT,
+                                         blocking_timeout=SESSION_LOCK_WAIT)
+            if not await run_in_threadpool(redis_lock.acquire):
+                raise SessionBusy(session_id)
+            try:
+                state = await run_in_threadpool(self._load, session_id, redis_conn)
+                yield state
+                await run_in_threadpool(self._save, state, redis_conn)
+            finally:
+                # shielded, a cancelled request (a streaming client disconnecting) would otherwise leave the session
+                # locked until the lock expires
+                with anyio.CancelScope(shield=True):
+                    try:
+                        await run_in_threadpool(redis_lock.release)
+                    except LockError as e:
+                        print(f"Session lock of {session_id} expired before its release: {e}")
+
+
+sessions = SessionStore()